@@ -1,160 +1,422 @@
 import os
 import sys
-import noisereduce as nr
 import soundfile as sf
-import tempfile
-import subprocess
-import librosa
-from elevenlabs import clone, voices, set_api_key
-import requests
+import io
 import json
+import time
+import argparse
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
 from dotenv import load_dotenv
 import traceback
+from worker_client import request_worker_job
+import tts_cache
+import noise_reduction
+import speech_activity
+import voice_registry
+import upload_fingerprints
+import phrase_bank
+import upstream
+import telemetry
+import clone_queue
+import batch_jobs
+
+log = telemetry.get_logger("clone")
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Fetch the ElevenLabs API key from an environment variable
 API_KEY = os.getenv("ELEVENLABS_API_KEY")
-if not API_KEY:
-    print("Error: ELEVENLABS_API_KEY environment variable not set.", file=sys.stderr)
-    sys.exit(1)
-set_api_key(API_KEY)
-
-def validate_audio_file(input_path: str) -> bool:
-    """Validate if the input file is a valid audio file using ffprobe."""
-    print(f"Validating file format for: {input_path}")
-    command = ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_streams", input_path]
-    try:
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if result.returncode != 0:
-            print(f"FFprobe error: {result.stderr}", file=sys.stderr)
-            return False
-        stream_info = json.loads(result.stdout)
-        return any(stream["codec_type"] == "audio" for stream in stream_info.get("streams", []))
-    except Exception as e:
-        print(f"Error validating audio file: {str(e)}", file=sys.stderr)
-        return False
 
-def convert_audio_to_wav(input_path: str) -> str:
-    print(f"Converting {input_path} to WAV format")
-    output_path = tempfile.mktemp(suffix=".wav")
-    command = ["ffmpeg", "-y", "-i", input_path, "-ar", "16000", "-ac", "1", output_path]
+TARGET_SAMPLE_RATE = 16000
+# Uploads are only ever read from here, whatever directory the caller passes
+UPLOADS_DIR = os.getenv("VOICE_UPLOADS_DIR", "/app/uploads")
+# Container for the denoised clip uploaded to ElevenLabs: WAV or FLAC (about half the bytes)
+CLONE_UPLOAD_FORMAT = os.getenv("CLONE_UPLOAD_FORMAT", "WAV").upper()
+
+def require_api_key():
+    """Exit with an error when the ElevenLabs API key is missing; checked once the arguments are known to be valid."""
+    if not API_KEY:
+        print("Error: ELEVENLABS_API_KEY environment variable not set.", file=sys.stderr)
+        sys.exit(1)
+
+def resolve_upload_path(input_audio_path: str) -> str:
+    return os.path.join(UPLOADS_DIR, os.path.basename(input_audio_path))
+
+def warm_up():
+    """Import the lazily loaded audio stack and run a tiny resample and noise reduction, so the first real job pays no setup cost."""
+    import librosa
+    require_api_key()
+    upstream.start()
+    silence = np.zeros(16000, dtype=np.float32)
+    librosa.resample(silence, orig_sr=44100, target_sr=TARGET_SAMPLE_RATE)
+    noise_reduction.reduce_noise_single(silence, 16000)
+
+def decode_audio_with_ffmpeg(input_path: str, target_sr: int = TARGET_SAMPLE_RATE):
+    """Fallback decoder for formats libsndfile cannot read: ffmpeg writes WAV to a pipe, never to disk."""
+    log.debug(f"Decoding {input_path} with ffmpeg fallback")
+    command = ["ffmpeg", "-v", "error", "-i", input_path, "-ar", str(target_sr), "-ac", "1", "-f", "wav", "pipe:1"]
+    with telemetry.span("ffmpeg_decode", bytes_in=os.path.getsize(input_path)) as ffmpeg_span:
+        try:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise ValueError(f"Invalid audio file format: {input_path} (unsupported by libsndfile and ffmpeg is not installed)")
+        if result.returncode != 0 or not result.stdout:
+            stderr = result.stderr.decode("utf-8", errors="replace")
+            log.error(f"FFmpeg error: {stderr}")
+            raise ValueError(f"Invalid audio file format: {input_path}: {stderr}")
+        audio_data, sample_rate = sf.read(io.BytesIO(result.stdout), dtype="float32")
+        ffmpeg_span.set(audio_seconds=round(len(audio_data) / sample_rate, 3))
+    return audio_data, sample_rate
+
+def decode_audio(input_path: str, target_sr: int = TARGET_SAMPLE_RATE):
+    """
+    Probe, decode, downmix and resample an upload in one pass, in memory.
+
+    libsndfile handles WAV/FLAC/OGG/MP3 directly; anything it rejects goes through
+    decode_audio_with_ffmpeg. Returns (float32 mono samples, sample_rate).
+    """
+    with telemetry.span("decode", bytes_in=os.path.getsize(input_path)) as decode_span:
+        try:
+            info = sf.info(input_path)
+            log.debug(f"Probed {input_path}: {info.format} {info.subtype}, {info.samplerate} Hz, {info.channels} ch, {info.duration:.1f}s")
+            audio_data, sample_rate = sf.read(input_path, dtype="float32", always_2d=True)
+            audio_data = audio_data.mean(axis=1)
+        except (sf.LibsndfileError, RuntimeError) as e:
+            log.warning(f"In-process decode failed ({str(e)}), falling back to ffmpeg")
+            audio_data, sample_rate = decode_audio_with_ffmpeg(input_path, target_sr)
+
+        if audio_data.size == 0:
+            raise ValueError(f"Invalid audio file format: {input_path} contains no audio samples")
+        decode_span.set(audio_seconds=round(len(audio_data) / sample_rate, 3))
+        if sample_rate != target_sr:
+            import librosa  # heavy; only uploads that need resampling pay for it
+            audio_data = librosa.resample(audio_data, orig_sr=sample_rate, target_sr=target_sr)
+    return np.ascontiguousarray(audio_data, dtype=np.float32), target_sr
+
+def encode_audio(audio_data, sample_rate: int, audio_format: str = CLONE_UPLOAD_FORMAT) -> bytes:
+    """Encode samples into an in-memory WAV or FLAC file for upload."""
+    with telemetry.span("encode", audio_seconds=round(len(audio_data) / sample_rate, 3)) as encode_span:
+        buffer = io.BytesIO()
+        sf.write(buffer, audio_data, sample_rate, format=audio_format, subtype="PCM_16")
+        encode_span.set(bytes_out=buffer.tell())
+    return buffer.getvalue()
+
+def clone_voice_from_buffer(name: str, description: str, audio_bytes: bytes, audio_format: str = CLONE_UPLOAD_FORMAT) -> str:
+    """Create an ElevenLabs instant voice clone from in-memory audio and return its voice_id."""
+    filename = f"{name}.{audio_format.lower()}"
+    mime_type = "audio/flac" if audio_format.upper() == "FLAC" else "audio/wav"
+    with telemetry.span("clone_upload", bytes_in=len(audio_bytes)):
+        return upstream.run_with_retries(lambda: upstream.add_voice(name, description, filename, audio_bytes, mime_type),
+                                         description="Voice clone upload")
+
+def _forget_voice(voice_id: str):
+    tts_cache.invalidate_voice(voice_id)
+    voice_registry.remove(voice_id)
+
+def delete_voice_by_id(voice_id: str, clone_name: str = None):
+    """
+    Delete a voice. With clone_name, only that name's claim is dropped, and the
+    voice itself stays while other clone names still refer to it.
+    """
+    if clone_name is not None:
+        still_used_by = voice_registry.remove_name(voice_id, clone_name)
+        if still_used_by:
+            log.info(f"Keeping voice {voice_id} for {still_used_by}; dropped '{clone_name}'")
+            return
+    log.info(f"Deleting voice with ID: {voice_id}")
     try:
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if result.returncode != 0:
-            print(f"FFmpeg error: {result.stderr}", file=sys.stderr)
-            raise RuntimeError(f"Failed to convert audio to WAV: {result.stderr}")
-        if not os.path.exists(output_path):
-            raise RuntimeError(f"WAV file was not created: {output_path}")
-        print(f"Converted to WAV: {output_path}")
-        return output_path
+        if upstream.run(upstream.delete_voice(voice_id)):
+            log.info(f"Deleted voice ID: {voice_id}")
+            _forget_voice(voice_id)
     except Exception as e:
-        print(f"Error converting audio: {str(e)}", file=sys.stderr)
+        log.error(f"Error deleting voice: {str(e)}")
         raise
 
-def delete_voice_by_id(voice_id: str):
-    print(f"Deleting voice with ID: {voice_id}")
-    url = f"https://api.elevenlabs.io/v1/voices/{voice_id}"
-    headers = {
-        "xi-api-key": API_KEY,
-        "accept": "application/json"
-    }
+def delete_voices_by_id(voice_ids):
+    """Delete several voices concurrently; returns the ids that were deleted."""
+    log.info(f"Deleting voices: {voice_ids}")
+    results = upstream.run(upstream.delete_voices(list(voice_ids)))
+    deleted = [voice_id for voice_id, ok in results.items() if ok]
+    for voice_id in deleted:
+        _forget_voice(voice_id)
+    log.info(f"Deleted {len(deleted)} of {len(results)} voices")
+    return deleted
+
+def list_remote_voices():
+    """Fetch the account's voices for registry syncs."""
+    return [{"voice_id": v["voice_id"], "name": v.get("name"), "category": v.get("category")}
+            for v in upstream.run_with_retries(upstream.list_voices, description="Voice list")]
+
+def load_user_data(user_data_file):
+    """The personalization data in user_data_file, or None (with a warning) when it cannot be read."""
     try:
-        response = requests.delete(url, headers=headers)
-        if response.status_code == 204:
-            print(f"Deleted voice ID: {voice_id}")
-        else:
-            print(f"Failed to delete voice ID: {voice_id}, Status: {response.status_code}, Message: {response.text}", file=sys.stderr)
-    except Exception as e:
-        print(f"Error deleting voice: {str(e)}", file=sys.stderr)
-        raise
+        with open(user_data_file, "r") as f:
+            raw_user_data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        log.warning(f"Skipping phrase bank: could not read {user_data_file}: {str(e)}")
+        return None
+    if not isinstance(raw_user_data, dict):
+        log.warning(f"Skipping phrase bank: {user_data_file} does not hold a JSON object")
+        return None
+    return raw_user_data
+
+def warm_phrase_bank(voice_id, raw_user_data):
+    """Start pre-synthesizing the persona's stock phrases for the voice in the background."""
+    phrase_bank.schedule_build(voice_id, raw_user_data)
 
 def remove_noise_and_clone_voice(input_audio_path, clone_name):
-    print(f"Step 1: Starting process for: {input_audio_path}, clone_name: {clone_name}")
+    """Clone (or reuse) the voice in an upload; every stage is timed by telemetry."""
+    with telemetry.trace("clone", clone_name=clone_name) as job:
+        voice_id = _clone(input_audio_path, clone_name)
+        job["voice_id"] = voice_id
+        return voice_id
+
+def _select_and_denoise(audio_data, sample_rate, fingerprint, raw_hash, clone_name):
+    """Keep the best speech, reduce its noise and store the result under the fingerprint."""
+    # Keep only the best speech so denoising and upload scale with usable audio
+    log.debug("Step 5: Selecting speech segments")
+    decoded_audio = audio_data
+    with telemetry.span("vad", audio_seconds=round(len(decoded_audio) / sample_rate, 3)) as vad_span:
+        audio_data, speech_report = speech_activity.select_speech(decoded_audio, sample_rate)
+        vad_span.set(kept_seconds=round(len(audio_data) / sample_rate, 3))
+    log.debug(f"Speech selection: {speech_report}")
+
+    log.debug(f"Step 6: Reducing noise ({noise_reduction.NOISE_REDUCTION_MODE})")
+    with telemetry.span("noise_reduction", audio_seconds=round(len(audio_data) / sample_rate, 3),
+                        mode=noise_reduction.NOISE_REDUCTION_MODE):
+        reduced_noise_audio = noise_reduction.reduce_noise(audio_data, sample_rate, noise_source=decoded_audio)
+    del decoded_audio, audio_data
+    upload_fingerprints.store(fingerprint, raw_hash, reduced_noise_audio, sample_rate,
+                              clone_name=clone_name, speech_report=speech_report)
+    return reduced_noise_audio
+
+def _clone(input_audio_path, clone_name):
+    log.debug(f"Step 1: Starting process for: {input_audio_path}, clone_name: {clone_name}")
     description = "a person talking"
 
     try:
         # Step 2: Resolve absolute path
-        input_audio_path = os.path.join('/app/uploads', os.path.basename(input_audio_path))
-        print(f"Step 2: Resolved absolute path: {input_audio_path}")
+        input_audio_path = resolve_upload_path(input_audio_path)
+        log.debug(f"Step 2: Resolved absolute path: {input_audio_path}")
 
         # Step 3: Check if input audio file exists
         if not os.path.exists(input_audio_path):
             raise FileNotFoundError(f"Input audio file not found: {input_audio_path}")
 
-        # Step 4: Validate audio file format
-        print("Step 3: Validating audio file format")
-        if not validate_audio_file(input_audio_path):
-            raise ValueError(f"Invalid audio file format: {input_audio_path}")
-
-        # Step 5: Convert to WAV
-        print("Step 4: Converting audio to .wav format")
-        converted_wav_path = convert_audio_to_wav(input_audio_path)
-
-        # Step 6: Load and process
-        print("Step 5: Loading WAV audio with librosa")
-        audio_data, sample_rate = librosa.load(converted_wav_path, sr=16000, mono=True)
-        print(f"Loaded: sample_rate={sample_rate}, shape={audio_data.shape}")
-
-        # Step 7: Reduce noise
-        print("Step 6: Reducing noise")
-        reduced_noise_audio = nr.reduce_noise(y=audio_data, sr=sample_rate, stationary=True, prop_decrease=0.75)
-
-        # Step 8: Save noise-reduced to temp file
-        print("Step 7: Saving noise-reduced audio")
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-            sf.write(tmp_file.name, reduced_noise_audio, sample_rate)
-            tmp_file_path = tmp_file.name
-        print(f"Saved noise-reduced audio to: {tmp_file_path}")
-
-        # Step 9: Reuse voice if already exists
-        print("Step 8: Checking for existing voice")
-        existing = [v for v in voices() if v.name == clone_name]
-        if existing:
-            print(f"Voice with name '{clone_name}' already exists. Reusing ID: {existing[0].voice_id}")
-            os.remove(tmp_file_path)
-            os.remove(converted_wav_path)
-            return existing[0].voice_id
-
-        # Step 10: Check limit and delete all old voices if full
-        print("Step 9: Checking voice limit")
-        all_voices = voices()
-        if len(all_voices) >= 30:
-            print("Voice limit reached. Deleting all previous voices...")
-            for v in all_voices:
-                delete_voice_by_id(v.voice_id)
+        # Step 4: Reuse voice if already exists (answered by the local registry, synced on a TTL)
+        log.debug("Step 3: Checking for existing voice")
+        voice_registry.sync(list_remote_voices)
+        existing_voice_id = voice_registry.find_by_name(clone_name)
+        if existing_voice_id:
+            log.info(f"Voice with name '{clone_name}' already exists. Reusing ID: {existing_voice_id}")
+            return existing_voice_id
 
-        # Step 11: Clone
-        print("Step 10: Cloning voice...")
-        voice = clone(name=clone_name, description=description, files=[tmp_file_path])
-        print(f"Voice cloned successfully, ID: {voice.voice_id}")
+        # Step 5: Identify the recording: raw-bytes index first, decoded PCM fingerprint otherwise
+        log.debug("Step 4: Looking up upload fingerprint")
+        started = time.monotonic()
+        with telemetry.span("file_hash", bytes_in=os.path.getsize(input_audio_path)):
+            raw_hash = upload_fingerprints.file_hash(input_audio_path)
+            fingerprint = upload_fingerprints.lookup_raw(raw_hash)
+        audio_data = None
+        if fingerprint is None:
+            log.debug("Step 4.1: Decoding audio in-process")
+            audio_data, sample_rate = decode_audio(input_audio_path)
+            fingerprint = upload_fingerprints.pcm_fingerprint(audio_data)
+            log.debug(f"Loaded: sample_rate={sample_rate}, shape={audio_data.shape}")
+
+        # Step 6: Same audio seen before: reuse its voice, or at least its denoised audio
+        meta = upload_fingerprints.load(fingerprint)
+        denoised = None
+        if meta:
+            upload_fingerprints.index_raw(raw_hash, fingerprint)
+            reused_voice_id = meta.get("voice_id")
+            if not voice_registry.contains(reused_voice_id):
+                reused_voice_id = voice_registry.find_by_audio_hash(fingerprint)
+            # Register the new name on the reused voice, so later lookups by name find it
+            # and deleting the voice for one name does not take it from the other
+            if reused_voice_id and voice_registry.add_name(reused_voice_id, clone_name):
+                telemetry.cache_event("upload_fingerprint", "hit")
+                upload_fingerprints.log_decision(upload_fingerprints.HIT, clone_name=clone_name, fingerprint=fingerprint,
+                                                 voice_id=reused_voice_id, seconds=round(time.monotonic() - started, 3))
+                log.info(f"Recording already cloned as {reused_voice_id}. Reusing it for '{clone_name}'")
+                return reused_voice_id
+            denoised = upload_fingerprints.load_denoised(fingerprint)
+
+        telemetry.cache_event("upload_fingerprint", "partial" if denoised is not None else "miss")
+        if denoised is not None:
+            decision = upload_fingerprints.PARTIAL
+            reduced_noise_audio, sample_rate = denoised
+            log.debug("Step 5: Reusing stored noise-reduced audio")
+        else:
+            decision = upload_fingerprints.MISS
+            if audio_data is None:
+                log.debug("Step 4.1: Decoding audio in-process")
+                audio_data, sample_rate = decode_audio(input_audio_path)
 
-        # Step 12: Clean up
-        print("Step 11: Cleaning up temporary files")
-        os.remove(tmp_file_path)
-        os.remove(converted_wav_path)
-        return voice.voice_id
+            # Steps 7-8: Speech selection and noise reduction
+            reduced_noise_audio = _select_and_denoise(audio_data, sample_rate, fingerprint, raw_hash, clone_name)
+            del audio_data
+
+        # Step 9: Encode noise-reduced audio for upload without touching disk
+        log.debug("Step 7: Encoding noise-reduced audio")
+        upload_bytes = encode_audio(reduced_noise_audio, sample_rate)
+        log.debug(f"Encoded noise-reduced audio: {len(upload_bytes)} bytes ({CLONE_UPLOAD_FORMAT})")
+
+        # Step 10: At the voice limit, evict only the least recently used voice(s)
+        log.debug("Step 8: Checking voice limit")
+        with telemetry.span("make_room"):
+            reservation = voice_registry.make_room(delete_voices_by_id)
+
+        # Step 11: Clone
+        log.debug("Step 9: Cloning voice...")
+        try:
+            voice_id = clone_voice_from_buffer(clone_name, description, upload_bytes)
+        except Exception:
+            voice_registry.release(reservation)
+            raise
+        voice_registry.register(voice_id, clone_name, fingerprint, reservation=reservation)
+        upload_fingerprints.update(fingerprint, voice_id=voice_id)
+        upload_fingerprints.log_decision(decision, clone_name=clone_name, fingerprint=fingerprint,
+                                         voice_id=voice_id, seconds=round(time.monotonic() - started, 3))
+        log.info(f"Voice cloned successfully, ID: {voice_id}")
+        return voice_id
 
     except Exception as e:
-        print(f"Error in remove_noise_and_clone_voice: {str(e)}\n{traceback.format_exc()}", file=sys.stderr)
-        if 'converted_wav_path' in locals() and os.path.exists(converted_wav_path):
-            os.remove(converted_wav_path)
-        if 'tmp_file_path' in locals() and os.path.exists(tmp_file_path):
-            os.remove(tmp_file_path)
+        log.error(f"Error in remove_noise_and_clone_voice: {str(e)}\n{traceback.format_exc()}")
         raise
 
+def clone_voice_job(input_audio_path, clone_name, raw_user_data=None):
+    """
+    Clone through the job queue, so duplicate requests for the same name and upload
+    share one run. raw_user_data is kept with the job for its phrase bank. Returns
+    the finished job state; raises when the job failed.
+    """
+    job = clone_queue.clone(resolve_upload_path(input_audio_path), clone_name, remove_noise_and_clone_voice,
+                            raw_user_data)
+    if job["status"] != clone_queue.SUCCEEDED:
+        raise clone_queue.CloneJobError(f"Clone job {job['job_id']} failed: {job['error']}")
+    return job
+
+def preprocess_upload(input_audio_path, clone_name):
+    """
+    The CPU half of a clone, run in a process pool by batch runs: decode, select speech
+    and denoise an upload into the fingerprint store, so the clone that follows only
+    encodes and uploads. Returns "reused" when the voice or denoised audio already
+    exists, otherwise "denoised".
+    """
+    with telemetry.trace("clone_preprocess", clone_name=clone_name):
+        input_audio_path = resolve_upload_path(input_audio_path)
+        if not os.path.exists(input_audio_path):
+            raise FileNotFoundError(f"Input audio file not found: {input_audio_path}")
+        if voice_registry.find_by_name(clone_name):
+            return "reused"
+        with telemetry.span("file_hash", bytes_in=os.path.getsize(input_audio_path)):
+            raw_hash = upload_fingerprints.file_hash(input_audio_path)
+            fingerprint = upload_fingerprints.lookup_raw(raw_hash)
+        if upload_fingerprints.has_denoised(fingerprint):
+            return "reused"
+        audio_data, sample_rate = decode_audio(input_audio_path)
+        fingerprint = upload_fingerprints.pcm_fingerprint(audio_data)
+        if upload_fingerprints.has_denoised(fingerprint):
+            upload_fingerprints.index_raw(raw_hash, fingerprint)
+            return "reused"
+        _select_and_denoise(audio_data, sample_rate, fingerprint, raw_hash, clone_name)
+        return "denoised"
+
+def _clone_batch_job(batch, job_id, job, preprocessed):
+    try:
+        raw_user_data = load_user_data(job["user_data_file"]) if job.get("user_data_file") else None
+        clone_job = clone_voice_job(job["input_audio_path"], job["clone_name"], raw_user_data)
+    except Exception as e:
+        batch.record(job_id, job, batch_jobs.FAILED, stage="clone", error=str(e))
+        return
+    if raw_user_data is not None:
+        warm_phrase_bank(clone_job["voice_id"], raw_user_data)
+    batch.record(job_id, job, batch_jobs.OK, voice_id=clone_job["voice_id"], clone_job_id=clone_job["job_id"],
+                 preprocessed=preprocessed)
+
+def run_batch(argv):
+    """
+    Clone every job in a manifest of {"input_audio_path", "clone_name", "user_data_file"?}.
+
+    Decoding, speech selection and denoising run across a process pool; each finished
+    upload moves on to a thread pool whose clones go through the job queue and the
+    shared upstream engine, which bounds concurrent ElevenLabs calls. See batch_jobs
+    for results and resuming.
+    """
+    parser = argparse.ArgumentParser(prog="audio_cloning.py --batch", description="Clone the voices in a manifest")
+    parser.add_argument("manifest", help="JSON lines (or a JSON array) of clone jobs")
+    parser.add_argument("--results-dir", help="Per-job result files; defaults to <manifest>.results")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Processes for decoding and denoising")
+    parser.add_argument("--concurrency", type=int, default=4, help="Clones uploading at once")
+    args = parser.parse_args(argv)
+
+    require_api_key()
+    batch = batch_jobs.BatchRun(args.manifest, args.results_dir, required=("input_audio_path", "clone_name"))
+    if not batch.pending:
+        return batch.finish()
+    voice_registry.sync(list_remote_voices)
+    phrase_bank.enable_in_process_builds()
+    if not upload_fingerprints.CACHE_ENABLED:
+        # Preprocessed audio could not be handed over; every clone does its own CPU work
+        log.warning("Upload fingerprint cache disabled: running whole clones without the process pool")
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as clone_pool:
+            for job_id, job in batch.pending:
+                clone_pool.submit(_clone_batch_job, batch, job_id, job, None)
+        return batch.finish()
+
+    # Parallelism comes from the pool; each upload is denoised on a single core
+    os.environ["NOISE_REDUCTION_WORKERS"] = "1"
+    with ProcessPoolExecutor(max_workers=max(1, args.processes), mp_context=multiprocessing.get_context("spawn")) as cpu_pool, \
+            ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as clone_pool:
+        futures = {cpu_pool.submit(preprocess_upload, job["input_audio_path"], job["clone_name"]): (job_id, job)
+                   for job_id, job in batch.pending}
+        for future in as_completed(futures):
+            job_id, job = futures[future]
+            try:
+                preprocessed = future.result()
+            except Exception as e:
+                batch.record(job_id, job, batch_jobs.FAILED, stage="preprocess", error=str(e))
+                continue
+            clone_pool.submit(_clone_batch_job, batch, job_id, job, preprocessed)
+    return batch.finish()
+
 if __name__ == "__main__":
-    print(f"Args: {sys.argv}")
-    if len(sys.argv) != 3:
-        print("Usage: python audio_cloning.py <input_audio_path> <clone_name>", file=sys.stderr)
+    if sys.argv[1:2] == ["--batch"]:
+        sys.exit(run_batch(sys.argv[2:]))
+
+    log.debug(f"Args: {sys.argv}")
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python audio_cloning.py <input_audio_path> <clone_name> [<user_data_file>]", file=sys.stderr)
+        print("       python audio_cloning.py --batch <manifest> [--processes N] [--concurrency N] [--results-dir DIR]",
+              file=sys.stderr)
         sys.exit(1)
 
     input_audio_path = sys.argv[1]
     clone_name = sys.argv[2]
+    # Cheap checks first, so bad requests fail before any API or audio work
+    if not os.path.exists(resolve_upload_path(input_audio_path)):
+        print(f"Execution failed: Input audio file not found: {resolve_upload_path(input_audio_path)}", file=sys.stderr)
+        sys.exit(1)
+    require_api_key()
+    # Read now: Node deletes the file once this process exits, and a resumed job still needs it
+    raw_user_data = load_user_data(sys.argv[3]) if len(sys.argv) == 4 else None
 
     try:
-        voice_id = remove_noise_and_clone_voice(input_audio_path, clone_name)
+        # Hand the job to the warm worker when one is running; otherwise run it here.
+        worker_result = request_worker_job("clone", {"input_audio_path": input_audio_path, "clone_name": clone_name,
+                                                     "user_data": raw_user_data})
+        if worker_result is not None:
+            voice_id = worker_result["voice_id"]
+        else:
+            voice_id = clone_voice_job(input_audio_path, clone_name, raw_user_data)["voice_id"]
+            if raw_user_data is not None:
+                warm_phrase_bank(voice_id, raw_user_data)
         print(f"Cloned voice ID: {voice_id}")
         sys.stdout.flush()
     except Exception as e:
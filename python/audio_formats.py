@@ -0,0 +1,174 @@
+import io
+import os
+import struct
+
+# Output encodings for generated replies.
+#
+# A talk reply used to be whatever ElevenLabs returned for mp3_44100_128, about
+# 16 KB per second of speech. TALK_OUTPUT_FORMAT (or the job's output_format)
+# picks one of the formats below. Formats ElevenLabs produces itself are
+# requested directly and passed through; the others are requested as raw PCM
+# and finished in process from memory:
+#
+#   name            requested from ElevenLabs   delivered as
+#   mp3_44100_128   mp3_44100_128               MP3 as returned (default)
+#   mp3_44100_64    mp3_44100_64                MP3 as returned
+#   mp3_22050_32    mp3_22050_32                MP3 as returned
+#   pcm_<rate>      pcm_<rate>                  16-bit mono WAV, header added here
+#   opus_<rate>     pcm_<rate>                  Ogg/Opus, encoded here with soundfile
+#
+# The TTS cache and phrase bank hold the upstream bytes, so formats that share
+# an upstream format (pcm_24000 and opus_24000) share cached speech too.
+# Streamed replies are encoded by StreamEncoder: MP3 passes through chunk by
+# chunk, WAV gets its header up front and Opus is encoded once the last sentence
+# has arrived. A streamed WAV header has unknown sizes; they are patched at the
+# end when the output can seek, and otherwise the real header is handed back
+# (unpatched_header) for the result frame, so the receiver can overwrite the
+# first WAV_HEADER_BYTES.
+
+DEFAULT_OUTPUT_FORMAT = os.getenv("TALK_OUTPUT_FORMAT", "mp3_44100_128")
+
+# name: (upstream output_format, container, file extension, MIME type)
+FORMATS = {
+    "mp3_44100_128": ("mp3_44100_128", "mp3", ".mp3", "audio/mpeg"),
+    "mp3_44100_64": ("mp3_44100_64", "mp3", ".mp3", "audio/mpeg"),
+    "mp3_22050_32": ("mp3_22050_32", "mp3", ".mp3", "audio/mpeg"),
+    "pcm_16000": ("pcm_16000", "wav", ".wav", "audio/wav"),
+    "pcm_22050": ("pcm_22050", "wav", ".wav", "audio/wav"),
+    "pcm_24000": ("pcm_24000", "wav", ".wav", "audio/wav"),
+    "pcm_44100": ("pcm_44100", "wav", ".wav", "audio/wav"),
+    "opus_16000": ("pcm_16000", "opus", ".ogg", "audio/ogg"),
+    "opus_24000": ("pcm_24000", "opus", ".ogg", "audio/ogg"),
+}
+
+PCM_SAMPLE_BYTES = 2
+# RIFF and data chunk sizes of a WAV whose length is not known yet
+UNKNOWN_WAV_SIZE = 0xFFFFFFFF
+WAV_HEADER_BYTES = 44
+
+
+def resolve(name: str = None) -> str:
+    """The format to use for name (None means TALK_OUTPUT_FORMAT); raises ValueError for unknown names."""
+    name = name or DEFAULT_OUTPUT_FORMAT
+    if name not in FORMATS:
+        raise ValueError(f"Unknown output format {name!r}; expected one of {', '.join(FORMATS)}")
+    return name
+
+
+def upstream_format(name: str) -> str:
+    return FORMATS[name][0]
+
+
+def extension(name: str) -> str:
+    return FORMATS[name][2]
+
+
+def mime_type(name: str) -> str:
+    return FORMATS[name][3]
+
+
+def conflicting_extension(path: str, name: str) -> bool:
+    """Whether path carries another format's extension (e.g. reply.wav for opus_24000)."""
+    path_extension = os.path.splitext(path)[1].lower()
+    return path_extension != extension(name) and path_extension in {details[2] for details in FORMATS.values()}
+
+
+def _sample_rate(upstream: str) -> int:
+    return int(upstream.split("_")[1])
+
+
+def duration_seconds(name: str, upstream_audio_bytes: int) -> float:
+    """Seconds of speech in upstream_audio_bytes bytes of the format's upstream audio."""
+    upstream = upstream_format(name)
+    if upstream.startswith("pcm_"):
+        return upstream_audio_bytes / (_sample_rate(upstream) * PCM_SAMPLE_BYTES)
+    # ElevenLabs MP3 is constant bitrate: mp3_<rate>_<kbps>
+    return upstream_audio_bytes * 8 / (int(upstream.split("_")[2]) * 1000)
+
+
+def _wav_header(sample_rate: int, data_bytes: int) -> bytes:
+    riff_size = UNKNOWN_WAV_SIZE if data_bytes == UNKNOWN_WAV_SIZE else 36 + data_bytes
+    return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", riff_size, b"WAVE", b"fmt ", 16, 1, 1, sample_rate,
+                       sample_rate * PCM_SAMPLE_BYTES, PCM_SAMPLE_BYTES, 8 * PCM_SAMPLE_BYTES, b"data", data_bytes)
+
+
+def _encode_opus(pcm: bytes, sample_rate: int) -> bytes:
+    import numpy as np
+    import soundfile as sf
+    samples = np.frombuffer(pcm[:len(pcm) - len(pcm) % PCM_SAMPLE_BYTES], dtype="<i2")
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format="OGG", subtype="OPUS")
+    return buffer.getvalue()
+
+
+def encode(name: str, audio: bytes) -> bytes:
+    """Turn a whole reply in the format's upstream encoding into the delivered file."""
+    upstream, container = FORMATS[name][:2]
+    if container == "wav":
+        return _wav_header(_sample_rate(upstream), len(audio)) + audio
+    if container == "opus":
+        return _encode_opus(audio, _sample_rate(upstream))
+    return audio
+
+
+def describe(name: str, output_bytes: int, seconds: float) -> dict:
+    """Format details and delivered bytes per second of speech, for results and telemetry."""
+    return {
+        "output_format": name,
+        "extension": extension(name),
+        "mime_type": mime_type(name),
+        "bytes": output_bytes,
+        "seconds": round(seconds, 3),
+        "bytes_per_second": round(output_bytes / seconds) if seconds else None,
+    }
+
+
+class StreamEncoder:
+    """Writes upstream audio chunks to output as the format's file while a reply streams in."""
+
+    def __init__(self, name: str, output):
+        self.name = name
+        self.output = output
+        self.upstream, self.container = FORMATS[name][:2]
+        self.upstream_bytes = 0
+        self.bytes_written = 0
+        self._pending = []
+        self._header_at = None
+        # The final WAV header, when it could not be written over the streamed one
+        self.unpatched_header = None
+        if self.container == "wav":
+            try:
+                self._header_at = output.tell()
+            except (AttributeError, OSError):
+                pass
+            self._emit(_wav_header(_sample_rate(self.upstream), UNKNOWN_WAV_SIZE))
+
+    def _emit(self, data: bytes):
+        self.output.write(data)
+        self.bytes_written += len(data)
+
+    def write(self, chunk: bytes):
+        self.upstream_bytes += len(chunk)
+        if self.container == "opus":
+            self._pending.append(chunk)
+            return
+        self._emit(chunk)
+        self.output.flush()
+
+    def close(self):
+        if self.container == "opus":
+            self._emit(encode(self.name, b"".join(self._pending)))
+            self._pending = []
+        elif self.container == "wav":
+            header = _wav_header(_sample_rate(self.upstream), self.upstream_bytes)
+            if self._header_at is not None and self.output.seekable():
+                end = self.output.tell()
+                self.output.seek(self._header_at)
+                self.output.write(header)
+                self.output.seek(end)
+            else:
+                self.unpatched_header = header
+        self.output.flush()
+
+    def seconds(self) -> float:
+        return duration_seconds(self.name, self.upstream_bytes)
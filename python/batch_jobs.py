@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+# Manifest-driven batch runs for backfills: re-cloning recordings after a
+# voice-limit wipe or an account migration, and regenerating stock phrases.
+#
+#   python audio_cloning.py --batch clones.jsonl
+#   python generate_ai_response.py --batch phrases.jsonl
+#
+# A manifest holds one JSON job per line (a JSON array works too). Every job
+# gets an id, its "id" field or else a hash of the job itself, and one result
+# file:
+#
+#   <results dir>/<id>.json     {"id", "status": "ok" | "failed", "job", ..., "finished_at"}
+#   <results dir>/summary.json  counts and wall time of the last run
+#
+# The result files are the checkpoint: running the same manifest again skips
+# jobs whose result is ok and retries the rest, so an interrupted backfill
+# resumes where it stopped. The results directory defaults to the manifest
+# path with ".results" in place of its extension.
+
+OK = "ok"
+FAILED = "failed"
+
+
+def load_manifest(path: str):
+    """[(job_id, job)] in manifest order; repeated jobs (same id) are kept once."""
+    with open(path, "r") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        documents = json.loads(text)
+    else:
+        documents = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                documents.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{number}: invalid JSON: {str(e)}")
+    jobs = {}
+    for job in documents:
+        if not isinstance(job, dict):
+            raise ValueError(f"{path}: every job must be a JSON object, got {job!r}")
+        job_id = str(job.get("id") or hashlib.sha256(json.dumps(job, sort_keys=True).encode("utf-8")).hexdigest()[:16])
+        jobs.setdefault(job_id, job)
+    return list(jobs.items())
+
+
+def default_results_dir(manifest_path: str) -> str:
+    return os.path.splitext(manifest_path)[0] + ".results"
+
+
+def _write_json(path: str, document: dict):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(document, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class BatchRun:
+    """One pass over a manifest: the jobs still to do, and their results as they finish."""
+
+    def __init__(self, manifest_path: str, results_dir: str = None, required=()):
+        self.manifest_path = manifest_path
+        self.results_dir = results_dir or default_results_dir(manifest_path)
+        os.makedirs(self.results_dir, exist_ok=True)
+        self.jobs = load_manifest(manifest_path)
+        self.started = time.monotonic()
+        self.counts = {OK: 0, FAILED: 0, "skipped": 0}
+        self._lock = threading.Lock()
+
+        self.pending = []
+        for job_id, job in self.jobs:
+            previous = self.result(job_id)
+            if previous is not None and previous.get("status") == OK:
+                self.counts["skipped"] += 1
+                continue
+            missing = [key for key in required if not job.get(key)]
+            if missing:
+                self.record(job_id, job, FAILED, error=f"Missing job fields: {', '.join(missing)}")
+                continue
+            self.pending.append((job_id, job))
+        print(f"Batch {manifest_path}: {len(self.jobs)} jobs, {self.counts['skipped']} already done, "
+              f"{len(self.pending)} to run (results in {self.results_dir})", file=sys.stderr)
+
+    def _result_path(self, job_id: str) -> str:
+        safe_id = "".join(c if c.isalnum() or c in "-_." else "_" for c in job_id)
+        return os.path.join(self.results_dir, f"{safe_id}.json")
+
+    def result(self, job_id: str):
+        try:
+            with open(self._result_path(job_id), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def record(self, job_id: str, job: dict, status: str, **fields):
+        """Write a job's result file; safe to call from any thread."""
+        _write_json(self._result_path(job_id), {"id": job_id, "status": status, "job": job, **fields,
+                                                "finished_at": time.time()})
+        with self._lock:
+            self.counts[status] += 1
+            done = self.counts[OK] + self.counts[FAILED]
+        detail = fields.get("error") if status == FAILED else ""
+        print(f"[{done}/{len(self.jobs) - self.counts['skipped']}] {status} {job_id} {detail}".rstrip(), file=sys.stderr)
+
+    def finish(self) -> int:
+        """Write summary.json and return the exit status: 1 when any job failed."""
+        summary = {
+            "manifest": os.path.abspath(self.manifest_path),
+            "jobs": len(self.jobs),
+            **self.counts,
+            "wall_seconds": round(time.monotonic() - self.started, 3),
+        }
+        _write_json(os.path.join(self.results_dir, "summary.json"), summary)
+        print(json.dumps(summary))
+        return 1 if self.counts[FAILED] else 0
@@ -0,0 +1,300 @@
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-ins for the OpenAI and ElevenLabs endpoints the pipelines call,
+# so benchmarks cost nothing and do not depend on provider latency.
+#
+#   POST   /v1/chat/completions                  plain and streamed (SSE), with usage
+#   POST   /v1/text-to-speech/<voice_id>         audio sized by the text length
+#   POST   /v1/text-to-speech/<voice_id>/stream  the same audio, chunked
+#   GET    /v1/voices
+#   POST   /v1/voices/add                        returns a new voice_id
+#   DELETE /v1/voices/<voice_id>
+#
+# Every request waits latency +/- jitter before answering and fails with a 500
+# at error_rate. Streams pace their chunks by token_delay / chunk_delay. Point
+# OPENAI_BASE_URL and ELEVEN_BASE_URL at <url>/v1 to use it.
+
+DEFAULT_CONFIG = {
+    "latency": 0.05,           # seconds before the first byte of every response
+    "jitter": 0.02,            # +/- uniform seconds added to latency
+    "error_rate": 0.0,         # share of requests answered with a 500
+    "token_delay": 0.01,       # seconds between streamed chat deltas
+    "token_chars": 8,          # characters per streamed chat delta
+    "chunk_bytes": 4096,       # bytes per streamed TTS chunk
+    "chunk_delay": 0.005,      # seconds between streamed TTS chunks
+    "audio_bytes_per_char": 1000,  # roughly mp3_44100_128 at a normal speaking rate
+    "clone_latency": 0.5,      # extra seconds for /voices/add
+    "seed_voices": 3,          # voices the account already has
+}
+
+REPLY_SENTENCES = (
+    "Hello my dear, it is so good to hear from you today.",
+    "I was just thinking about our favorite song and the way you used to hum it.",
+    "Remember to take a little time for yourself this week.",
+    "Take care of yourself, sweetheart, and call me again soon.",
+)
+
+VOICE_PATH = re.compile(r"^/v1/voices/([^/?]+)")
+TTS_PATH = re.compile(r"^/v1/text-to-speech/([^/?]+)(/stream)?")
+
+
+class _State:
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.random = random.Random(config.get("seed", 0))
+        self.replies = 0
+        self.voices = {f"SEEDVOICE{index:011d}": f"seed-{index}" for index in range(config["seed_voices"])}
+        self.next_voice = 0
+        self.requests = {}
+
+    def count(self, endpoint, failed=False):
+        with self.lock:
+            counters = self.requests.setdefault(endpoint, {"requests": 0, "errors": 0})
+            counters["requests"] += 1
+            counters["errors"] += int(failed)
+
+    def delay(self, extra=0.0):
+        with self.lock:
+            jitter = self.random.uniform(-self.config["jitter"], self.config["jitter"])
+        time.sleep(max(0.0, self.config["latency"] + jitter + extra))
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.config["error_rate"]
+
+    def reply_text(self):
+        # Every reply is different so the TTS cache does not hide synthesis cost
+        with self.lock:
+            self.replies += 1
+            number = self.replies
+        return f"{' '.join(REPLY_SENTENCES)} This is reply number {number}."
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body=b"", content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, document, status=200):
+        self._send(status, json.dumps(document).encode("utf-8"))
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _fail_maybe(self, endpoint):
+        if self.state.should_fail():
+            self.state.count(endpoint, failed=True)
+            self._send_json({"error": {"message": "injected failure", "type": "server_error"}}, status=500)
+            return True
+        self.state.count(endpoint)
+        return False
+
+    def do_POST(self):
+        body = self._read_body()
+        path = self.path
+        if path.startswith("/v1/chat/completions"):
+            self.state.delay()
+            if not self._fail_maybe("chat"):
+                self._chat(json.loads(body))
+            return
+        match = TTS_PATH.match(path)
+        if match:
+            endpoint = "tts_stream" if match.group(2) else "tts"
+            self.state.delay()
+            if not self._fail_maybe(endpoint):
+                self._tts(json.loads(body)["text"], stream=bool(match.group(2)))
+            return
+        if path.startswith("/v1/voices/add"):
+            self.state.delay(self.state.config["clone_latency"])
+            if not self._fail_maybe("voices_add"):
+                with self.state.lock:
+                    voice_id = f"BENCHVOICE{self.state.next_voice:010d}"
+                    self.state.next_voice += 1
+                    self.state.voices[voice_id] = voice_id
+                self._send_json({"voice_id": voice_id})
+            return
+        self._send(404)
+
+    def do_GET(self):
+        if self.path.startswith("/v1/voices"):
+            self.state.delay()
+            if not self._fail_maybe("voices"):
+                with self.state.lock:
+                    voices = [{"voice_id": voice_id, "name": name, "category": "cloned"}
+                              for voice_id, name in self.state.voices.items()]
+                self._send_json({"voices": voices})
+            return
+        self._send(404)
+
+    def do_DELETE(self):
+        self._read_body()
+        match = VOICE_PATH.match(self.path)
+        if not match:
+            self._send(404)
+            return
+        self.state.delay()
+        if not self._fail_maybe("voices_delete"):
+            with self.state.lock:
+                self.state.voices.pop(match.group(1), None)
+            self._send_json({"status": "ok"})
+
+    def _chat(self, request):
+        text = self.state.reply_text()
+        if not request.get("stream"):
+            self._send_json({
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+                "model": request.get("model", "bench"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 400, "completion_tokens": len(text) // 4,
+                          "total_tokens": 400 + len(text) // 4},
+            })
+            return
+
+        config = self.state.config
+        self._start_chunked("text/event-stream")
+        step = config["token_chars"]
+        for start in range(0, len(text), step):
+            chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+                     "choices": [{"index": 0, "delta": {"content": text[start:start + step]}, "finish_reason": None}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            time.sleep(config["token_delay"])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            usage = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+                     "choices": [], "usage": {"prompt_tokens": 400, "completion_tokens": len(text) // 4,
+                                              "total_tokens": 400 + len(text) // 4}}
+            self._write_chunk(f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_chunked()
+
+    def _tts(self, text, stream):
+        config = self.state.config
+        audio = (b"\xff\xfb" + text.encode("utf-8")) * max(1, config["audio_bytes_per_char"])
+        audio = audio[:len(text) * config["audio_bytes_per_char"]]
+        if not stream:
+            self._send(200, audio, content_type="audio/mpeg")
+            return
+        self._start_chunked("audio/mpeg")
+        for start in range(0, len(audio), config["chunk_bytes"]):
+            self._write_chunk(audio[start:start + config["chunk_bytes"]])
+            time.sleep(config["chunk_delay"])
+        self._end_chunked()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class FakeUpstream:
+    """Runs the stand-in server on a background thread; use as a context manager."""
+
+    def __init__(self, host="127.0.0.1", port=0, **config):
+        self.config = {**DEFAULT_CONFIG, **config}
+        self.state = _State(self.config)
+        handler = type("Handler", (_Handler,), {"state": self.state})
+        self.server = _Server((host, port), handler)
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> dict:
+        """Environment that points the pipelines at this server."""
+        return {
+            "OPENAI_BASE_URL": f"{self.url}/v1",
+            "ELEVEN_BASE_URL": f"{self.url}/v1",
+            "OPENAI_API_KEY": "bench",
+            "ELEVENLABS_API_KEY": "bench",
+        }
+
+    def stats(self) -> dict:
+        with self.state.lock:
+            return {endpoint: dict(counters) for endpoint, counters in self.state.requests.items()}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-upstream", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.stop()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Options shared by this script and run_bench.py."""
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_CONFIG["latency"] * 1000)
+    parser.add_argument("--jitter-ms", type=float, default=DEFAULT_CONFIG["jitter"] * 1000)
+    parser.add_argument("--error-rate", type=float, default=DEFAULT_CONFIG["error_rate"])
+    parser.add_argument("--token-delay-ms", type=float, default=DEFAULT_CONFIG["token_delay"] * 1000)
+    parser.add_argument("--chunk-bytes", type=int, default=DEFAULT_CONFIG["chunk_bytes"])
+    parser.add_argument("--chunk-delay-ms", type=float, default=DEFAULT_CONFIG["chunk_delay"] * 1000)
+    parser.add_argument("--clone-latency-ms", type=float, default=DEFAULT_CONFIG["clone_latency"] * 1000)
+
+
+def config_from_arguments(args) -> dict:
+    return {
+        "latency": args.latency_ms / 1000,
+        "jitter": args.jitter_ms / 1000,
+        "error_rate": args.error_rate,
+        "token_delay": args.token_delay_ms / 1000,
+        "chunk_bytes": args.chunk_bytes,
+        "chunk_delay": args.chunk_delay_ms / 1000,
+        "clone_latency": args.clone_latency_ms / 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI/ElevenLabs server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    fake = FakeUpstream(args.host, args.port, **config_from_arguments(args))
+    print(f"Fake upstream listening on {fake.url}; set OPENAI_BASE_URL and ELEVEN_BASE_URL to {fake.url}/v1",
+          file=sys.stderr)
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
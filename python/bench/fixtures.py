@@ -0,0 +1,60 @@
+import os
+import sys
+import numpy as np
+import soundfile as sf
+
+# Synthetic voice recordings for the cloning benchmarks.
+#
+# Real uploads cannot be shipped, so fixtures are generated deterministically
+# from a seed: a voiced, harmonic "speaker" with a wandering pitch, syllable
+# envelopes and pauses between phrases, over room noise and mains hum. That
+# gives VAD, noise reduction and encoding realistic work to do. The same seed
+# always produces the same bytes; different seeds give different fingerprints.
+
+SAMPLE_RATE = 44100
+# Typical short, medium and long uploads
+FIXTURE_SECONDS = (15, 60, 180)
+
+
+def synthetic_speech(seconds: float, seed: int = 0, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate)
+    t = np.arange(total) / sample_rate
+
+    # Phrases of 1.5-4s separated by 0.3-1.2s pauses
+    voiced = np.zeros(total, dtype=np.float32)
+    position = int(rng.uniform(0.3, 1.0) * sample_rate)
+    while position < total:
+        length = int(rng.uniform(1.5, 4.0) * sample_rate)
+        voiced[position:position + length] = 1.0
+        position += length + int(rng.uniform(0.3, 1.2) * sample_rate)
+
+    # Syllables at ~4 Hz and a pitch contour around a per-speaker base
+    syllables = 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(3.5, 5.0) * t + rng.uniform(0, np.pi)) ** 2
+    base_pitch = rng.uniform(100, 220)
+    pitch = base_pitch * (1 + 0.08 * np.sin(2 * np.pi * 0.3 * t) + 0.03 * np.sin(2 * np.pi * 1.7 * t))
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voice = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 9))
+    voice = (voice * syllables * voiced).astype(np.float32)
+
+    noise = rng.normal(0, 0.02, total).astype(np.float32)
+    hum = 0.01 * np.sin(2 * np.pi * 50 * t).astype(np.float32)
+    audio = 0.3 * voice / (np.abs(voice).max() or 1.0) + noise + hum
+    return np.clip(audio, -1.0, 1.0).astype(np.float32)
+
+
+def write_fixture(directory: str, seconds: float, seed: int = 0, audio_format: str = "WAV") -> str:
+    """Write one fixture (reusing an existing file) and return its path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"bench-{int(seconds)}s-{seed}.{audio_format.lower()}")
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        sf.write(tmp_path, synthetic_speech(seconds, seed), SAMPLE_RATE, format=audio_format, subtype="PCM_16")
+        os.replace(tmp_path, path)
+    return path
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else "fixtures"
+    for fixture_seconds in FIXTURE_SECONDS:
+        print(write_fixture(target, fixture_seconds))
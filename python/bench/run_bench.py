@@ -0,0 +1,401 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import fake_upstream
+import fixtures
+
+# Benchmarks for the talk and clone pipelines against local fake upstreams.
+#
+#   python bench/run_bench.py                                  # all scenarios
+#   python bench/run_bench.py --scenarios talk,talk_stream --concurrency 1,16
+#   python bench/run_bench.py --output new.json --baseline old.json
+#
+# Scenarios:
+#   cold_start   import time of each pipeline and one full `--stdin` talk job in
+#                a fresh interpreter, as the Node routes pay it without a worker
+#   talk         generate_ai_response_and_convert_to_audio, whole-reply TTS
+#   talk_stream  the same with sentence-by-sentence streaming
+#   clone        remove_noise_and_clone_voice on synthetic uploads of several lengths
+#   noise_reduction  chunked against single-shot noise reduction on each fixture
+#                length; output below noise_reduction.EQUIVALENCE_MIN_SNR_DB
+#                from single-shot is reported as a regression on its own
+#
+# talk/clone scenarios run once per --concurrency level, each in a fresh child
+# process (so peak RSS is per scenario), after one untimed warm-up job. Every job
+# uses a distinct input so the reply, TTS and fingerprint caches stay cold.
+# The report records p50/p95/p99 latency, time to first audio, throughput and
+# peak RSS; with --baseline, metrics that got worse by more than --tolerance are
+# listed and the exit status is 1.
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("cold_start", "talk", "talk_stream", "clone", "noise_reduction")
+# Differences smaller than this are noise whatever the relative change
+MIN_SECONDS_DELTA = 0.005
+
+USER_DATA = {
+    "lovedOneName": "Grandma Rose",
+    "nicknameForUser": "Sunshine",
+    "favoriteSong": "You Are My Sunshine",
+    "favoriteTopic": "gardening",
+    "distinctGreeting": "Hello there, Sunshine!",
+    "distinctGoodbye": "Sleep tight, Sunshine.",
+    "userBirthday": "2001-04-12",
+    "lovedOneBirthday": "1941-09-30",
+    "signaturePhrase": "Every day is a gift.",
+}
+# Lower is better for every metric except these
+HIGHER_IS_BETTER = {"throughput_per_second"}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, prefix=""):
+    return {
+        f"{prefix}p50_seconds": percentile(latencies, 0.50),
+        f"{prefix}p95_seconds": percentile(latencies, 0.95),
+        f"{prefix}p99_seconds": percentile(latencies, 0.99),
+    }
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+# Child side: runs inside a fresh interpreter with the environment set up by the parent
+
+class _TimedSink:
+    """Output for a talk job that notes when the first audio byte arrived."""
+
+    def __init__(self, started):
+        self.started = started
+        self.first_audio = None
+        self.bytes_written = 0
+
+    def write(self, data):
+        if self.first_audio is None and data:
+            self.first_audio = time.monotonic() - self.started
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def _run_jobs(job, count, concurrency):
+    """Run job(index) count times at the given concurrency; returns (results, wall seconds)."""
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(job, range(count)))
+    return results, time.monotonic() - started
+
+
+def _child_talk(jobs, concurrency, stream):
+    import generate_ai_response
+    generate_ai_response.warm_up()
+
+    def job(index):
+        started = time.monotonic()
+        sink = _TimedSink(started)
+        user_input = f"Tell me again about the summer we spent at the lake, story number {index}"
+        ok = generate_ai_response.generate_ai_response_and_convert_to_audio(
+            user_input, "SEEDVOICE00000000000", USER_DATA, sink, stream=stream)
+        return {"ok": bool(ok) and sink.bytes_written > 0, "seconds": time.monotonic() - started,
+                "first_audio": sink.first_audio, "bytes": sink.bytes_written}
+
+    job(-1)
+    results, wall = _run_jobs(job, jobs, concurrency)
+    succeeded = [r for r in results if r["ok"]]
+    return {
+        "jobs": jobs,
+        "concurrency": concurrency,
+        "errors": jobs - len(succeeded),
+        **summarize([r["seconds"] for r in succeeded]),
+        **summarize([r["first_audio"] for r in succeeded if r["first_audio"] is not None], "ttfa_"),
+        "throughput_per_second": round(len(succeeded) / wall, 3) if wall else None,
+        "audio_bytes_per_job": round(sum(r["bytes"] for r in succeeded) / len(succeeded)) if succeeded else 0,
+    }
+
+
+def _child_clone(jobs, concurrency, uploads_dir):
+    import audio_cloning
+    audio_cloning.warm_up()
+
+    # Fixtures are written before timing starts; a distinct seed per job keeps every upload unique
+    uploads = {index: (seconds, fixtures.write_fixture(uploads_dir, seconds, seed=index + 1))
+               for index, seconds in ((i, fixtures.FIXTURE_SECONDS[i % len(fixtures.FIXTURE_SECONDS)])
+                                      for i in range(-1, jobs))}
+
+    def job(index):
+        seconds, path = uploads[index]
+        started = time.monotonic()
+        try:
+            audio_cloning.remove_noise_and_clone_voice(path, f"bench-clone-{index}")
+            ok = True
+        except Exception as e:
+            print(f"Clone job {index} failed: {str(e)}", file=sys.stderr)
+            ok = False
+        return {"ok": ok, "seconds": time.monotonic() - started, "audio_seconds": seconds}
+
+    job(-1)
+    results, wall = _run_jobs(job, jobs, concurrency)
+    succeeded = [r for r in results if r["ok"]]
+    by_length = {}
+    for seconds in fixtures.FIXTURE_SECONDS:
+        latencies = [r["seconds"] for r in succeeded if r["audio_seconds"] == seconds]
+        if latencies:
+            by_length[f"{seconds}s_p50_seconds"] = percentile(latencies, 0.50)
+    return {
+        "jobs": jobs,
+        "concurrency": concurrency,
+        "errors": jobs - len(succeeded),
+        **summarize([r["seconds"] for r in succeeded]),
+        **by_length,
+        "throughput_per_second": round(len(succeeded) / wall, 3) if wall else None,
+    }
+
+
+def run_child(args):
+    sys.path.insert(0, PYTHON_DIR)
+    if args.child == "clone":
+        result = _child_clone(args.jobs, args.concurrency, os.environ["VOICE_UPLOADS_DIR"])
+    else:
+        result = _child_talk(args.jobs, args.concurrency, stream=args.child == "talk_stream")
+    result["peak_rss_mb"] = peak_rss_mb()
+    with open(args.child_output, "w") as f:
+        json.dump(result, f)
+
+
+# Parent side
+
+def _scenario_env(fake, work_dir, name):
+    """A fresh, private set of cache and state directories per scenario run."""
+    state_dir = os.path.join(work_dir, name)
+    os.makedirs(state_dir, exist_ok=True)
+    env = {key: value for key, value in os.environ.items() if key != "VOICE_WORKER_SOCKET"}
+    env.update(fake.env())
+    env.update({
+        "TTS_CACHE_DIR": os.path.join(state_dir, "tts_cache"),
+        "VOICE_REGISTRY_PATH": os.path.join(state_dir, "voice_registry.json"),
+        "UPLOAD_FINGERPRINT_DIR": os.path.join(state_dir, "fingerprints"),
+        "VOICE_UPLOADS_DIR": os.path.join(state_dir, "uploads"),
+        "TELEMETRY_JSONL_PATH": os.path.join(state_dir, "spans.jsonl"),
+        "CONVERSATION_DIR": os.path.join(state_dir, "conversations"),
+        "CLONE_QUEUE_DIR": os.path.join(state_dir, "clone_jobs"),
+        # Every bench job talks as one persona; remembered turns would grow the prompt job by job
+        "CONVERSATION_MEMORY_ENABLED": "0",
+        "VOICE_LOG_LEVEL": "WARNING",
+        "PHRASE_BANK_ENABLED": "0",
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    return env
+
+
+def _run_scenario_child(scenario, jobs, concurrency, env, work_dir):
+    output_path = os.path.join(work_dir, f"{scenario}-{concurrency}.json")
+    command = [sys.executable, os.path.abspath(__file__), "--child", scenario, "--jobs", str(jobs),
+               "--concurrency", str(concurrency), "--child-output", output_path]
+    result = subprocess.run(command, cwd=PYTHON_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"{scenario} at concurrency {concurrency} failed:\n"
+                           f"{result.stderr.decode('utf-8', errors='replace')[-4000:]}")
+    with open(output_path, "r") as f:
+        return json.load(f)
+
+
+def _timed_process(command, env, input_bytes=None):
+    started = time.monotonic()
+    result = subprocess.run(command, cwd=PYTHON_DIR, env=env, input=input_bytes,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed:\n{result.stderr.decode('utf-8', errors='replace')[-4000:]}")
+    return time.monotonic() - started, result.stdout
+
+
+def run_cold_start(env, repeats):
+    import_talk, import_clone, first_job = [], [], []
+    job = json.dumps({"user_input": "What should I cook for dinner tonight, do you think?",
+                      "cloned_voice_id": "SEEDVOICE00000000000", "user_data": USER_DATA}).encode("utf-8")
+    for _ in range(repeats):
+        import_talk.append(_timed_process([sys.executable, "-c", "import generate_ai_response"], env)[0])
+        import_clone.append(_timed_process([sys.executable, "-c", "import audio_cloning"], env)[0])
+        seconds, output = _timed_process([sys.executable, "generate_ai_response.py", "--stdin"], env, job)
+        if b'"ok": true' not in output:
+            raise RuntimeError("cold start talk job did not report success")
+        first_job.append(seconds)
+    return {
+        "repeats": repeats,
+        "import_talk_seconds": percentile(import_talk, 0.5),
+        "import_clone_seconds": percentile(import_clone, 0.5),
+        "first_talk_job_seconds": percentile(first_job, 0.5),
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def run_noise_reduction():
+    """Speed and output difference of chunked vs single-shot noise reduction per fixture length."""
+    sys.path.insert(0, PYTHON_DIR)
+    import noise_reduction
+    results, failures = {}, []
+    for seconds in fixtures.FIXTURE_SECONDS:
+        audio = fixtures.synthetic_speech(seconds, seed=seconds, sample_rate=16000)
+        comparison = noise_reduction.compare_noise_reduction(audio, 16000)
+        # snr_db is None when the outputs are identical
+        snr_db = comparison["snr_db"]
+        key = f"noise_reduction@{seconds}s"
+        results[key] = {"single_seconds": comparison["single_seconds"], "chunked_seconds": comparison["chunked_seconds"],
+                        "max_abs_diff": comparison["max_abs_diff"], "snr_db": snr_db}
+        if snr_db is not None and snr_db < noise_reduction.EQUIVALENCE_MIN_SNR_DB:
+            failures.append({"scenario": key, "metric": "snr_db", "baseline": noise_reduction.EQUIVALENCE_MIN_SNR_DB,
+                             "current": snr_db})
+    return results, failures
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PYTHON_DIR, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(report, baseline, tolerance):
+    """Metrics that regressed by more than tolerance (relative) against the baseline report."""
+    regressions = []
+    for key, metrics in report["results"].items():
+        previous = baseline.get("results", {}).get(key)
+        if not previous:
+            continue
+        for metric, value in metrics.items():
+            old = previous.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            if metric in ("jobs", "concurrency", "repeats", "audio_bytes_per_job", "max_abs_diff", "snr_db"):
+                continue
+            if metric == "errors":
+                if value > old:
+                    regressions.append({"scenario": key, "metric": metric, "baseline": old, "current": value})
+                continue
+            change = (value - old) / old
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            elif metric.endswith("_seconds") and value - old < MIN_SECONDS_DELTA:
+                continue
+            if change > tolerance:
+                regressions.append({"scenario": key, "metric": metric, "baseline": old, "current": value,
+                                    "change": round(change, 3)})
+    return regressions
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+def print_report(report):
+    print(f"Benchmark {report['revision'] or ''} on {report['machine']['python']} "
+          f"({report['machine']['cpu_count']} CPUs), fake upstream latency {report['upstream']['latency']}s")
+    for key, metrics in report["results"].items():
+        print(f"\n{key}")
+        for metric, value in metrics.items():
+            print(f"  {metric:<28} {_format_value(value)}")
+    for regression in report.get("regressions", []):
+        print(f"REGRESSION {regression['scenario']} {regression['metric']}: "
+              f"{_format_value(regression['baseline'])} -> {_format_value(regression['current'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the voice pipelines against local fake upstreams")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {SCENARIOS}")
+    parser.add_argument("--concurrency", default="1,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--jobs", type=int, default=40, help="Timed talk jobs per concurrency level")
+    parser.add_argument("--clone-jobs", type=int, default=6, help="Timed clone jobs per concurrency level")
+    parser.add_argument("--cold-start-repeats", type=int, default=3)
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown before flagging")
+    parser.add_argument("--keep-work-dir", action="store_true", help="Keep caches, uploads and spans for inspection")
+    fake_upstream.add_arguments(parser)
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.concurrency = int(args.concurrency)
+        run_child(args)
+        return 0
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    upstream_config = fake_upstream.config_from_arguments(args)
+    report = {
+        "revision": _git_revision(),
+        "created_at": time.time(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "cpu_count": os.cpu_count()},
+        "upstream": upstream_config,
+        "results": {},
+    }
+
+    work_dir = tempfile.mkdtemp(prefix="voice-bench-")
+    try:
+        with fake_upstream.FakeUpstream(**upstream_config) as fake:
+            for scenario in scenarios:
+                if scenario == "cold_start":
+                    print("Running cold_start", file=sys.stderr)
+                    env = _scenario_env(fake, work_dir, "cold_start")
+                    report["results"]["cold_start"] = run_cold_start(env, args.cold_start_repeats)
+                    continue
+                if scenario == "noise_reduction":
+                    print("Running noise_reduction", file=sys.stderr)
+                    results, failures = run_noise_reduction()
+                    report["results"].update(results)
+                    report.setdefault("regressions", []).extend(failures)
+                    continue
+                for level in levels:
+                    print(f"Running {scenario} at concurrency {level}", file=sys.stderr)
+                    env = _scenario_env(fake, work_dir, f"{scenario}-{level}")
+                    jobs = args.clone_jobs if scenario == "clone" else args.jobs
+                    report["results"][f"{scenario}@{level}"] = _run_scenario_child(scenario, jobs, level, env, work_dir)
+            report["upstream_requests"] = fake.stats()
+    finally:
+        if args.keep_work_dir:
+            print(f"Work directory kept at {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            report.setdefault("regressions", []).extend(compare(report, json.load(f), args.tolerance))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print_report(report)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# Startup-time budget for the python/ entry points the Node routes spawn.
+#
+#   python bench/startup_budget.py                     # check, exit 1 when over budget
+#   python bench/startup_budget.py --output profile.json
+#
+# Each check runs in a fresh interpreter several times and the median wall time
+# is compared with its budget. The import checks also record a `-X importtime`
+# profile (the modules with the largest cumulative import time), so a new
+# top-level import of librosa, noisereduce, openai or the like shows up by name.
+# Budgets can be scaled for slower machines with --scale or STARTUP_BUDGET_SCALE.
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name: (command, budget in seconds)
+CHECKS = {
+    "import_generate_ai_response": (["-c", "import generate_ai_response"], 0.5),
+    "import_audio_cloning": (["-c", "import audio_cloning"], 0.5),
+    "import_worker": (["-c", "import worker"], 0.3),
+    # Failure paths must not pay for imports or API setup
+    "talk_usage_error": (["generate_ai_response.py"], 0.5),
+    "clone_usage_error": (["audio_cloning.py"], 0.5),
+    "clone_missing_file": (["audio_cloning.py", "does-not-exist.wav", "bench"], 0.5),
+}
+PROFILE_TOP_MODULES = 15
+
+
+def _environment():
+    env = {key: value for key, value in os.environ.items() if key != "VOICE_WORKER_SOCKET"}
+    env.setdefault("OPENAI_API_KEY", "startup-budget")
+    env.setdefault("ELEVENLABS_API_KEY", "startup-budget")
+    env["VOICE_UPLOADS_DIR"] = os.path.join(PYTHON_DIR, "bench")
+    return env
+
+
+def time_command(arguments, env):
+    started = time.monotonic()
+    subprocess.run([sys.executable, *arguments], cwd=PYTHON_DIR, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.monotonic() - started
+
+
+def import_profile(module, env):
+    """Modules with the largest cumulative import time (seconds) when importing module."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=PYTHON_DIR,
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(cumulative) / 1e6))
+    modules.sort(key=lambda entry: entry[1], reverse=True)
+    return [{"module": name, "cumulative_seconds": round(seconds, 4)} for name, seconds in modules[:PROFILE_TOP_MODULES]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the startup time of the python/ entry points")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=float(os.getenv("STARTUP_BUDGET_SCALE", "1")),
+                        help="Multiply every budget, e.g. 2 on slow CI machines")
+    parser.add_argument("--output", help="Write timings and import profiles as JSON")
+    args = parser.parse_args()
+
+    env = _environment()
+    # One untimed run of each so bytecode caches and the page cache are warm
+    for arguments, _ in CHECKS.values():
+        time_command(arguments, env)
+
+    report = {"scale": args.scale, "checks": {}, "profiles": {}}
+    failures = []
+    for name, (arguments, budget) in CHECKS.items():
+        timings = sorted(time_command(arguments, env) for _ in range(args.repeats))
+        median = timings[len(timings) // 2]
+        allowed = budget * args.scale
+        report["checks"][name] = {"median_seconds": round(median, 4), "budget_seconds": allowed,
+                                  "ok": median <= allowed}
+        status = "ok" if median <= allowed else "OVER BUDGET"
+        print(f"{name:<30} {median:.3f}s (budget {allowed:.3f}s) {status}")
+        if median > allowed:
+            failures.append(name)
+
+    for module in ("generate_ai_response", "audio_cloning"):
+        report["profiles"][module] = import_profile(module, env)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    for name in failures:
+        module = CHECKS[name][0][-1].replace("import ", "") if name.startswith("import_") else None
+        if module in report["profiles"]:
+            slowest = ", ".join(f"{entry['module']} {entry['cumulative_seconds']:.3f}s"
+                                for entry in report["profiles"][module][1:6])
+            print(f"{name}: slowest imports: {slowest}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import hashlib
+import tempfile
+import upload_fingerprints
+import voice_registry
+
+# Single-flight, idempotent clone jobs.
+#
+# Double-taps and client retries on /add-voice used to start one full clone per
+# request. A job is now identified by its clone name and the hash of the upload
+# bytes, so duplicates get the same job id:
+#
+#   <CLONE_QUEUE_DIR>/<job_id>.json   job state (queued / running / succeeded / failed)
+#   <CLONE_QUEUE_DIR>/<job_id>.lock   held by whichever process is running the job
+#
+# run_or_wait() runs the job when nobody else is, and otherwise waits on the lock
+# and returns the owner's result, so decoding, denoising and the clone upload
+# happen once per distinct job. A lock is released when its holder dies, so a
+# job left "running" by a crash or restart is picked up by the next caller, or by
+# the warm worker's resume_pending() at startup. A succeeded job answers repeats
+# for as long as its voice is still registered. The job keeps the persona's
+# personalization data itself (the file Node passes is deleted once the request
+# ends), so a resumed job still builds the phrase bank. Transient upstream failures are
+# retried with backoff inside the clone itself (upstream.run_with_retries).
+
+CLONE_QUEUE_DIR = os.getenv("CLONE_QUEUE_DIR", "/app/uploads/clone_jobs")
+JOB_TTL_SECONDS = float(os.getenv("CLONE_JOB_TTL_SECONDS", str(24 * 3600)))
+WAIT_TIMEOUT_SECONDS = float(os.getenv("CLONE_JOB_WAIT_TIMEOUT", "600"))
+POLL_SECONDS = 0.25
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class CloneJobError(RuntimeError):
+    """Raised when a clone job failed or could not be waited for."""
+
+
+def job_id_for(input_audio_path: str, clone_name: str) -> str:
+    raw_hash = upload_fingerprints.file_hash(input_audio_path)
+    return hashlib.sha256(f"{clone_name}\0{raw_hash}".encode("utf-8")).hexdigest()[:24]
+
+
+def _state_path(job_id: str) -> str:
+    return os.path.join(CLONE_QUEUE_DIR, f"{job_id}.json")
+
+
+def _lock_path(job_id: str) -> str:
+    return os.path.join(CLONE_QUEUE_DIR, f"{job_id}.lock")
+
+
+def status(job_id: str):
+    """The job's state document, or None for an unknown job id."""
+    try:
+        with open(_state_path(job_id), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _save(job: dict):
+    job["updated_at"] = time.time()
+    os.makedirs(CLONE_QUEUE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CLONE_QUEUE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp_path, _state_path(job["job_id"]))
+
+
+def _reusable(job) -> bool:
+    return (job is not None and job["status"] == SUCCEEDED
+            and time.time() - job["updated_at"] <= JOB_TTL_SECONDS
+            and voice_registry.contains(job.get("voice_id")))
+
+
+def submit(input_audio_path: str, clone_name: str, user_data: dict = None) -> dict:
+    """Register a job (or find the existing one for the same name and audio) and return its state."""
+    job_id = job_id_for(input_audio_path, clone_name)
+    job = status(job_id)
+    if job is not None and (job["status"] in (QUEUED, RUNNING) or _reusable(job)):
+        return job
+    job = {
+        "job_id": job_id,
+        "clone_name": clone_name,
+        "input_audio_path": input_audio_path,
+        "user_data": user_data,
+        "status": QUEUED,
+        "attempts": 0,
+        "voice_id": None,
+        "error": None,
+        "created_at": time.time(),
+    }
+    _save(job)
+    return job
+
+
+def _execute(job: dict, clone) -> dict:
+    job.update(status=RUNNING, attempts=job["attempts"] + 1, error=None, pid=os.getpid())
+    _save(job)
+    try:
+        job["voice_id"] = clone(job["input_audio_path"], job["clone_name"])
+        job["status"] = SUCCEEDED
+    except Exception as e:
+        job.update(status=FAILED, error=str(e))
+    _save(job)
+    return job
+
+
+def run_or_wait(job_id: str, clone, timeout: float = WAIT_TIMEOUT_SECONDS) -> dict:
+    """
+    Run the job with clone(input_audio_path, clone_name) unless another caller
+    already is; then return its final state.
+
+    Raises CloneJobError for unknown jobs and when timeout passes first.
+    """
+    os.makedirs(CLONE_QUEUE_DIR, exist_ok=True)
+    deadline = time.monotonic() + timeout
+    with open(_lock_path(job_id), "a") as lock_file:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise CloneJobError(f"Timed out after {timeout}s waiting for clone job {job_id}")
+                time.sleep(POLL_SECONDS)
+
+        job = status(job_id)
+        if job is None:
+            raise CloneJobError(f"Unknown clone job: {job_id}")
+        # submit() resets earlier failures to queued, so a finished state here comes from the
+        # caller that held the lock meanwhile; a leftover "running" means its owner died
+        if job["status"] in (SUCCEEDED, FAILED):
+            return job
+        return _execute(job, clone)
+
+
+def wait(job_id: str, timeout: float = WAIT_TIMEOUT_SECONDS) -> dict:
+    """Poll until the job has finished, without ever running it."""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = status(job_id)
+        if job is None:
+            raise CloneJobError(f"Unknown clone job: {job_id}")
+        if job["status"] in (SUCCEEDED, FAILED):
+            return job
+        if time.monotonic() >= deadline:
+            raise CloneJobError(f"Timed out after {timeout}s waiting for clone job {job_id}")
+        time.sleep(POLL_SECONDS)
+
+
+def clone(input_audio_path: str, clone_name: str, clone_fn, user_data: dict = None) -> dict:
+    """Submit and run (or join) a clone job; returns the final state."""
+    job = submit(input_audio_path, clone_name, user_data)
+    if _reusable(job):
+        return job
+    return run_or_wait(job["job_id"], clone_fn)
+
+
+def _lock_is_free(job_id: str) -> bool:
+    with open(_lock_path(job_id), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return True
+
+
+def pending_jobs():
+    """Queued or abandoned running jobs that nobody holds; expired job files are removed along the way."""
+    if not os.path.isdir(CLONE_QUEUE_DIR):
+        return []
+    pending = []
+    for name in os.listdir(CLONE_QUEUE_DIR):
+        if not name.endswith(".json"):
+            continue
+        job_id = name[:-len(".json")]
+        job = status(job_id)
+        if job is None:
+            continue
+        if time.time() - job["updated_at"] > JOB_TTL_SECONDS:
+            if _lock_is_free(job_id):
+                for path in (_state_path(job_id), _lock_path(job_id)):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            continue
+        if job["status"] in (QUEUED, RUNNING) and _lock_is_free(job_id):
+            pending.append(job)
+    return pending
+
+
+def resume_pending(executor, clone_fn, on_success=None):
+    """Called by the warm worker at startup: finish jobs interrupted by a crash or restart in the background."""
+    def resume(job):
+        finished = run_or_wait(job["job_id"], clone_fn)
+        print(f"Resumed clone job {job['job_id']} ({job['clone_name']}): {finished['status']}", file=sys.stderr)
+        if on_success and finished["status"] == SUCCEEDED:
+            on_success(finished)
+
+    jobs = pending_jobs()
+    for job in jobs:
+        executor.submit(resume, job)
+    return len(jobs)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("status", "wait"):
+        print("Usage: python clone_queue.py status|wait <job_id>", file=sys.stderr)
+        sys.exit(1)
+    try:
+        state = status(sys.argv[2]) if sys.argv[1] == "status" else wait(sys.argv[2])
+    except CloneJobError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+    if state is None:
+        print(f"Unknown clone job: {sys.argv[2]}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(state, indent=2))
@@ -1,146 +1,599 @@
 import sys
+import re
 import json
-import openai
+import base64
+import time
+import queue
+import argparse
+import tempfile
+import threading
+import contextvars
 import os
-from elevenlabs import generate, set_api_key
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from worker_client import request_worker_job, WorkerJobError
+import tts_cache
+import reply_cache
+import voice_registry
+import personalization
+import phrase_bank
+import prompt_compiler
+import audio_formats
+import batch_jobs
+import upstream
+import telemetry
+from job_io import FramedAudioWriter, FRAME_RESULT, FRAME_ERROR, write_json_frame
+
+# In --stdin mode stdout carries framed audio only, so every log line goes to stderr
+JOB_OUTPUT = None
+if __name__ == "__main__" and sys.argv[1:] == ["--stdin"]:
+    JOB_OUTPUT = sys.stdout.buffer
+    sys.stdout = sys.stderr
+
+log = telemetry.get_logger("talk")
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Fetch the OpenAI API key from an environment variable
-openai.api_key = os.getenv("OPENAI_API_KEY")
-if not openai.api_key:
-    print("Error: OPENAI_API_KEY environment variable not set.")
-    sys.exit(1)
-    
-# Fetch the ElevenLabs API key from an environment variable
-set_api_key(os.getenv("ELEVENLABS_API_KEY"))
-if not os.getenv("ELEVENLABS_API_KEY"):
-    print("Error: ELEVENLABS_API_KEY environment variable not set.")
-    sys.exit(1)
-    
 # Unset any proxy environment variables to prevent interference
 for proxy_var in ['HTTP_PROXY', 'HTTPS_PROXY', 'http_proxy', 'https_proxy']:
     if proxy_var in os.environ:
-        print(f"Removing proxy variable {proxy_var}: {os.environ[proxy_var]}")
+        log.debug(f"Removing proxy variable {proxy_var}: {os.environ[proxy_var]}")
         os.environ.pop(proxy_var, None)
 
-def generate_ai_response_and_convert_to_audio(user_input, cloned_voice_id, user_data_file, output_audio_path):
+# The API keys are read from the environment by the upstream clients; they are
+# checked only after the arguments, so malformed invocations fail fast.
+API_KEY_VARS = ("OPENAI_API_KEY", "ELEVENLABS_API_KEY")
+
+def missing_api_keys():
+    return [name for name in API_KEY_VARS if not os.getenv(name)]
+
+def require_api_keys():
+    for name in missing_api_keys():
+        print(f"Error: {name} environment variable not set.")
+        sys.exit(1)
+
+def warm_up():
+    """Start the upstream event loop and its pooled OpenAI/ElevenLabs clients ahead of the first request."""
+    require_api_keys()
+    upstream.start()
+
+# Streaming mode: synthesize each sentence while the rest of the reply is still being generated
+STREAM_AUDIO = os.getenv("TALK_STREAM_AUDIO", "0") == "1"
+STREAM_TTS_CONCURRENCY = int(os.getenv("TALK_STREAM_TTS_CONCURRENCY", "3"))
+STREAM_MIN_SENTENCE_CHARS = int(os.getenv("TALK_STREAM_MIN_SENTENCE_CHARS", "40"))
+OPENAI_MODEL = "gpt-3.5-turbo"
+ELEVENLABS_MODEL = "eleven_multilingual_v2"
+# The phrase bank is built for the default output format's upstream encoding
+ELEVENLABS_OUTPUT_FORMAT = audio_formats.upstream_format(audio_formats.resolve())
+
+# A sentence ends at . ! ? or … (optionally followed by closing quotes/brackets) and whitespace
+SENTENCE_BOUNDARY = re.compile(r'[.!?\u2026]+["\'\u2019\u201d)\]]*\s+')
+
+@contextmanager
+def _open_output(output_audio):
+    """Yield a binary sink for output_audio: a path (opened and closed here) or a writable file object."""
+    if hasattr(output_audio, "write"):
+        yield output_audio
+    else:
+        with open(output_audio, "wb") as output_file:
+            yield output_file
+
+def split_sentences(text_chunks, min_chars=STREAM_MIN_SENTENCE_CHARS):
     """
-    Function to generate AI response based on user input and convert it to cloned voice audio.
+    Re-chunk a stream of LLM text deltas into sentences.
+
+    Sentences shorter than min_chars are merged with the next one so TTS is not
+    called for fragments like "Oh!". Whatever remains when the stream ends is
+    yielded as the last sentence.
+    """
+    buffer = ""
+    for chunk in text_chunks:
+        buffer += chunk
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(buffer):
+            if match.end() - start >= min_chars:
+                yield buffer[start:match.end()].strip()
+                start = match.end()
+        buffer = buffer[start:]
+    if buffer.strip():
+        yield buffer.strip()
+
+def stream_openai_text(messages, usage=None):
+    """Yield the reply text delta by delta as OpenAI produces it."""
+    yield from upstream.iterate(upstream.chat_completion_stream(messages, OPENAI_MODEL, usage))
+
+def _synthesize_sentence_stream(sentence, cloned_voice_id, upstream_format, chunk_queue):
+    """Stream one sentence's audio into chunk_queue, ending with None (or the exception raised)."""
+    try:
+        with telemetry.span("tts_stream", chars=len(sentence)) as tts_span:
+            cached_audio = tts_cache.get(cloned_voice_id, sentence, ELEVENLABS_MODEL, upstream_format)
+            if cached_audio is not None:
+                tts_span.set(cache="hit", bytes_out=len(cached_audio))
+                chunk_queue.put(cached_audio)
+                chunk_queue.put(None)
+                return
+            audio_chunks = []
+            for audio_chunk in upstream.iterate(upstream.text_to_speech_stream(
+                    cloned_voice_id, sentence, ELEVENLABS_MODEL, upstream_format)):
+                audio_chunks.append(audio_chunk)
+                chunk_queue.put(audio_chunk)
+            chunk_queue.put(None)
+            audio = b"".join(audio_chunks)
+            tts_span.set(cache="miss", bytes_out=len(audio))
+        tts_cache.put(cloned_voice_id, sentence, ELEVENLABS_MODEL, upstream_format, audio)
+    except Exception as e:
+        chunk_queue.put(e)
+
+def stream_response_to_audio(text_chunks, cloned_voice_id, output_audio_path, fallback_text,
+                             output_format=audio_formats.DEFAULT_OUTPUT_FORMAT):
+    """
+    Streaming LLM-to-TTS pipeline.
+
+    Reads text_chunks (normally stream_openai_text(messages)) token by token, cuts
+    it at sentence boundaries and sends each sentence to ElevenLabs while later text
+    is still being generated. Audio chunks are appended to output_audio_path (a file
+    or a named pipe) strictly in sentence order, as soon as they arrive, encoded as
+    output_format (see audio_formats.StreamEncoder). Writing stops at the first
+    sentence whose speech fails, and that error is raised.
+
+    Returns a dict with the reply text, time to first audio, the time spent reading
+    the text stream, whether the fallback text had to be used, whether the text
+    stream broke off after some sentences (incomplete) and the encoder.
+    """
+    started = time.monotonic()
+    sentence_queues = queue.Queue()
+    first_audio_at = []
+    writer_errors = []
+
+    def write_in_order(encoder):
+        while True:
+            chunk_queue = sentence_queues.get()
+            if chunk_queue is None:
+                return
+            while True:
+                item = chunk_queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    # A reply with a sentence missing is no reply: nothing after it is written
+                    writer_errors.append(item)
+                    return
+                if not first_audio_at:
+                    first_audio_at.append(time.monotonic() - started)
+                encoder.write(item)
+
+    sentences = []
+    upstream_format = audio_formats.upstream_format(output_format)
+    with _open_output(output_audio_path) as output_file, ThreadPoolExecutor(max_workers=STREAM_TTS_CONCURRENCY) as tts_pool:
+        encoder = audio_formats.StreamEncoder(output_format, output_file)
+        writer = threading.Thread(target=write_in_order, args=(encoder,), daemon=True)
+        writer.start()
+
+        def submit(sentence):
+            sentences.append(sentence)
+            chunk_queue = queue.Queue()
+            sentence_queues.put(chunk_queue)
+            # Each sentence runs in a copy of this context so its TTS span lands in the job's trace
+            tts_pool.submit(contextvars.copy_context().run, _synthesize_sentence_stream, sentence, cloned_voice_id,
+                            upstream_format, chunk_queue)
+
+        used_fallback = False
+        incomplete = False
+        try:
+            for sentence in split_sentences(text_chunks):
+                if writer_errors:
+                    break
+                log.debug(f"Streaming sentence {len(sentences) + 1} to TTS: {sentence[:50]}...")
+                submit(sentence)
+        except Exception as e:
+            log.warning(f"Error streaming AI response: {str(e)} - Check OpenAI API key or network connectivity")
+            if not sentences:
+                log.warning(f"Using fallback response: {fallback_text}")
+                used_fallback = True
+                # Submitted whole so it is served from the phrase bank
+                submit(fallback_text)
+            else:
+                # What was said stays said, but it is not a whole reply
+                incomplete = True
+        text_seconds = time.monotonic() - started
+
+        sentence_queues.put(None)
+        writer.join()
+        if writer_errors:
+            tts_pool.shutdown(wait=False, cancel_futures=True)
+        encoder.close()
+
+    if writer_errors:
+        raise writer_errors[0]
+    return {
+        "text": " ".join(sentences),
+        "time_to_first_audio": first_audio_at[0] if first_audio_at else None,
+        "text_seconds": text_seconds,
+        "used_fallback": used_fallback,
+        "incomplete": incomplete,
+        "encoder": encoder,
+    }
+
+def build_phrase_bank(cloned_voice_id, user_data):
+    """Pre-synthesize a persona's greeting, goodbye, signature phrase and fallback reply."""
+    return phrase_bank.build(
+        cloned_voice_id, user_data, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT,
+        lambda text: upstream.run(upstream.text_to_speech(cloned_voice_id, text, ELEVENLABS_MODEL,
+                                                          ELEVENLABS_OUTPUT_FORMAT))
+    )
+
+def _record_output(output_format, output_bytes, seconds, output_info):
+    """Report the delivered size per second of speech to telemetry and the caller's output_info."""
+    info = audio_formats.describe(output_format, output_bytes, seconds)
+    telemetry.annotate(output_format=output_format, bytes_per_second=info["bytes_per_second"])
+    telemetry.count("talk_output_bytes_total", output_bytes, format=output_format)
+    telemetry.count("talk_output_audio_seconds_total", seconds, format=output_format)
+    if output_info is not None:
+        output_info.update(info)
+    log.debug(f"Output: {output_bytes} bytes of {output_format} for {seconds:.2f}s of speech "
+              f"({info['bytes_per_second']} bytes/s)")
+
+def _write_output(output_audio_path, audio, output_format, output_info):
+    """Encode a whole reply (upstream bytes) as output_format and write it."""
+    with telemetry.span("write_output", output_format=output_format, bytes_in=len(audio)) as write_span:
+        encoded = audio_formats.encode(output_format, audio)
+        with _open_output(output_audio_path) as output_file:
+            output_file.write(encoded)
+        write_span.set(bytes_out=len(encoded))
+    _record_output(output_format, len(encoded), audio_formats.duration_seconds(output_format, len(audio)), output_info)
+
+def _remember_turn(conversation_id, user_input, reply):
+    try:
+        prompt_compiler.record_turn(conversation_id, user_input, reply)
+    except OSError as e:
+        log.warning(f"Could not save conversation turn: {e}")
+
+def generate_ai_response_and_convert_to_audio(user_input, cloned_voice_id, user_data_file, output_audio_path, stream=None,
+                                              conversation_id=None, output_format=None, output_info=None):
+    """
+    Generates a response using the OpenAI chat model (OPENAI_MODEL), converts it to audio using ElevenLabs, and saves it as an audio file.
     Supports personalized data from a JSON file with error handling.
 
+    Every stage is timed by telemetry; the job's spans are written out when it ends.
+
     Parameters:
         user_input (str): The text input from the user.
         cloned_voice_id (str): The ID of the cloned voice.
-        user_data_file (str): Path to the JSON file containing user and loved one personalized data.
-        output_audio_path (str): The path where the generated audio will be saved.
+        user_data_file (str | dict): Path to the JSON file containing user and loved one personalized data,
+            or the personalized data itself.
+        output_audio_path (str | file): The path where the generated audio will be saved, or a binary
+            file object (e.g. job_io.FramedAudioWriter) that receives it.
+        stream (bool): Stream the reply sentence by sentence into output_audio_path.
+            Defaults to the TALK_STREAM_AUDIO environment setting.
+        conversation_id (str): Key of the conversation whose earlier turns are remembered.
+            Defaults to one conversation per voice and personalization data.
+        output_format (str): One of audio_formats.FORMATS. Defaults to the TALK_OUTPUT_FORMAT setting.
+            A path is used as given; output_info["extension"] names the format's usual extension.
+        output_info (dict): Filled with the format, extension, MIME type, size and bytes per second of speech.
 
     Returns:
         generated_audio_path (str): Path to the generated audio file, or None if an error occurs.
     """
-    print(f"Step 1: Starting generate_ai_response_and_convert_to_audio")
-    print(f"Input parameters - user_input: {user_input}, cloned_voice_id: {cloned_voice_id}, user_data_file: {user_data_file}, output_audio_path: {output_audio_path}")
+    stream = STREAM_AUDIO if stream is None else stream
+    output_format = audio_formats.resolve(output_format)
+    if not hasattr(output_audio_path, "write") and audio_formats.conflicting_extension(output_audio_path, output_format):
+        log.warning(f"Writing {output_format} to {output_audio_path}; its usual extension is "
+                    f"{audio_formats.extension(output_format)}")
+    with telemetry.trace("talk", voice_id=cloned_voice_id, stream=stream) as job:
+        generated_audio_path = _talk(user_input, cloned_voice_id, user_data_file, output_audio_path, stream,
+                                     conversation_id, output_format, output_info)
+        if not generated_audio_path:
+            job["status"] = "error"
+        return generated_audio_path
 
-    # Read the user data from the file
+def _talk(user_input, cloned_voice_id, user_data_file, output_audio_path, stream, conversation_id, output_format,
+          output_info):
+    log.debug(f"Step 1: Starting generate_ai_response_and_convert_to_audio")
     try:
-        with open(user_data_file, 'r') as f:
-            user_data = json.load(f)
-        print(f"Step 2: Loaded user_data from file: {user_data}")
-    except FileNotFoundError as e:
-        print(f"Step 2.1: Error loading user data file: {e}")
-        return None
-    except json.JSONDecodeError as e:
-        print(f"Step 2.2: Error decoding JSON from user data file: {e}")
-        return None
+        # Keeps this voice away from LRU eviction when the account hits its voice limit
+        voice_registry.touch(cloned_voice_id)
+    except OSError as e:
+        log.warning(f"Step 1.1: Could not update voice registry: {e}")
+    log.debug(f"Input parameters - user_input: {user_input}, cloned_voice_id: {cloned_voice_id}, user_data_file: {user_data_file}, output_audio_path: {output_audio_path}")
 
-    # Standardize field names to match the expected structure
-    user_data = {
-        'loved_one_name': user_data.get('lovedOneName', 'Unknown'),
-        'loved_one_birthday': user_data.get('lovedOneBirthday', 'Unknown'),
-        'user_birthday': user_data.get('userBirthday', 'Unknown'),
-        'nickname_for_user': user_data.get('nicknameForUser', 'Unknown'),
-        'favorite_song': user_data.get('favoriteSong', 'Unknown'),
-        'signature_phrase': user_data.get('signaturePhrase', 'Unknown'),
-        'favorite_topic': user_data.get('favoriteTopic', 'Unknown'),
-        'distinct_greeting': user_data.get('distinctGreeting', 'Unknown'),
-        'distinct_goodbye': user_data.get('distinctGoodbye', 'Unknown'),
-        'additional_data': user_data.get('additionalData', 'Unknown')
-    }
-    print(f"Step 3: Standardized user_data: {user_data}")
+    # Read the user data from the file
+    with telemetry.span("load_user_data") as load_span:
+        try:
+            if isinstance(user_data_file, dict):
+                user_data = user_data_file
+            else:
+                with open(user_data_file, 'r') as f:
+                    load_span.set(bytes_in=os.fstat(f.fileno()).st_size)
+                    user_data = json.load(f)
+            log.debug(f"Step 2: Loaded user_data: {user_data}")
+        except FileNotFoundError as e:
+            log.error(f"Step 2.1: Error loading user data file: {e}")
+            return None
+        except json.JSONDecodeError as e:
+            log.error(f"Step 2.2: Error decoding JSON from user data file: {e}")
+            return None
+
+        # Standardize field names to match the expected structure
+        raw_user_data = user_data
+        user_data = personalization.standardize(raw_user_data)
+        log.debug(f"Step 3: Standardized user_data: {user_data}")
+    persona = reply_cache.persona_key(cloned_voice_id, user_data)
+    conversation_id = conversation_id or persona
+    upstream_format = audio_formats.upstream_format(output_format)
+
+    # Bare greetings and goodbyes are answered from the persona's pre-synthesized phrase bank
+    with telemetry.span("phrase_bank") as bank_span:
+        if (upstream_format == ELEVENLABS_OUTPUT_FORMAT
+                and phrase_bank.is_stale(cloned_voice_id, user_data, ELEVENLABS_MODEL, ELEVENLABS_OUTPUT_FORMAT)):
+            phrase_bank.schedule_build(cloned_voice_id, raw_user_data)
+        intent = phrase_bank.match_intent(user_input)
+        banked = intent and phrase_bank.get(cloned_voice_id, intent, user_data, ELEVENLABS_MODEL, upstream_format)
+        if intent:
+            bank_span.set(cache="hit" if banked else "miss")
+    if banked:
+        banked_text, audio = banked
+        log.debug(f"Step 3.1: Answering {intent} from the phrase bank: {banked_text}")
+        _write_output(output_audio_path, audio, output_format, output_info)
+        _remember_turn(conversation_id, user_input, banked_text)
+        log.debug(f"Step 10: Returning generated audio path: {output_audio_path}")
+        return output_audio_path
+
+    # Persona block (cached), conversation summary and recent turns, within the prompt token budget
+    with telemetry.span("prompt_build") as prompt_span:
+        compiled = prompt_compiler.compile_prompt(user_data, user_input, conversation_id)
+        messages = compiled["messages"]
+        fallback_text = personalization.fallback_reply(user_data)
+        prompt_span.set(prompt_tokens_estimate=compiled["tokens"], history_turns=compiled["history_turns"],
+                        cache="hit" if compiled["persona_cached"] else "miss")
+        log.debug(f"Step 4: Compiled prompt for OpenAI: {compiled['tokens']} tokens, "
+                  f"{compiled['history_turns']} earlier turns, {compiled['summary_lines']} summary lines")
 
-    prompt = f"""
-You are an AI assistant having a warm, caring, and supportive conversation with a user. The goal is to reply in a natural, loving tone, based on the context of the user's input, but without repeating what the user said.
+    # Near-duplicate inputs for this persona can reuse an earlier reply and skip OpenAI
+    with telemetry.span("reply_cache") as cache_span:
+        cached_reply = reply_cache.lookup(persona, user_input)
+        cache_span.set(cache="hit" if cached_reply else "miss")
+    if cached_reply:
+        log.debug(f"Step 4.1: Reply cache hit, skipping OpenAI: {cached_reply}")
+
+    if stream:
+        try:
+            log.debug("Step 5: Streaming OpenAI response into ElevenLabs sentence by sentence")
+            usage = {}
+            with telemetry.span("llm_tts_stream") as stream_span:
+                text_chunks = [cached_reply] if cached_reply else stream_openai_text(messages, usage)
+                streamed = stream_response_to_audio(text_chunks, cloned_voice_id, output_audio_path, fallback_text,
+                                                    output_format)
+                stream_span.set(chars=len(streamed["text"]), text_seconds=round(streamed["text_seconds"], 6),
+                                time_to_first_audio=streamed["time_to_first_audio"], **usage)
+            ai_response_text = streamed["text"]
+            log.debug(f"Step 6: Streamed response: {ai_response_text}")
+            _record_output(output_format, streamed["encoder"].bytes_written, streamed["encoder"].seconds(), output_info)
+            if streamed["encoder"].unpatched_header is not None and output_info is not None:
+                # The stream went out with unknown WAV sizes; the result carries the real header
+                output_info["wav_header"] = base64.b64encode(streamed["encoder"].unpatched_header).decode("ascii")
+            # Reached only once every sentence was written (a failed sentence raises). A fallback
+            # or a reply cut off mid-stream is neither cached nor remembered as a turn
+            if not streamed["used_fallback"] and not streamed["incomplete"]:
+                _remember_turn(conversation_id, user_input, ai_response_text)
+                if not cached_reply:
+                    reply_cache.store(persona, user_input, ai_response_text, streamed["text_seconds"])
+            if streamed["time_to_first_audio"] is not None:
+                log.debug(f"Step 7: Time to first audio: {streamed['time_to_first_audio']:.3f}s")
+        except Exception as e:
+            log.error(f"Step 9.1: Error streaming speech with ElevenLabs: {str(e)} - Check ElevenLabs API key or voice ID")
+            return None
+        log.debug(f"Step 10: Returning generated audio path: {output_audio_path}")
+        return output_audio_path
+
+    # Generate AI response with the OpenAI chat model (OPENAI_MODEL)
+    used_fallback = False
+    if cached_reply:
+        ai_response_text = cached_reply
+    else:
+        try:
+            log.debug("Step 5: Calling OpenAI API to generate response")
+            usage = {}
+            with telemetry.span("llm_call") as llm_span:
+                ai_response_text = upstream.run(upstream.chat_completion(messages, OPENAI_MODEL, usage)).strip()
+                llm_span.set(chars=len(ai_response_text), **usage)
+            log.debug(f"Step 6: OpenAI response received: {ai_response_text}")
+        except Exception as e:
+            log.warning(f"Step 6.1: Error generating AI response: {str(e)} - Check OpenAI API key or network connectivity")
+            # Fallback response in case OpenAI API fails
+            ai_response_text = fallback_text
+            used_fallback = True
+            log.warning(f"Step 6.2: Using fallback response: {ai_response_text}")
+
+    # Convert the AI response to speech using ElevenLabs
+    try:
+        log.debug(f"Step 7: Generating audio with ElevenLabs - text: {ai_response_text[:50]}..., voice: {cloned_voice_id}")
+        with telemetry.span("tts_call", chars=len(ai_response_text), cache="hit") as tts_span:
+            def synthesize():
+                tts_span.set(cache="miss")
+                return upstream.run(upstream.text_to_speech(
+                    cloned_voice_id, ai_response_text, ELEVENLABS_MODEL, upstream_format
+                ))
 
-Here is some information about the user:
+            # Repeated replies (fallbacks, stock phrases) are served from the on-disk TTS cache
+            audio = tts_cache.get_or_synthesize(
+                cloned_voice_id, ai_response_text, ELEVENLABS_MODEL, upstream_format, synthesize
+            )
+            tts_span.set(bytes_out=len(audio))
+        log.debug("Step 8: Audio generated, writing to file")
+        _write_output(output_audio_path, audio, output_format, output_info)
+        log.debug(f"Step 9: Audio successfully written to {output_audio_path} (TTS cache: {tts_cache.stats()})")
+        if not used_fallback:
+            _remember_turn(conversation_id, user_input, ai_response_text)
+    except Exception as e:
+        log.error(f"Step 9.1: Error generating speech with ElevenLabs: {str(e)} - Check ElevenLabs API key or voice ID")
+        return None
 
-- The user's loved one (AI's cloned voice) is named {user_data.get('loved_one_name', 'Unknown')}.
-- The user and their loved one have a special bond. The loved one calls the user {user_data.get('nickname_for_user', 'Unknown')}.
-- The user and their loved one have shared experiences, such as {user_data.get('favorite_song', 'Unknown')} or their favorite topics, like {user_data.get('favorite_topic', 'Unknown')}.
-- The loved one has a distinctive way of greeting the user, saying: "{user_data.get('distinct_greeting', 'Unknown')}", and a special farewell phrase: "{user_data.get('distinct_goodbye', 'Unknown')}".
-- The user's birthday is {user_data.get('user_birthday', 'Unknown')}, and the loved one's birthday is {user_data.get('loved_one_birthday', 'Unknown')}.
-- The loved one often says: "{user_data.get('signature_phrase', 'Unknown')}".
+    # Only a reply that made it into audio is offered to later similar inputs
+    if not used_fallback and not cached_reply:
+        reply_cache.store(persona, user_input, ai_response_text, llm_span.seconds)
+    log.debug(f"Step 10: Returning generated audio path: {output_audio_path}")
+    return output_audio_path
 
-**User input:** "{user_input}"
+def _talk_on_worker(job, output):
+    """
+    Run a stdin job on the warm worker, which writes into a private per-job directory.
 
-**Respond naturally based on the user's input.** Keep the response warm and loving, just like how the user’s loved one would respond. Don't repeat the user’s words; focus on giving a thoughtful and supportive reply. If the user brings up any of the special topics or moments, incorporate them into the conversation in a natural and caring way.
+    Returns the worker result with the audio already copied to output, or None when
+    no worker is reachable.
+    """
+    with tempfile.TemporaryDirectory(prefix="talk-") as job_dir:
+        output_audio_path = os.path.join(job_dir, "reply.audio")
+        worker_result = request_worker_job("talk", {
+            "output_format": job.get("output_format"),
+            "user_input": job["user_input"],
+            "cloned_voice_id": job["cloned_voice_id"],
+            "user_data": job["user_data"],
+            "output_audio_path": output_audio_path,
+            "stream": job.get("stream"),
+            "conversation_id": job.get("conversation_id"),
+        })
+        if worker_result is None:
+            return None
+        with open(worker_result["generated_audio_path"], "rb") as audio_file:
+            for block in iter(lambda: audio_file.read(64 * 1024), b""):
+                output.write(block)
+        return worker_result
 
-Your responses should sound like they come from the user’s loved one. Be warm, natural, and caring, incorporating relevant details about the user's loved one or their relationship only when it feels right in the conversation.
+def run_stdin_job(protocol_out):
+    """
+    Read one job document from stdin and answer with framed audio on protocol_out.
 
-If the user mentions something related to the favorite song, signature phrase, or special moments, include that in a personal way.
-"""
-    print(f"Step 4: Generated prompt for OpenAI: {prompt[:100]}...")  # Truncate for brevity
+    The document is {"user_input", "cloned_voice_id", "user_data", "stream"?, "conversation_id"?,
+    "output_format"?}. The result frame carries the format, extension, MIME type and bytes per second
+    of speech, and for a streamed WAV reply "wav_header": the base64 header with the real sizes, to
+    write over the first audio_formats.WAV_HEADER_BYTES received. Nothing is written to shared paths, so any number of these can run side by side.
+    """
+    try:
+        job = json.load(sys.stdin)
+        if not isinstance(job, dict):
+            raise ValueError("expected a JSON object")
+        missing = [key for key in ("user_input", "cloned_voice_id", "user_data") if key not in job]
+        if missing:
+            raise ValueError(f"Missing job fields: {', '.join(missing)}")
+        # A string would be taken for a user data file path; the document carries the data itself
+        if not isinstance(job["user_data"], dict):
+            raise ValueError(f"user_data must be a JSON object, got {type(job['user_data']).__name__}")
+        output_format = audio_formats.resolve(job.get("output_format"))
+    except ValueError as e:
+        write_json_frame(protocol_out, FRAME_ERROR, {"ok": False, "error": f"Invalid job document: {str(e)}"})
+        return 1
+    if missing_api_keys():
+        error = f"{', '.join(missing_api_keys())} environment variable not set."
+        write_json_frame(protocol_out, FRAME_ERROR, {"ok": False, "error": error})
+        return 1
 
-    # Generate AI response using OpenAI GPT-4 with new API syntax
+    output = FramedAudioWriter(protocol_out)
+    output_info = {}
     try:
-        print("Step 5: Calling OpenAI API to generate response")
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a warm, caring, and supportive assistant."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        ai_response_text = response.choices[0].message.content.strip()
-        print(f"Step 6: OpenAI response received: {ai_response_text}")
+        worker_result = _talk_on_worker(job, output)
+        if worker_result is not None:
+            output_info = {key: value for key, value in worker_result.items() if key != "generated_audio_path"}
+        elif not generate_ai_response_and_convert_to_audio(job["user_input"], job["cloned_voice_id"], job["user_data"],
+                                                           output, stream=job.get("stream"),
+                                                           conversation_id=job.get("conversation_id"),
+                                                           output_format=output_format, output_info=output_info):
+            raise RuntimeError("There was an error generating the audio.")
     except Exception as e:
-        print(f"Step 6.1: Error generating AI response: {str(e)} - Check OpenAI API key or network connectivity")
-        # Fallback response in case OpenAI API fails
-        ai_response_text = f"{user_data.get('distinct_greeting', 'Hello, dear!')} I'm here for you, {user_data.get('nickname_for_user', 'sweetheart')}. {user_data.get('signature_phrase', 'I care about you deeply.')}"
-        print(f"Step 6.2: Using fallback response: {ai_response_text}")
+        log.error(f"Main: Job failed: {str(e)}")
+        write_json_frame(protocol_out, FRAME_ERROR, {"ok": False, "error": str(e)})
+        return 1
+    write_json_frame(protocol_out, FRAME_RESULT, {**output_info, "ok": True, "bytes": output.bytes_written})
+    return 0
 
-    # Convert the AI response to speech using ElevenLabs
+def _load_batch_user_data(job):
+    if "user_data" in job:
+        user_data = job["user_data"]
+    else:
+        with open(job["user_data_file"], "r") as f:
+            user_data = json.load(f)
+    if not isinstance(user_data, dict):
+        raise ValueError(f"user_data must be a JSON object, got {type(user_data).__name__}")
+    return user_data
+
+def _run_batch_job(batch, job_id, job):
     try:
-        print(f"Step 7: Generating audio with ElevenLabs - text: {ai_response_text[:50]}..., voice: {cloned_voice_id}")
-        audio = generate(
-            text=ai_response_text,
-            voice=cloned_voice_id,
-            model="eleven_multilingual_v2"
-        )
-        print("Step 8: Audio generated, writing to file")
-        with open(output_audio_path, "wb") as output_file:
-            output_file.write(audio)  # In version 0.2.27, generate() returns bytes directly
-        print(f"Step 9: Audio successfully written to {output_audio_path}")
+        if "user_data" not in job and "user_data_file" not in job:
+            raise ValueError("Missing job fields: user_data or user_data_file")
+        if job.get("user_input"):
+            if not job.get("output_audio_path"):
+                raise ValueError("Missing job fields: output_audio_path")
+            output_info = {}
+            generated_audio_path = generate_ai_response_and_convert_to_audio(
+                job["user_input"], job["cloned_voice_id"], _load_batch_user_data(job), job["output_audio_path"],
+                stream=False, conversation_id=job.get("conversation_id"), output_format=job.get("output_format"),
+                output_info=output_info)
+            if not generated_audio_path:
+                raise RuntimeError("There was an error generating the audio.")
+            batch.record(job_id, job, batch_jobs.OK, generated_audio_path=generated_audio_path, **output_info)
+        else:
+            user_data = personalization.standardize(_load_batch_user_data(job))
+            built = build_phrase_bank(job["cloned_voice_id"], user_data)
+            batch.record(job_id, job, batch_jobs.OK, **built)
     except Exception as e:
-        print(f"Step 9.1: Error generating speech with ElevenLabs: {str(e)} - Check ElevenLabs API key or voice ID")
-        return None
+        batch.record(job_id, job, batch_jobs.FAILED, error=str(e))
 
-    print(f"Step 10: Returning generated audio path: {output_audio_path}")
-    return output_audio_path
+def run_batch(argv):
+    """
+    Run a manifest of synthesis jobs: {"cloned_voice_id", "user_data" | "user_data_file"} rebuilds
+    that persona's phrase bank, and adding "user_input" and "output_audio_path" (plus "output_format"?,
+    "conversation_id"?) generates a reply file instead. Jobs run on a thread pool; the shared upstream
+    engine bounds the OpenAI and ElevenLabs calls in flight. See batch_jobs for results and resuming.
+    """
+    parser = argparse.ArgumentParser(prog="generate_ai_response.py --batch",
+                                     description="Regenerate phrase banks or replies from a manifest")
+    parser.add_argument("manifest", help="JSON lines (or a JSON array) of synthesis jobs")
+    parser.add_argument("--results-dir", help="Per-job result files; defaults to <manifest>.results")
+    parser.add_argument("--concurrency", type=int, default=8, help="Jobs running at once")
+    args = parser.parse_args(argv)
+
+    require_api_keys()
+    batch = batch_jobs.BatchRun(args.manifest, args.results_dir, required=("cloned_voice_id",))
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as job_pool:
+        for job_id, job in batch.pending:
+            job_pool.submit(_run_batch_job, batch, job_id, job)
+    return batch.finish()
 
 if __name__ == "__main__":
+    if JOB_OUTPUT is not None:
+        sys.exit(run_stdin_job(JOB_OUTPUT))
+    if sys.argv[1:2] == ["--batch"]:
+        sys.exit(run_batch(sys.argv[2:]))
+
     if len(sys.argv) != 5:
         print("Usage: python generate_ai_response.py <user_input> <cloned_voice_id> <user_data_file> <output_audio_path>")
+        print("       python generate_ai_response.py --stdin  (job JSON on stdin, framed audio on stdout)")
+        print("       python generate_ai_response.py --batch <manifest> [--concurrency N] [--results-dir DIR]")
         sys.exit(1)
 
     user_input = sys.argv[1]
     cloned_voice_id = sys.argv[2]
     user_data_file = sys.argv[3]
     output_audio_path = sys.argv[4]
+    require_api_keys()
 
-    print(f"Main: Executing with arguments - user_input: {user_input}, cloned_voice_id: {cloned_voice_id}, user_data_file: {user_data_file}, output_audio_path: {output_audio_path}")
-    generated_audio_path = generate_ai_response_and_convert_to_audio(user_input, cloned_voice_id, user_data_file, output_audio_path)
+    log.debug(f"Main: Executing with arguments - user_input: {user_input}, cloned_voice_id: {cloned_voice_id}, user_data_file: {user_data_file}, output_audio_path: {output_audio_path}")
+    try:
+        # Hand the job to the warm worker when one is running; otherwise run it here.
+        worker_result = request_worker_job("talk", {
+            "user_input": user_input,
+            "cloned_voice_id": cloned_voice_id,
+            "user_data_file": os.path.abspath(user_data_file),
+            "output_audio_path": os.path.abspath(output_audio_path),
+        })
+    except WorkerJobError as e:
+        log.error(f"Main: Worker job failed: {str(e)}")
+        worker_result = {"generated_audio_path": None}
+    if worker_result is not None:
+        generated_audio_path = worker_result.get("generated_audio_path")
+    else:
+        generated_audio_path = generate_ai_response_and_convert_to_audio(user_input, cloned_voice_id, user_data_file, output_audio_path)
     if generated_audio_path:
         print(f"Generated audio saved at: {generated_audio_path}")
     else:
@@ -0,0 +1,64 @@
+import json
+import struct
+
+# Framed binary job output for `generate_ai_response.py --stdin`.
+#
+# The job document (persona, input, voice) arrives as JSON on stdin and the
+# reply leaves on stdout as a sequence of frames, so concurrent requests share
+# no paths and callers never parse log lines:
+#
+#   1 byte type | 4 byte big-endian payload length | payload
+#
+#   A  audio bytes, in order; a reply may span many frames
+#   R  final result (JSON), e.g. {"ok": true, "bytes": 12345}
+#   E  final error (JSON), e.g. {"ok": false, "error": "..."}
+#
+# Exactly one R or E frame ends the stream. Logs go to stderr.
+
+FRAME_AUDIO = b"A"
+FRAME_RESULT = b"R"
+FRAME_ERROR = b"E"
+
+_HEADER = struct.Struct(">cI")
+# Larger writes are split so a reader never has to buffer more than this per frame
+MAX_FRAME_BYTES = 64 * 1024
+
+
+def write_frame(stream, frame_type: bytes, payload: bytes):
+    stream.write(_HEADER.pack(frame_type, len(payload)))
+    stream.write(payload)
+
+
+def write_json_frame(stream, frame_type: bytes, document: dict):
+    write_frame(stream, frame_type, json.dumps(document).encode("utf-8"))
+    stream.flush()
+
+
+def read_frames(stream):
+    """Yield (frame_type, payload) pairs until the stream ends."""
+    while True:
+        header = stream.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return
+        frame_type, length = _HEADER.unpack(header)
+        payload = stream.read(length)
+        if len(payload) < length:
+            raise EOFError(f"Truncated {frame_type!r} frame: expected {length} bytes, got {len(payload)}")
+        yield frame_type, payload
+
+
+class FramedAudioWriter:
+    """File-like sink that wraps every write in audio frames; passed as the output of a talk job."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_written = 0
+
+    def write(self, data: bytes):
+        for start in range(0, len(data), MAX_FRAME_BYTES):
+            write_frame(self.stream, FRAME_AUDIO, data[start:start + MAX_FRAME_BYTES])
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        self.stream.flush()
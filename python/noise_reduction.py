@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Streaming, multi-core stationary noise reduction for long uploads.
+#
+# nr.reduce_noise on a whole 10-20 minute recording runs on one core. Internally
+# it already works in chunks: the noise statistics come from the first
+# LIBRARY_CHUNK_SAMPLES of the noise signal (clip_noise_stationary), and every
+# chunk is gated on its own with LIBRARY_PADDING_SAMPLES of context on each
+# side. Here each library chunk is cut into hop-aligned blocks that are
+# denoised in a process pool with the same noise profile and at least as much
+# context, and only each block's own span is kept. Every STFT frame therefore sees the same
+# samples and the same threshold as in the single-shot call, so the output
+# matches it to float rounding (compare_noise_reduction measures it; the bench
+# checks it stays above EQUIVALENCE_MIN_SNR_DB).
+
+NOISE_REDUCTION_MODE = os.getenv("NOISE_REDUCTION_MODE", "chunked")  # "chunked" or "single"
+BLOCK_SECONDS = float(os.getenv("NOISE_REDUCTION_BLOCK_SECONDS", "30"))
+# Context denoised on each side of a block and then discarded
+OVERLAP_SECONDS = float(os.getenv("NOISE_REDUCTION_OVERLAP_SECONDS", "2"))
+WORKERS = int(os.getenv("NOISE_REDUCTION_WORKERS", str(os.cpu_count() or 1)))
+PROP_DECREASE = 0.75
+
+# nr.reduce_noise defaults the chunked path has to line up with
+LIBRARY_CHUNK_SAMPLES = 600000
+LIBRARY_PADDING_SAMPLES = 30000
+STFT_HOP_SAMPLES = 1024 // 4
+# Chunked output below this SNR against single-shot counts as a regression
+EQUIVALENCE_MIN_SNR_DB = 60.0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def reduce_noise_single(audio_data, sample_rate, noise_source=None):
+    """The original single-shot call, kept as the reference path."""
+    import noisereduce as nr  # pulls in scipy.signal; only the denoising stage pays for it
+    return nr.reduce_noise(y=audio_data, sr=sample_rate, y_noise=noise_source, stationary=True,
+                           prop_decrease=PROP_DECREASE)
+
+
+def noise_profile(audio_data):
+    """The part of the noise signal nr.reduce_noise computes its statistics from."""
+    return audio_data[:LIBRARY_CHUNK_SAMPLES]
+
+
+def _reduce_block(segment, noise, sample_rate, keep_from, keep_to):
+    import noisereduce as nr
+    denoised = nr.reduce_noise(y=segment, sr=sample_rate, y_noise=noise, stationary=True,
+                               prop_decrease=PROP_DECREASE)
+    return denoised[keep_from:keep_to].astype(np.float32)
+
+
+def _get_pool(workers):
+    """One process pool per process, reused across jobs. spawn keeps it safe inside the threaded worker."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _round_to_hop(samples: int) -> int:
+    return max(STFT_HOP_SAMPLES, -(-samples // STFT_HOP_SAMPLES) * STFT_HOP_SAMPLES)
+
+
+def reduce_noise_chunked(audio_data, sample_rate, block_seconds=BLOCK_SECONDS,
+                         overlap_seconds=OVERLAP_SECONDS, workers=WORKERS, noise_source=None):
+    """
+    Denoise blocks in parallel, each with discarded context on both sides, and
+    concatenate them; the result matches reduce_noise_single.
+
+    noise_source is the audio the noise profile is estimated from; it defaults to
+    audio_data but the cloning pipeline passes the untrimmed upload, whose pauses
+    say more about the background noise than the speech-only selection does.
+
+    At most 2 * workers blocks are in flight at once, so extra memory stays bounded
+    by the block size rather than the recording length.
+    """
+    # Blocks are cut within each library chunk, and block sizes and context are whole
+    # STFT hops, so every block keeps the frame grid single-shot uses for that chunk
+    block = _round_to_hop(int(block_seconds * sample_rate))
+    context = _round_to_hop(max(int(overlap_seconds * sample_rate), LIBRARY_PADDING_SAMPLES))
+    if len(audio_data) <= block:
+        return reduce_noise_single(audio_data, sample_rate, noise_source)
+
+    noise = noise_profile(audio_data if noise_source is None else noise_source)
+    spans = []
+    for chunk_start in range(0, len(audio_data), LIBRARY_CHUNK_SAMPLES):
+        chunk_end = min(chunk_start + LIBRARY_CHUNK_SAMPLES, len(audio_data))
+        spans.extend((start, min(start + block, chunk_end)) for start in range(chunk_start, chunk_end, block))
+    starts = [start for start, _ in spans]
+    output = np.empty(len(audio_data), dtype=np.float32)
+
+    def segment(span):
+        start, end = span
+        segment_start = max(0, start - context)
+        segment_end = min(len(audio_data), end + context)
+        return audio_data[segment_start:segment_end], noise, sample_rate, start - segment_start, end - segment_start
+
+    def stitch(index, denoised):
+        output[starts[index]:starts[index] + len(denoised)] = denoised
+
+    if workers <= 1:
+        for index, span in enumerate(spans):
+            stitch(index, _reduce_block(*segment(span)))
+        return output
+
+    pool = _get_pool(workers)
+    in_flight = {}
+    max_in_flight = 2 * workers
+    next_index = 0
+    while next_index < len(starts) or in_flight:
+        while next_index < len(starts) and len(in_flight) < max_in_flight:
+            in_flight[next_index] = pool.submit(_reduce_block, *segment(spans[next_index]))
+            next_index += 1
+        oldest = min(in_flight)
+        stitch(oldest, in_flight.pop(oldest).result())
+    return output
+
+
+def reduce_noise(audio_data, sample_rate, mode=None, noise_source=None):
+    """Entry point used by the cloning pipeline; NOISE_REDUCTION_MODE picks the implementation."""
+    mode = mode or NOISE_REDUCTION_MODE
+    if mode == "single":
+        return reduce_noise_single(audio_data, sample_rate, noise_source)
+    return reduce_noise_chunked(audio_data, sample_rate, noise_source=noise_source)
+
+
+def compare_noise_reduction(audio_data, sample_rate) -> dict:
+    """Run both implementations on the same audio and report speed and output difference."""
+    started = time.monotonic()
+    single = reduce_noise_single(audio_data, sample_rate)
+    single_seconds = time.monotonic() - started
+
+    started = time.monotonic()
+    chunked = reduce_noise_chunked(audio_data, sample_rate)
+    chunked_seconds = time.monotonic() - started
+
+    difference = single.astype(np.float64) - chunked.astype(np.float64)
+    signal_power = float(np.mean(single.astype(np.float64) ** 2))
+    noise_power = float(np.mean(difference ** 2))
+    return {
+        "audio_seconds": round(len(audio_data) / sample_rate, 2),
+        "workers": WORKERS,
+        "block_seconds": BLOCK_SECONDS,
+        "single_seconds": round(single_seconds, 3),
+        "chunked_seconds": round(chunked_seconds, 3),
+        "speedup": round(single_seconds / chunked_seconds, 2) if chunked_seconds else None,
+        "max_abs_diff": float(np.max(np.abs(difference))) if difference.size else 0.0,
+        "snr_db": round(10 * np.log10(signal_power / noise_power), 2) if noise_power > 0 else None,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python noise_reduction.py <audio_path>", file=sys.stderr)
+        sys.exit(1)
+    import librosa
+    audio_data, sample_rate = librosa.load(sys.argv[1], sr=16000, mono=True)
+    print(json.dumps(compare_noise_reduction(audio_data, sample_rate), indent=2))
@@ -0,0 +1,40 @@
+# Personalization data attached to a voice recording.
+#
+# The Node API stores the fields in camelCase (personalizationData on the
+# VoiceRecording model); the Python pipelines work with the snake_case names
+# below. Missing fields are reported as 'Unknown', as the prompt has always done.
+
+FIELDS = {
+    'loved_one_name': 'lovedOneName',
+    'loved_one_birthday': 'lovedOneBirthday',
+    'user_birthday': 'userBirthday',
+    'nickname_for_user': 'nicknameForUser',
+    'favorite_song': 'favoriteSong',
+    'signature_phrase': 'signaturePhrase',
+    'favorite_topic': 'favoriteTopic',
+    'distinct_greeting': 'distinctGreeting',
+    'distinct_goodbye': 'distinctGoodbye',
+    'additional_data': 'additionalData',
+}
+
+UNKNOWN = 'Unknown'
+
+
+def standardize(raw_data: dict) -> dict:
+    """Map the stored camelCase personalization fields to the names used in prompts."""
+    return {field: raw_data.get(source, UNKNOWN) for field, source in FIELDS.items()}
+
+
+def is_known(value) -> bool:
+    return isinstance(value, str) and value.strip() not in ('', UNKNOWN)
+
+
+def known_or(user_data: dict, field: str, default: str) -> str:
+    """The field's value, or default when it is missing or 'Unknown'."""
+    value = user_data.get(field)
+    return value.strip() if is_known(value) else default
+
+
+def fallback_reply(user_data: dict) -> str:
+    """Reply used when OpenAI cannot be reached."""
+    return f"{known_or(user_data, 'distinct_greeting', 'Hello, dear!')} I'm here for you, {known_or(user_data, 'nickname_for_user', 'sweetheart')}. {known_or(user_data, 'signature_phrase', 'I care about you deeply.')}"
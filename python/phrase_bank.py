@@ -0,0 +1,212 @@
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import tts_cache
+import telemetry
+import personalization
+
+# Pre-synthesized persona phrases.
+#
+# A persona's greeting, goodbye, signature phrase and the fallback reply are fixed
+# strings built from its personalization data, yet every turn that uses them used
+# to wait on an ElevenLabs round trip. Right after a voice is cloned they are
+# synthesized in the background into the TTS cache, and a manifest next to the
+# voice's cache entries (<TTS_CACHE_DIR>/<voice_id>/phrase_bank.json) records
+# which texts were built. The talk path answers bare greetings and goodbyes and
+# the OpenAI-failure fallback straight from the bank. When personalization data
+# changes, the talk path notices the manifest is stale and only the phrases whose
+# text changed are synthesized again.
+#
+# Builds run on a background thread inside the warm worker, and in a detached
+# `python phrase_bank.py <voice_id>` process (user data on stdin) otherwise.
+
+PHRASE_BANK_ENABLED = os.getenv("PHRASE_BANK_ENABLED", "1") == "1"
+# Only inputs this short, and made of nothing but the greeting or goodbye, are treated as one
+MAX_INTENT_WORDS = int(os.getenv("PHRASE_BANK_MAX_INTENT_WORDS", "4"))
+
+MANIFEST_FILE = "phrase_bank.json"
+
+GREETING = "greeting"
+GOODBYE = "goodbye"
+SIGNATURE = "signature"
+FALLBACK = "fallback"
+
+# Matched against the whole input (words only), so "never say goodbye" or "see you in heaven" are not intents
+GREETING_PATTERN = re.compile(r"(hi|hello|hey|hiya|howdy|good (morning|afternoon|evening))( there| again)?", re.IGNORECASE)
+GOODBYE_PATTERN = re.compile(r"(bye( bye)?|goodbye|good night|goodnight|see you( later| soon| tomorrow)?"
+                             r"|talk (to you )?(later|soon|tomorrow)|gotta go)( for now| then| now)?", re.IGNORECASE)
+
+log = telemetry.get_logger("phrase_bank")
+
+_executor = None
+_pending_lock = threading.Lock()
+_pending = set()
+
+
+def phrases(user_data: dict) -> dict:
+    """Texts to pre-synthesize for a standardized persona, by kind. Unknown fields are skipped."""
+    bank = {FALLBACK: personalization.fallback_reply(user_data)}
+    for kind, field in ((GREETING, 'distinct_greeting'), (GOODBYE, 'distinct_goodbye'), (SIGNATURE, 'signature_phrase')):
+        if personalization.is_known(user_data.get(field)):
+            bank[kind] = user_data[field].strip()
+    return bank
+
+
+def match_intent(user_input: str):
+    """GREETING or GOODBYE when the input is nothing more than one, else None."""
+    words = re.findall(r"[\w']+", user_input)
+    if not words or len(words) > MAX_INTENT_WORDS:
+        return None
+    utterance = " ".join(words)
+    if GOODBYE_PATTERN.fullmatch(utterance):
+        return GOODBYE
+    if GREETING_PATTERN.fullmatch(utterance):
+        return GREETING
+    return None
+
+
+def _manifest_path(voice_id: str) -> str:
+    return os.path.join(tts_cache.voice_dir(voice_id), MANIFEST_FILE)
+
+
+def load_manifest(voice_id: str) -> dict:
+    try:
+        with open(_manifest_path(voice_id), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_manifest(voice_id: str, manifest: dict):
+    path = _manifest_path(voice_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def is_stale(voice_id: str, user_data: dict, model: str, output_format: str) -> bool:
+    """True when the texts changed or TTS cache eviction dropped banked audio."""
+    manifest = load_manifest(voice_id)
+    if (manifest.get("phrases") != phrases(user_data)
+            or manifest.get("model") != model
+            or manifest.get("output_format") != output_format):
+        return True
+    return tts_cache.CACHE_ENABLED and not all(tts_cache.contains(voice_id, text, model, output_format)
+                                               for text in manifest["phrases"].values())
+
+
+def get(voice_id: str, kind: str, user_data: dict, model: str, output_format: str):
+    """(text, audio) for a banked phrase, or None when it is unknown or not built yet."""
+    if not PHRASE_BANK_ENABLED:
+        return None
+    text = phrases(user_data).get(kind)
+    if not text or load_manifest(voice_id).get("phrases", {}).get(kind) != text:
+        return None
+    audio = tts_cache.get(voice_id, text, model, output_format)
+    return (text, audio) if audio is not None else None
+
+
+def build(voice_id: str, user_data: dict, model: str, output_format: str, synthesize) -> dict:
+    """
+    Synthesize the persona's phrases that are not already in the TTS cache.
+
+    synthesize(text) returns audio bytes. Concurrent builds for the same voice are
+    skipped rather than duplicated. Returns {"built": [...], "reused": [...]}.
+    """
+    result = {"built": [], "reused": []}
+    if not PHRASE_BANK_ENABLED:
+        return result
+    directory = tts_cache.voice_dir(voice_id)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".phrase_bank.lock"), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log.debug(f"Phrase bank for {voice_id} is already being built")
+            return result
+
+        started = time.monotonic()
+        bank = phrases(user_data)
+        for kind, text in bank.items():
+            if tts_cache.get(voice_id, text, model, output_format) is not None:
+                result["reused"].append(kind)
+                continue
+            tts_cache.put(voice_id, text, model, output_format, synthesize(text))
+            result["built"].append(kind)
+
+        _write_manifest(voice_id, {
+            "voice_id": voice_id,
+            "model": model,
+            "output_format": output_format,
+            "phrases": bank,
+            "built_at": time.time(),
+        })
+    log.info(f"Phrase bank for {voice_id}: built {result['built']}, reused {result['reused']} "
+             f"in {time.monotonic() - started:.2f}s")
+    return result
+
+
+def enable_in_process_builds():
+    """Called by the warm worker: run builds on a background thread instead of a child process."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="phrase-bank")
+
+
+def _build_in_process(voice_id: str, raw_user_data: dict):
+    try:
+        import generate_ai_response
+        generate_ai_response.build_phrase_bank(voice_id, personalization.standardize(raw_user_data))
+    except Exception as e:
+        log.warning(f"Phrase bank build for {voice_id} failed: {str(e)}")
+    finally:
+        with _pending_lock:
+            _pending.discard(voice_id)
+
+
+def schedule_build(voice_id: str, raw_user_data: dict):
+    """Start a background (re)build of a voice's phrase bank without waiting for it."""
+    if not PHRASE_BANK_ENABLED or not voice_id or raw_user_data is None:
+        return
+    with _pending_lock:
+        if voice_id in _pending:
+            return
+        _pending.add(voice_id)
+
+    if _executor is not None:
+        _executor.submit(_build_in_process, voice_id, raw_user_data)
+        return
+
+    try:
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), voice_id],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            start_new_session=True,
+        )
+        process.stdin.write(json.dumps(raw_user_data).encode("utf-8"))
+        process.stdin.close()
+        log.info(f"Scheduled phrase bank build for {voice_id} (pid {process.pid})")
+    except OSError as e:
+        log.warning(f"Could not start phrase bank build for {voice_id}: {str(e)}")
+    finally:
+        with _pending_lock:
+            _pending.discard(voice_id)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python phrase_bank.py <cloned_voice_id>  (personalization JSON on stdin)", file=sys.stderr)
+        sys.exit(1)
+    _build_in_process(sys.argv[1], json.load(sys.stdin))
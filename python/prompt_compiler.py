@@ -0,0 +1,320 @@
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import personalization
+
+# Prompt compilation for the talk pipeline.
+#
+# Every prompt is laid out the same way, most stable part first, so the
+# provider's prompt caching can reuse the shared prefix across turns:
+#
+#   system     INSTRUCTIONS + persona block      (same for every turn of a persona)
+#   system     summary of older turns            (changes only when turns are folded in)
+#   user/asst  the most recent turns, verbatim
+#   user       the new input
+#
+# The persona block lists only the personalization fields that are actually
+# set (additional_data included) and is cached per personalization hash.
+# Conversations are kept per conversation id under CONVERSATION_DIR. Turns
+# beyond CONVERSATION_MAX_TURNS / CONVERSATION_HISTORY_TOKENS are folded into
+# a short extractive summary, itself capped at CONVERSATION_SUMMARY_TOKENS,
+# so memory costs a bounded number of tokens however long a conversation
+# runs. Conversations idle for CONVERSATION_TTL_SECONDS are forgotten, and
+# every CONVERSATION_PRUNE_EVERY writes their files (and lock files) are
+# deleted. The whole prompt never exceeds PROMPT_MAX_TOKENS: the oldest turns
+# and then the summary are left out first. Tokens are estimated at about
+# four characters each, which is close enough for budgeting.
+
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "1500"))
+MEMORY_ENABLED = os.getenv("CONVERSATION_MEMORY_ENABLED", "1") == "1"
+CONVERSATION_DIR = os.getenv("CONVERSATION_DIR", "/app/uploads/conversations")
+MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "8"))
+HISTORY_TOKENS = int(os.getenv("CONVERSATION_HISTORY_TOKENS", "600"))
+SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "200"))
+CONVERSATION_TTL_SECONDS = float(os.getenv("CONVERSATION_TTL_SECONDS", str(7 * 24 * 3600)))
+PRUNE_EVERY_N_WRITES = int(os.getenv("CONVERSATION_PRUNE_EVERY", "50"))
+# additional_data is free text; it must not crowd out the conversation
+ADDITIONAL_DATA_TOKENS = 300
+PERSONA_CACHE_SIZE = 256
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+# Longest excerpt of a turn kept in the summary
+GIST_CHARS = 120
+
+INSTRUCTIONS = """You are the user's loved one, having a warm, caring, and supportive conversation with them. Reply in a natural, loving tone based on the context of what the user just said, without repeating their words.
+
+Sound like the loved one described below. Bring in details about yourself or your relationship only when it feels right in the conversation. If the user mentions the favorite song, signature phrase, or special moments, include that in a personal way."""
+
+# (field, line template) in prompt order
+PERSONA_LINES = (
+    ('loved_one_name', "Your name is {}."),
+    ('nickname_for_user', 'You call the user "{}".'),
+    ('distinct_greeting', 'Your usual greeting: "{}"'),
+    ('distinct_goodbye', 'Your usual goodbye: "{}"'),
+    ('signature_phrase', 'You often say: "{}"'),
+    ('favorite_song', "A song you share: {}."),
+    ('favorite_topic', "A favorite topic of yours: {}."),
+    ('user_birthday', "The user's birthday: {}."),
+    ('loved_one_birthday', "Your birthday: {}."),
+    ('additional_data', "More about the user: {}"),
+)
+
+_persona_lock = threading.Lock()
+_writes_lock = threading.Lock()
+# Starts one short, so a process prunes on its first write as well
+_writes_since_prune = PRUNE_EVERY_N_WRITES - 1
+_persona_cache = OrderedDict()
+_persona_stats = {"hits": 0, "misses": 0}
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _message_tokens(message: dict) -> int:
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + "..."
+
+
+# Persona block
+
+def _persona_hash(user_data: dict) -> str:
+    known = {field: user_data[field].strip() for field, _ in PERSONA_LINES
+             if personalization.is_known(user_data.get(field))}
+    return hashlib.sha256(json.dumps(known, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _build_persona_block(user_data: dict) -> str:
+    lines = []
+    for field, template in PERSONA_LINES:
+        value = user_data.get(field)
+        if not personalization.is_known(value):
+            continue
+        value = value.strip()
+        if field == 'additional_data':
+            value = _truncate(value, ADDITIONAL_DATA_TOKENS)
+        lines.append(f"- {template.format(value)}")
+    if not lines:
+        return INSTRUCTIONS
+    return f"{INSTRUCTIONS}\n\nAbout you and the user:\n" + "\n".join(lines)
+
+
+def persona_block(user_data: dict):
+    """(system prompt for a standardized persona, True when it came from the cache)."""
+    key = _persona_hash(user_data)
+    with _persona_lock:
+        block = _persona_cache.get(key)
+        if block is not None:
+            _persona_cache.move_to_end(key)
+            _persona_stats["hits"] += 1
+            return block, True
+        _persona_stats["misses"] += 1
+    block = _build_persona_block(user_data)
+    with _persona_lock:
+        _persona_cache[key] = block
+        while len(_persona_cache) > PERSONA_CACHE_SIZE:
+            _persona_cache.popitem(last=False)
+    return block, False
+
+
+# Conversation memory
+
+def _conversation_path(conversation_id: str) -> str:
+    digest = hashlib.sha256(conversation_id.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(CONVERSATION_DIR, f"{digest}.json")
+
+
+def _empty_conversation() -> dict:
+    return {"summary": [], "turns": [], "updated_at": None}
+
+
+def load_conversation(conversation_id: str) -> dict:
+    if not MEMORY_ENABLED or not conversation_id:
+        return _empty_conversation()
+    try:
+        with open(_conversation_path(conversation_id), "r") as f:
+            conversation = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return _empty_conversation()
+    if time.time() - (conversation.get("updated_at") or 0) > CONVERSATION_TTL_SECONDS:
+        return _empty_conversation()
+    return conversation
+
+
+def _write_conversation(path: str, conversation: dict):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(conversation, f)
+    os.replace(tmp_path, path)
+
+
+def _gist(text: str) -> str:
+    """First sentence of a turn, cut to GIST_CHARS."""
+    text = re.sub(r"\s+", " ", text).strip()
+    first = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    return first if len(first) <= GIST_CHARS else first[:GIST_CHARS].rsplit(" ", 1)[0] + "..."
+
+
+def _turn_tokens(turn: dict) -> int:
+    return estimate_tokens(turn["user"]) + estimate_tokens(turn["assistant"]) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+def _fold_oldest_turns(conversation: dict):
+    """Move turns over the history limits into the summary, then trim the summary to its budget."""
+    turns = conversation["turns"]
+    while turns and (len(turns) > MAX_TURNS or sum(_turn_tokens(turn) for turn in turns) > HISTORY_TOKENS):
+        turn = turns.pop(0)
+        conversation["summary"].append(f"They said: {_gist(turn['user'])} You said: {_gist(turn['assistant'])}")
+    summary = conversation["summary"]
+    while summary and estimate_tokens("\n".join(summary)) > SUMMARY_TOKENS:
+        summary.pop(0)
+
+
+def _lock_conversation(path: str):
+    """Open and exclusively lock the conversation's lock file, which prune() may delete meanwhile."""
+    while True:
+        lock_file = open(f"{path}.lock", "a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.stat(lock_file.name).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                return lock_file
+        except FileNotFoundError:
+            pass
+        lock_file.close()
+
+
+def record_turn(conversation_id: str, user_input: str, reply: str):
+    """Append a finished turn to the conversation; safe across processes."""
+    global _writes_since_prune
+    if not MEMORY_ENABLED or not conversation_id:
+        return
+    path = _conversation_path(conversation_id)
+    os.makedirs(CONVERSATION_DIR, exist_ok=True)
+    with _lock_conversation(path):
+        conversation = load_conversation(conversation_id)
+        conversation["turns"].append({"user": user_input, "assistant": reply, "at": time.time()})
+        _fold_oldest_turns(conversation)
+        conversation["updated_at"] = time.time()
+        _write_conversation(path, conversation)
+
+    with _writes_lock:
+        _writes_since_prune += 1
+        should_prune = _writes_since_prune >= PRUNE_EVERY_N_WRITES
+        if should_prune:
+            _writes_since_prune = 0
+    if should_prune:
+        prune()
+
+
+def prune() -> int:
+    """Delete conversations idle for longer than CONVERSATION_TTL_SECONDS with their lock files; returns how many."""
+    if not os.path.isdir(CONVERSATION_DIR):
+        return 0
+    with open(os.path.join(CONVERSATION_DIR, ".prune.lock"), "a") as prune_lock:
+        try:
+            fcntl.flock(prune_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0
+
+        cutoff = time.time() - CONVERSATION_TTL_SECONDS
+        last_written = {}
+        for entry in os.scandir(CONVERSATION_DIR):
+            base, extension = os.path.splitext(entry.path)
+            if entry.name.startswith(".") or extension not in (".json", ".lock", ".tmp"):
+                continue
+            if extension == ".lock":
+                base = os.path.splitext(base)[0]
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if extension == ".tmp":
+                # Left behind by a writer that died between mkstemp and rename
+                if mtime < cutoff:
+                    os.remove(entry.path)
+                continue
+            last_written[base] = max(last_written.get(base, 0), mtime)
+
+        removed = 0
+        for base, mtime in last_written.items():
+            if mtime >= cutoff:
+                continue
+            with open(f"{base}.json.lock", "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # a turn is being recorded right now
+                try:
+                    if os.path.getmtime(f"{base}.json") >= cutoff:
+                        continue
+                    os.remove(f"{base}.json")
+                except FileNotFoundError:
+                    pass
+                os.remove(f"{base}.json.lock")
+                removed += 1
+    if removed:
+        print(f"Pruned {removed} expired conversations", file=sys.stderr)
+    return removed
+
+
+# Compilation
+
+def compile_prompt(user_data: dict, user_input: str, conversation_id: str = None) -> dict:
+    """
+    Build the chat messages for one turn within PROMPT_MAX_TOKENS.
+
+    Returns {"messages", "tokens" (estimated), "history_turns", "summary_lines",
+    "persona_cached"}.
+    """
+    system_prompt, persona_cached = persona_block(user_data)
+    system = {"role": "system", "content": system_prompt}
+    remaining = PROMPT_MAX_TOKENS - _message_tokens(system)
+    # A huge input still has to fit; keep its beginning
+    current = {"role": "user", "content": _truncate(user_input, max(remaining - MESSAGE_OVERHEAD_TOKENS, 1))}
+    remaining -= _message_tokens(current)
+
+    conversation = load_conversation(conversation_id)
+    history = []
+    for turn in reversed(conversation["turns"]):
+        cost = _turn_tokens(turn)
+        if cost > remaining:
+            break
+        history[:0] = [{"role": "user", "content": turn["user"]}, {"role": "assistant", "content": turn["assistant"]}]
+        remaining -= cost
+
+    summary_lines = list(conversation["summary"])
+    summary = None
+    while summary_lines:
+        summary = {"role": "system", "content": "Earlier in this conversation:\n" + "\n".join(summary_lines)}
+        if _message_tokens(summary) <= remaining:
+            break
+        summary_lines.pop(0)
+        summary = None
+
+    messages = [system] + ([summary] if summary else []) + history + [current]
+    return {
+        "messages": messages,
+        "tokens": sum(_message_tokens(message) for message in messages),
+        "history_turns": len(history) // 2,
+        "summary_lines": len(summary_lines),
+        "persona_cached": persona_cached,
+    }
+
+
+def stats() -> dict:
+    with _persona_lock:
+        return {"personas": len(_persona_cache), **_persona_stats}
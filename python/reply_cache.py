@@ -0,0 +1,175 @@
+import os
+import re
+import json
+import time
+import zlib
+import random
+import hashlib
+import threading
+import numpy as np
+
+# Semantic cache of LLM replies, scoped per persona (voice + personalization data).
+#
+# Short conversational turns ("hi", "good night", "I miss you") repeat constantly.
+# Each past user input is embedded as a bag of hashed character n-grams in a
+# per-persona NumPy matrix; a new input whose cosine similarity to a stored one
+# is above REPLY_CACHE_THRESHOLD is answered with a stored reply instead of a new
+# OpenAI call. Every entry keeps a few reply variants and a hit occasionally falls
+# through to the LLM (REPLY_CACHE_REFRESH_PROBABILITY) to collect another one, so
+# repeated greetings do not always get the same words back.
+#
+# The cache lives in process memory, so it pays off inside the warm worker.
+
+CACHE_ENABLED = os.getenv("REPLY_CACHE_ENABLED", "0") == "1"
+SIMILARITY_THRESHOLD = float(os.getenv("REPLY_CACHE_THRESHOLD", "0.9"))
+TTL_SECONDS = float(os.getenv("REPLY_CACHE_TTL_SECONDS", str(24 * 3600)))
+PERSONA_CAPACITY = int(os.getenv("REPLY_CACHE_PERSONA_CAPACITY", "256"))
+MAX_PERSONAS = int(os.getenv("REPLY_CACHE_MAX_PERSONAS", "1024"))
+MAX_VARIANTS = int(os.getenv("REPLY_CACHE_MAX_VARIANTS", "4"))
+REFRESH_PROBABILITY = float(os.getenv("REPLY_CACHE_REFRESH_PROBABILITY", "0.15"))
+# Inputs longer than this are rarely repeated and would only pollute the index
+MAX_INPUT_CHARS = int(os.getenv("REPLY_CACHE_MAX_INPUT_CHARS", "120"))
+
+VECTOR_DIM = 2048
+NGRAM_SIZES = (2, 3, 4)
+
+
+def normalize_input(text: str) -> str:
+    text = re.sub(r"[^\w\s']", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def embed(text: str) -> np.ndarray:
+    """L2-normalized hashed character n-gram vector of the normalized text."""
+    padded = f" {normalize_input(text)} "
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    for n in NGRAM_SIZES:
+        for i in range(len(padded) - n + 1):
+            # crc32 instead of hash() so vectors are stable across processes
+            vector[zlib.crc32(padded[i:i + n].encode("utf-8")) % VECTOR_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def persona_key(voice_id: str, user_data: dict) -> str:
+    digest = hashlib.sha256(json.dumps(user_data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{voice_id}:{digest[:16]}"
+
+
+class _PersonaIndex:
+    def __init__(self):
+        self.vectors = np.zeros((0, VECTOR_DIM), dtype=np.float32)
+        self.inputs = []
+        self.replies = []
+        self.created_at = []
+        self.last_used_at = []
+
+    def _remove(self, indices):
+        keep = [i for i in range(len(self.inputs)) if i not in set(indices)]
+        self.vectors = self.vectors[keep]
+        self.inputs = [self.inputs[i] for i in keep]
+        self.replies = [self.replies[i] for i in keep]
+        self.created_at = [self.created_at[i] for i in keep]
+        self.last_used_at = [self.last_used_at[i] for i in keep]
+
+    def expire(self, now):
+        expired = [i for i, created in enumerate(self.created_at) if now - created > TTL_SECONDS]
+        if expired:
+            self._remove(expired)
+
+    def best_match(self, vector):
+        if not self.inputs:
+            return None, 0.0
+        similarities = self.vectors @ vector
+        best = int(np.argmax(similarities))
+        return best, float(similarities[best])
+
+    def add(self, vector, user_input, reply, now):
+        if len(self.inputs) >= PERSONA_CAPACITY:
+            self._remove([int(np.argmin(self.last_used_at))])
+        self.vectors = np.vstack([self.vectors, vector[np.newaxis, :]])
+        self.inputs.append(user_input)
+        self.replies.append([reply])
+        self.created_at.append(now)
+        self.last_used_at.append(now)
+
+
+_lock = threading.Lock()
+_personas = {}
+_persona_last_used = {}
+_stats = {"lookups": 0, "hits": 0, "misses": 0, "refreshes": 0, "stores": 0, "skipped_llm_seconds": 0.0}
+# Running average of real LLM latency, used to estimate the time each hit saved
+_llm_latency_avg = None
+
+
+def lookup(persona: str, user_input: str):
+    """Return a cached reply for a near-duplicate input, or None."""
+    if not CACHE_ENABLED or len(user_input) > MAX_INPUT_CHARS:
+        return None
+    vector = embed(user_input)
+    now = time.time()
+    with _lock:
+        _stats["lookups"] += 1
+        index = _personas.get(persona)
+        if index is None:
+            _stats["misses"] += 1
+            return None
+        _persona_last_used[persona] = now
+        index.expire(now)
+        best, similarity = index.best_match(vector)
+        if best is None or similarity < SIMILARITY_THRESHOLD:
+            _stats["misses"] += 1
+            return None
+        variants = index.replies[best]
+        if len(variants) < MAX_VARIANTS and random.random() < REFRESH_PROBABILITY:
+            _stats["refreshes"] += 1
+            _stats["misses"] += 1
+            return None
+        index.last_used_at[best] = now
+        _stats["hits"] += 1
+        _stats["skipped_llm_seconds"] += _llm_latency_avg or 0.0
+        return random.choice(variants)
+
+
+def store(persona: str, user_input: str, reply: str, llm_seconds: float = None):
+    """Index a fresh LLM reply; a near-duplicate input adds a variant to the existing entry."""
+    global _llm_latency_avg
+    if not CACHE_ENABLED or not reply:
+        return
+    if llm_seconds is not None:
+        with _lock:
+            _llm_latency_avg = llm_seconds if _llm_latency_avg is None else 0.9 * _llm_latency_avg + 0.1 * llm_seconds
+    if len(user_input) > MAX_INPUT_CHARS:
+        return
+
+    vector = embed(user_input)
+    now = time.time()
+    with _lock:
+        index = _personas.get(persona)
+        if index is None:
+            if len(_personas) >= MAX_PERSONAS:
+                oldest = min(_persona_last_used, key=_persona_last_used.get)
+                _personas.pop(oldest, None)
+                _persona_last_used.pop(oldest, None)
+            index = _personas[persona] = _PersonaIndex()
+        _persona_last_used[persona] = now
+
+        best, similarity = index.best_match(vector)
+        if best is not None and similarity >= SIMILARITY_THRESHOLD:
+            if reply not in index.replies[best] and len(index.replies[best]) < MAX_VARIANTS:
+                index.replies[best].append(reply)
+            index.last_used_at[best] = now
+        else:
+            index.add(vector, user_input, reply, now)
+        _stats["stores"] += 1
+
+
+def stats() -> dict:
+    with _lock:
+        snapshot = dict(_stats)
+        snapshot["personas"] = len(_personas)
+        snapshot["entries"] = sum(len(index.inputs) for index in _personas.values())
+        snapshot["avg_llm_seconds"] = round(_llm_latency_avg, 3) if _llm_latency_avg is not None else None
+    snapshot["hit_rate"] = round(snapshot["hits"] / snapshot["lookups"], 4) if snapshot["lookups"] else 0.0
+    snapshot["skipped_llm_seconds"] = round(snapshot["skipped_llm_seconds"], 3)
+    return snapshot
@@ -0,0 +1,142 @@
+import os
+import numpy as np
+
+# Speech-activity trimming before noise reduction and cloning.
+#
+# Uploads often carry long silences, music or crosstalk. A vectorized energy /
+# spectral voice-activity detector marks speech frames, nearby frames are merged
+# into segments, and the cleanest segments are kept up to CLONE_MAX_SPEECH_SECONDS
+# (ElevenLabs instant cloning gains nothing beyond a couple of minutes). Denoise
+# time and upload size then scale with usable speech instead of raw length.
+
+VAD_ENABLED = os.getenv("CLONE_VAD_ENABLED", "1") == "1"
+MAX_SPEECH_SECONDS = float(os.getenv("CLONE_MAX_SPEECH_SECONDS", "120"))
+# If less speech than this is found the detector is probably wrong; keep the whole upload
+MIN_SPEECH_SECONDS = float(os.getenv("CLONE_MIN_SPEECH_SECONDS", "5"))
+# Speech frames must be this many dB above the recording's noise floor
+ENERGY_MARGIN_DB = float(os.getenv("CLONE_VAD_ENERGY_MARGIN_DB", "8"))
+
+FRAME_SECONDS = 0.030
+HOP_SECONDS = 0.010
+# Gaps shorter than this between speech frames stay inside one segment
+MERGE_GAP_SECONDS = 0.300
+MIN_SEGMENT_SECONDS = 0.500
+MAX_FLATNESS = 0.45
+MIN_SPEECH_BAND_RATIO = 0.6
+SPEECH_BAND_HZ = (80.0, 4000.0)
+# Frames are analysed in batches so feature memory stays bounded on long uploads
+_BATCH_FRAMES = 8192
+
+
+def frame_features(audio_data, sample_rate):
+    """Per-frame energy (dB), spectral flatness and speech-band energy ratio."""
+    frame = int(FRAME_SECONDS * sample_rate)
+    hop = int(HOP_SECONDS * sample_rate)
+    if len(audio_data) < frame:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+
+    window = np.hanning(frame).astype(np.float32)
+    freqs = np.fft.rfftfreq(frame, d=1.0 / sample_rate)
+    band = (freqs >= SPEECH_BAND_HZ[0]) & (freqs <= SPEECH_BAND_HZ[1])
+    frames_view = np.lib.stride_tricks.sliding_window_view(audio_data, frame)[::hop]
+
+    energy_db, flatness, band_ratio = [], [], []
+    for start in range(0, len(frames_view), _BATCH_FRAMES):
+        frames = frames_view[start:start + _BATCH_FRAMES]
+        rms = np.sqrt(np.mean(frames.astype(np.float32) ** 2, axis=1))
+        energy_db.append(20.0 * np.log10(rms + 1e-10))
+
+        power = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2 + 1e-12
+        flatness.append(np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1))
+        band_ratio.append(power[:, band].sum(axis=1) / power.sum(axis=1))
+
+    return np.concatenate(energy_db), np.concatenate(flatness), np.concatenate(band_ratio)
+
+
+def _runs(mask):
+    """(start, end) frame index pairs of consecutive True values."""
+    padded = np.concatenate([[False], mask, [False]])
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def speech_segments(audio_data, sample_rate):
+    """
+    Return (segments, noise_floor_db, energy_db, flatness) where segments are
+    (start_frame, end_frame) pairs of detected speech.
+    """
+    energy_db, flatness, band_ratio = frame_features(audio_data, sample_rate)
+    if energy_db.size == 0:
+        return [], 0.0, energy_db, flatness
+
+    noise_floor_db = float(np.percentile(energy_db, 10))
+    speech = (
+        (energy_db > noise_floor_db + ENERGY_MARGIN_DB)
+        & (flatness < MAX_FLATNESS)
+        & (band_ratio > MIN_SPEECH_BAND_RATIO)
+    )
+
+    # Close short pauses between words, then drop blips too short to be speech
+    merge_gap = int(MERGE_GAP_SECONDS / HOP_SECONDS)
+    for start, end in _runs(~speech):
+        if start > 0 and end < len(speech) and end - start <= merge_gap:
+            speech[start:end] = True
+    min_frames = int(MIN_SEGMENT_SECONDS / HOP_SECONDS)
+    segments = [(int(start), int(end)) for start, end in _runs(speech) if end - start >= min_frames]
+    return segments, noise_floor_db, energy_db, flatness
+
+
+def select_speech(audio_data, sample_rate, max_seconds=MAX_SPEECH_SECONDS):
+    """
+    Keep the best speech segments, up to max_seconds, in their original order.
+
+    Segments are ranked by loudness above the noise floor, tonality (low flatness)
+    and syllabic energy variation, which favours clean close-mic speech over music
+    and distant crosstalk. Returns (audio, report).
+    """
+    total_seconds = len(audio_data) / sample_rate
+    report = {"enabled": VAD_ENABLED, "total_seconds": round(total_seconds, 2)}
+    if not VAD_ENABLED:
+        report.update({"kept_seconds": report["total_seconds"], "kept_ratio": 1.0})
+        return audio_data, report
+
+    segments, noise_floor_db, energy_db, flatness = speech_segments(audio_data, sample_rate)
+    hop = int(HOP_SECONDS * sample_rate)
+    speech_seconds = sum(end - start for start, end in segments) * HOP_SECONDS
+    report.update({
+        "speech_seconds": round(speech_seconds, 2),
+        "segments_detected": len(segments),
+        "noise_floor_db": round(noise_floor_db, 1),
+    })
+
+    if speech_seconds < MIN_SPEECH_SECONDS:
+        report.update({"kept_seconds": report["total_seconds"], "kept_ratio": 1.0, "fallback": "too little speech detected"})
+        return audio_data, report
+
+    scores = []
+    for start, end in segments:
+        segment_energy = energy_db[start:end]
+        snr = float(np.mean(segment_energy)) - noise_floor_db
+        tonality = 1.0 - float(np.mean(flatness[start:end]))
+        modulation = min(float(np.std(segment_energy)) / 10.0, 1.0)
+        scores.append(snr * tonality * (0.5 + modulation))
+
+    budget_frames = int(max_seconds / HOP_SECONDS)
+    chosen, used_frames = [], 0
+    for index in np.argsort(scores)[::-1]:
+        start, end = segments[index]
+        if used_frames >= budget_frames:
+            break
+        end = min(end, start + budget_frames - used_frames)
+        chosen.append((start, end))
+        used_frames += end - start
+    chosen.sort()
+
+    trimmed = np.concatenate([audio_data[start * hop:end * hop + int(FRAME_SECONDS * sample_rate)] for start, end in chosen])
+    kept_seconds = len(trimmed) / sample_rate
+    report.update({
+        "segments_kept": len(chosen),
+        "kept_seconds": round(kept_seconds, 2),
+        "kept_ratio": round(kept_seconds / total_seconds, 4) if total_seconds else 1.0,
+    })
+    return trimmed.astype(np.float32, copy=False), report
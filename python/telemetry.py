@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Stage timing, metrics and logging for the voice pipelines.
+#
+# Every job runs inside trace(), and every stage inside it (JSON load, prompt
+# build, LLM call, TTS call, decode, noise reduction, clone upload, ...) inside
+# span(). Spans are timed with time.monotonic() and carry optional attributes
+# with well-known names:
+#
+#   bytes_in / bytes_out          payload sizes
+#   audio_seconds                 duration of the audio the stage handled
+#   prompt_tokens / completion_tokens
+#   cache                         "hit" / "miss" / ... for cache lookups
+#
+# When a trace ends it is appended as one JSON line to TELEMETRY_JSONL_PATH
+# (rotated to <path>.1 once it passes TELEMETRY_JSONL_MAX_BYTES, so at most two
+# files are kept; an empty path turns the file off), and all spans feed process-wide counters and histograms that prometheus_text()
+# renders in the Prometheus text format (served by the worker, or written with
+# write_prometheus()).
+#
+# Progress messages go through get_logger(); VOICE_LOG_LEVEL (default INFO)
+# keeps the per-step chatter (DEBUG) off stdout on the hot path.
+
+LOG_LEVEL = os.getenv("VOICE_LOG_LEVEL", "INFO").upper()
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "1") == "1"
+JSONL_PATH = os.getenv("TELEMETRY_JSONL_PATH", "/app/uploads/telemetry/spans.jsonl")
+JSONL_MAX_BYTES = int(os.getenv("TELEMETRY_JSONL_MAX_BYTES", str(50 * 1024 * 1024)))
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_current_trace = contextvars.ContextVar("telemetry_trace", default=None)
+_metrics_lock = threading.Lock()
+_write_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+_COUNTER_HELP = {
+    "voice_jobs_total": "Pipeline jobs by outcome.",
+    "voice_stage_bytes_total": "Bytes read (in) and produced (out) per stage.",
+    "voice_stage_audio_seconds_total": "Seconds of audio handled per stage.",
+    "voice_llm_tokens_total": "OpenAI tokens by kind.",
+    "voice_cache_events_total": "Cache lookups by cache and outcome.",
+}
+_HISTOGRAM_HELP = {
+    "voice_job_seconds": "Wall time of whole pipeline jobs.",
+    "voice_stage_seconds": "Wall time of pipeline stages.",
+}
+
+
+# Logging
+
+class _ConsoleHandler(logging.Handler):
+    """Writes to whatever sys.stdout/sys.stderr are at emit time, so stdout swaps keep working."""
+
+    def emit(self, record):
+        try:
+            stream = sys.stderr if record.levelno >= logging.WARNING else sys.stdout
+            stream.write(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+
+_root_logger = logging.getLogger("voice")
+if not _root_logger.handlers:
+    _handler = _ConsoleHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    _root_logger.addHandler(_handler)
+    _root_logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    _root_logger.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    return _root_logger.getChild(name)
+
+
+# Metrics
+
+def _labels_key(labels: dict):
+    return tuple(sorted(labels.items()))
+
+
+def count(name: str, amount: float = 1, **labels):
+    with _metrics_lock:
+        series = _counters.setdefault(name, {})
+        key = _labels_key(labels)
+        series[key] = series.get(key, 0) + amount
+
+
+def observe(name: str, value: float, **labels):
+    with _metrics_lock:
+        series = _histograms.setdefault(name, {})
+        key = _labels_key(labels)
+        if key not in series:
+            series[key] = {"buckets": [0] * len(SECONDS_BUCKETS), "sum": 0.0, "count": 0}
+        histogram = series[key]
+        for index, bound in enumerate(SECONDS_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def cache_event(cache: str, outcome: str):
+    count("voice_cache_events_total", cache=cache, outcome=outcome)
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in pairs) + "}"
+
+
+def prometheus_text() -> str:
+    lines = []
+    with _metrics_lock:
+        for name, series in sorted(_counters.items()):
+            lines.append(f"# HELP {name} {_COUNTER_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, series in sorted(_histograms.items()):
+            lines.append(f"# HELP {name} {_HISTOGRAM_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in sorted(series.items()):
+                for bound, bucket_count in zip(SECONDS_BUCKETS, histogram["buckets"]):
+                    lines.append(f"{name}_bucket{_format_labels(key, {'le': bound})} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(key, {'le': '+Inf'})} {histogram['count']}")
+                lines.append(f"{name}_sum{_format_labels(key)} {round(histogram['sum'], 6)}")
+                lines.append(f"{name}_count{_format_labels(key)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str):
+    """Dump the current metrics to a file, e.g. for node_exporter's textfile collector."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
+
+
+# Spans
+
+class Span:
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.seconds = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {"name": self.name, "seconds": round(self.seconds, 6), **self.attrs}
+
+
+def _record_span(span_record: Span):
+    observe("voice_stage_seconds", span_record.seconds, stage=span_record.name)
+    attrs = span_record.attrs
+    if attrs.get("bytes_in"):
+        count("voice_stage_bytes_total", attrs["bytes_in"], stage=span_record.name, direction="in")
+    if attrs.get("bytes_out"):
+        count("voice_stage_bytes_total", attrs["bytes_out"], stage=span_record.name, direction="out")
+    if attrs.get("audio_seconds"):
+        count("voice_stage_audio_seconds_total", attrs["audio_seconds"], stage=span_record.name)
+    for kind in ("prompt", "completion"):
+        if attrs.get(f"{kind}_tokens"):
+            count("voice_llm_tokens_total", attrs[f"{kind}_tokens"], kind=kind)
+    if attrs.get("cache"):
+        cache_event(span_record.name, attrs["cache"])
+
+    current = _current_trace.get()
+    if current is not None:
+        current["spans"].append(span_record.to_dict())
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time one stage of the current job. Attributes can be added with .set() inside the block."""
+    span_record = Span(name, attrs)
+    started = time.monotonic()
+    try:
+        yield span_record
+    except BaseException as e:
+        span_record.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        span_record.seconds = time.monotonic() - started
+        if TELEMETRY_ENABLED:
+            _record_span(span_record)
+
+
+def annotate(**attrs):
+    """Attach attributes to the current job as a whole."""
+    current = _current_trace.get()
+    if current is not None:
+        current.update(attrs)
+
+
+def _write_jsonl(record: dict):
+    if not JSONL_PATH:
+        return
+    try:
+        os.makedirs(os.path.dirname(JSONL_PATH) or ".", exist_ok=True)
+        line = json.dumps(record, default=str) + "\n"
+        with _write_lock, open(JSONL_PATH, "a") as f:
+            f.write(line)
+            # Another process may rotate at the same time; either way the file stays bounded
+            if f.tell() >= JSONL_MAX_BYTES:
+                os.replace(JSONL_PATH, JSONL_PATH + ".1")
+    except OSError as e:
+        print(f"Could not write telemetry to {JSONL_PATH}: {str(e)}", file=sys.stderr)
+
+
+@contextmanager
+def trace(pipeline: str, **attrs):
+    """Collect the spans of one job; emits a JSON line and job metrics when the block ends."""
+    record = {"pipeline": pipeline, "trace_id": uuid.uuid4().hex[:16], "started_at": time.time(),
+              "status": "ok", **attrs, "spans": []}
+    token = _current_trace.set(record)
+    started = time.monotonic()
+    try:
+        yield record
+    except BaseException as e:
+        record["status"] = "error"
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        _current_trace.reset(token)
+        record["seconds"] = round(time.monotonic() - started, 6)
+        if TELEMETRY_ENABLED:
+            count("voice_jobs_total", pipeline=pipeline, status=record["status"])
+            observe("voice_job_seconds", record["seconds"], pipeline=pipeline)
+            _write_jsonl(record)
+            stages = ", ".join(f"{s['name']} {s['seconds']:.3f}s" for s in record["spans"])
+            get_logger(pipeline).info(f"{pipeline} job {record['status']} in {record['seconds']:.3f}s ({stages})")
@@ -0,0 +1,182 @@
+import os
+import sys
+import re
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import threading
+import unicodedata
+
+# Content-addressed on-disk cache for synthesized speech.
+#
+# Entries live under <TTS_CACHE_DIR>/<voice_id>/<sha256>.audio where the hash covers
+# (voice_id, normalized text, model, output format). Keeping one directory per voice
+# lets delete_voice_by_id drop everything synthesized with a voice in one call.
+# Writes go through a temp file + os.replace so concurrent processes never see a
+# partial entry, and eviction removes the least recently used files (mtime is bumped
+# on every hit) until the cache fits in TTS_CACHE_MAX_BYTES.
+
+CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "1") == "1"
+CACHE_DIR = os.getenv("TTS_CACHE_DIR", "/app/uploads/tts_cache")
+CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Walking the cache is not free, so eviction only runs every N writes per process
+EVICT_EVERY_N_WRITES = int(os.getenv("TTS_CACHE_EVICT_EVERY", "20"))
+
+ENTRY_SUFFIX = ".audio"
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "invalidations": 0}
+_writes_since_evict = 0
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace and unicode forms so trivially different strings share an entry."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(voice_id: str, text: str, model: str, output_format: str) -> str:
+    material = "\x1f".join([voice_id, normalize_text(text), model, output_format])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def voice_dir(voice_id: str) -> str:
+    return os.path.join(CACHE_DIR, re.sub(r"[^A-Za-z0-9_-]", "_", voice_id))
+
+
+def _entry_path(voice_id: str, key: str) -> str:
+    return os.path.join(voice_dir(voice_id), key + ENTRY_SUFFIX)
+
+
+def _count(name: str, amount: int = 1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def get(voice_id: str, text: str, model: str, output_format: str):
+    """Return cached audio bytes, or None on a miss."""
+    if not CACHE_ENABLED:
+        return None
+    path = _entry_path(voice_id, cache_key(voice_id, text, model, output_format))
+    try:
+        with open(path, "rb") as f:
+            audio = f.read()
+        os.utime(path)  # mark as recently used for LRU eviction
+    except FileNotFoundError:
+        _count("misses")
+        return None
+    _count("hits")
+    return audio
+
+
+def contains(voice_id: str, text: str, model: str, output_format: str) -> bool:
+    """Whether an entry exists, without reading it or counting a hit or miss."""
+    return CACHE_ENABLED and os.path.exists(_entry_path(voice_id, cache_key(voice_id, text, model, output_format)))
+
+
+def put(voice_id: str, text: str, model: str, output_format: str, audio: bytes):
+    """Store audio atomically; safe against concurrent writers of the same entry."""
+    global _writes_since_evict
+    if not CACHE_ENABLED or not audio:
+        return
+    path = _entry_path(voice_id, cache_key(voice_id, text, model, output_format))
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    except OSError as e:
+        # A cache that cannot be written must never break synthesis
+        print(f"TTS cache write failed for {path}: {str(e)}", file=sys.stderr)
+        return
+    _count("writes")
+
+    with _stats_lock:
+        _writes_since_evict += 1
+        should_evict = _writes_since_evict >= EVICT_EVERY_N_WRITES or _stats["writes"] == 1
+        if should_evict:
+            _writes_since_evict = 0
+    if should_evict:
+        evict()
+
+
+def get_or_synthesize(voice_id: str, text: str, model: str, output_format: str, synthesize):
+    """Serve audio from the cache, calling synthesize() and storing its bytes on a miss."""
+    audio = get(voice_id, text, model, output_format)
+    if audio is not None:
+        return audio
+    audio = synthesize()
+    put(voice_id, text, model, output_format, audio)
+    return audio
+
+
+def evict(max_bytes: int = None):
+    """Remove least recently used entries until the cache fits in max_bytes."""
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+
+    lock_path = os.path.join(CACHE_DIR, ".evict.lock")
+    with open(lock_path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0  # another process is already evicting
+
+        entries = []
+        total_bytes = 0
+        for voice_entry in os.scandir(CACHE_DIR):
+            if not voice_entry.is_dir():
+                continue
+            try:
+                voice_entries = list(os.scandir(voice_entry.path))
+            except FileNotFoundError:
+                continue  # voice invalidated concurrently
+            for entry in voice_entries:
+                if not entry.name.endswith(ENTRY_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_bytes += stat.st_size
+
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            removed += 1
+
+    if removed:
+        _count("evictions", removed)
+        print(f"TTS cache evicted {removed} entries, {total_bytes} bytes remain", file=sys.stderr)
+    return removed
+
+
+def invalidate_voice(voice_id: str):
+    """Drop every cached clip synthesized with voice_id."""
+    directory = voice_dir(voice_id)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory, ignore_errors=True)
+        _count("invalidations")
+
+
+def stats() -> dict:
+    with _stats_lock:
+        snapshot = dict(_stats)
+    lookups = snapshot["hits"] + snapshot["misses"]
+    snapshot["hit_rate"] = round(snapshot["hits"] / lookups, 4) if lookups else 0.0
+    return snapshot
@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import soundfile as sf
+import telemetry
+
+# Fingerprint cache for uploaded recordings.
+#
+# Users re-upload the same recording under a new title or after editing a
+# profile. Every processed upload is stored under the hash of its decoded,
+# peak-normalized 16-bit PCM, together with the denoised audio and the voice it
+# produced. An index from raw file bytes to fingerprint lets a byte-identical
+# upload skip decoding as well.
+#
+#   <UPLOAD_FINGERPRINT_DIR>/<fingerprint>/meta.json
+#   <UPLOAD_FINGERPRINT_DIR>/<fingerprint>/denoised.flac
+#   <UPLOAD_FINGERPRINT_DIR>/raw/<sha256 of upload bytes>  -> fingerprint
+#   <UPLOAD_FINGERPRINT_DIR>/decisions.log                 -> one JSON line per upload
+#
+# Entries are evicted by age and then, oldest use first, by total size.
+# store() writes meta.json before the audio, so an entry being written is never
+# the oldest; a directory without meta.json is only evicted once it is older
+# than STORE_GRACE_SECONDS (left behind by a writer that died).
+
+CACHE_ENABLED = os.getenv("UPLOAD_FINGERPRINT_ENABLED", "1") == "1"
+CACHE_DIR = os.getenv("UPLOAD_FINGERPRINT_DIR", "/app/uploads/fingerprints")
+MAX_AGE_SECONDS = float(os.getenv("UPLOAD_FINGERPRINT_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+MAX_BYTES = int(os.getenv("UPLOAD_FINGERPRINT_MAX_BYTES", str(1024 * 1024 * 1024)))
+STORE_GRACE_SECONDS = 600
+
+DENOISED_FILE = "denoised.flac"
+META_FILE = "meta.json"
+
+# Outcomes written to the decision log
+HIT = "hit"            # voice reused: no decode, denoise or clone call
+PARTIAL = "partial"    # denoised audio reused: only the clone call runs
+MISS = "miss"
+
+log = telemetry.get_logger("fingerprints")
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def pcm_fingerprint(audio_data):
+    """Hash of the decoded audio, peak-normalized and quantized so gain and float noise do not matter."""
+    peak = float(np.max(np.abs(audio_data))) if audio_data.size else 0.0
+    normalized = audio_data / peak if peak > 0 else audio_data
+    pcm = np.round(normalized * 32767).astype("<i2")
+    return hashlib.sha256(pcm.tobytes()).hexdigest()
+
+
+def _entry_dir(fingerprint):
+    return os.path.join(CACHE_DIR, fingerprint)
+
+
+def _raw_index_path(raw_hash):
+    return os.path.join(CACHE_DIR, "raw", raw_hash)
+
+
+def _atomic_write(path, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def lookup_raw(raw_hash):
+    """Fingerprint previously computed for these exact upload bytes, if any."""
+    if not CACHE_ENABLED:
+        return None
+    try:
+        with open(_raw_index_path(raw_hash), "r") as f:
+            fingerprint = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return fingerprint if os.path.isdir(_entry_dir(fingerprint)) else None
+
+
+def load(fingerprint):
+    """Metadata for a fingerprint, or None. Marks the entry as used."""
+    if not CACHE_ENABLED or not fingerprint:
+        return None
+    meta_path = os.path.join(_entry_dir(fingerprint), META_FILE)
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    meta["last_used_at"] = time.time()
+    _atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+    return meta
+
+
+def has_denoised(fingerprint):
+    return CACHE_ENABLED and bool(fingerprint) and os.path.exists(os.path.join(_entry_dir(fingerprint), DENOISED_FILE))
+
+
+def load_denoised(fingerprint):
+    """(audio, sample_rate) of the stored denoised artifact, or None."""
+    path = os.path.join(_entry_dir(fingerprint), DENOISED_FILE)
+    try:
+        audio_data, sample_rate = sf.read(path, dtype="float32")
+    except (RuntimeError, FileNotFoundError):
+        return None
+    return audio_data, sample_rate
+
+
+def store(fingerprint, raw_hash, denoised_audio, sample_rate, **meta_fields):
+    """Save the denoised artifact and metadata, and index the raw upload hash."""
+    if not CACHE_ENABLED:
+        return
+    try:
+        buffer = tempfile.SpooledTemporaryFile()
+        sf.write(buffer, denoised_audio, sample_rate, format="FLAC", subtype="PCM_16")
+        buffer.seek(0)
+        # Metadata first: it dates the entry as just used, so a concurrent evict() leaves it alone
+        now = time.time()
+        meta = {"fingerprint": fingerprint, "sample_rate": sample_rate, "created_at": now, "last_used_at": now, **meta_fields}
+        _atomic_write(os.path.join(_entry_dir(fingerprint), META_FILE), json.dumps(meta).encode("utf-8"))
+        _atomic_write(os.path.join(_entry_dir(fingerprint), DENOISED_FILE), buffer.read())
+        index_raw(raw_hash, fingerprint)
+    except OSError as e:
+        log.warning(f"Fingerprint cache write failed for {fingerprint}: {str(e)}")
+        return
+    evict()
+
+
+def index_raw(raw_hash, fingerprint):
+    if CACHE_ENABLED and raw_hash:
+        _atomic_write(_raw_index_path(raw_hash), fingerprint.encode("utf-8"))
+
+
+def update(fingerprint, **meta_fields):
+    """Merge fields (e.g. the voice_id once cloning succeeds) into an entry's metadata."""
+    meta = load(fingerprint)
+    if meta is None:
+        return
+    meta.update(meta_fields)
+    _atomic_write(os.path.join(_entry_dir(fingerprint), META_FILE), json.dumps(meta).encode("utf-8"))
+
+
+def log_decision(decision, **fields):
+    """Append one JSON line describing how an upload was handled."""
+    record = {"time": time.time(), "decision": decision, **fields}
+    log.debug(f"Upload fingerprint decision: {record}")
+    if not CACHE_ENABLED:
+        return
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(os.path.join(CACHE_DIR, "decisions.log"), "a") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        log.warning(f"Could not write fingerprint decision log: {str(e)}")
+
+
+def _entry_size(entry_dir):
+    total = 0
+    for name in os.listdir(entry_dir):
+        try:
+            total += os.path.getsize(os.path.join(entry_dir, name))
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def evict():
+    """Drop entries older than MAX_AGE_SECONDS, then least recently used ones above MAX_BYTES."""
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    with open(os.path.join(CACHE_DIR, ".evict.lock"), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0
+
+        now = time.time()
+        entries = []
+        for entry in os.scandir(CACHE_DIR):
+            if not entry.is_dir() or entry.name == "raw":
+                continue
+            try:
+                with open(os.path.join(entry.path, META_FILE), "r") as f:
+                    meta = json.load(f)
+                last_used = meta.get("last_used_at", 0)
+            except (FileNotFoundError, json.JSONDecodeError):
+                # No readable metadata: a store() in progress, or one that died
+                try:
+                    if now - entry.stat().st_mtime < STORE_GRACE_SECONDS:
+                        continue
+                except FileNotFoundError:
+                    continue
+                last_used = 0
+            entries.append((last_used, entry.path, _entry_size(entry.path)))
+
+        entries.sort()
+        total_bytes = sum(size for _, _, size in entries)
+        removed = set()
+        for last_used, path, size in entries:
+            if now - last_used > MAX_AGE_SECONDS or total_bytes > MAX_BYTES:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.add(os.path.basename(path))
+                total_bytes -= size
+
+        # Raw index entries pointing at removed fingerprints are dead weight
+        raw_dir = os.path.join(CACHE_DIR, "raw")
+        if removed and os.path.isdir(raw_dir):
+            for raw_entry in os.scandir(raw_dir):
+                try:
+                    with open(raw_entry.path, "r") as f:
+                        if f.read().strip() in removed:
+                            os.remove(raw_entry.path)
+                except FileNotFoundError:
+                    pass
+
+    if removed:
+        log.info(f"Fingerprint cache evicted {len(removed)} entries, {total_bytes} bytes remain")
+    return len(removed)
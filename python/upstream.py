@@ -0,0 +1,268 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+
+# Asyncio engine for every OpenAI and ElevenLabs call made by the pipelines.
+#
+# One event loop runs on a background thread per process and owns two pooled,
+# keep-alive httpx clients (one per upstream). The pipelines stay synchronous at
+# the edges: run() submits a coroutine to the loop and waits for it, iterate()
+# does the same for async generators. Any number of job threads can therefore
+# have requests in flight at once while sharing a handful of connections.
+#
+# Concurrency is bounded by a global semaphore and one per upstream, so a burst
+# of conversations queues here instead of tripping the providers' rate limits.
+#
+# httpx and openai are imported by start(), so importing this module is cheap
+# for invocations that fail validation before any call is made.
+
+MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "64"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+ELEVENLABS_MAX_CONCURRENCY = int(os.getenv("ELEVENLABS_MAX_CONCURRENCY", "16"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+REQUEST_TIMEOUT = float(os.getenv("UPSTREAM_REQUEST_TIMEOUT", "120"))
+RETRY_ATTEMPTS = int(os.getenv("UPSTREAM_RETRY_ATTEMPTS", "3"))
+RETRY_BASE_SECONDS = float(os.getenv("UPSTREAM_RETRY_BASE_SECONDS", "1"))
+# Rate limits, timeouts and server errors are worth another try; other 4xx are not
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+ELEVENLABS_API_BASE = os.getenv("ELEVEN_BASE_URL", "https://api.elevenlabs.io/v1")
+# Same value the elevenlabs package uses for generate(stream=True)
+ELEVENLABS_STREAMING_LATENCY = 1
+STREAM_CHUNK_SIZE = 2048
+
+OPENAI = "openai"
+ELEVENLABS = "elevenlabs"
+
+
+class UpstreamError(RuntimeError):
+    """Raised when an upstream API answers with an error status."""
+
+    def __init__(self, upstream, status_code, message):
+        super().__init__(f"{upstream} request failed, Status: {status_code}, Message: {message}")
+        self.upstream = upstream
+        self.status_code = status_code
+
+
+_start_lock = threading.Lock()
+_loop = None
+_openai = None
+_elevenlabs = None
+_limits = {}
+_stats_lock = threading.Lock()
+_stats = {OPENAI: {"in_flight": 0, "completed": 0, "failed": 0},
+          ELEVENLABS: {"in_flight": 0, "completed": 0, "failed": 0}}
+
+
+def _http_limits(max_connections):
+    import httpx
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS)
+
+
+async def _create_clients():
+    global _openai, _elevenlabs
+    import httpx
+    from openai import AsyncOpenAI
+    _limits["global"] = asyncio.Semaphore(MAX_CONCURRENCY)
+    _limits[OPENAI] = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    _limits[ELEVENLABS] = asyncio.Semaphore(ELEVENLABS_MAX_CONCURRENCY)
+    # AsyncOpenAI reads OPENAI_API_KEY / OPENAI_BASE_URL itself
+    _openai = AsyncOpenAI(http_client=httpx.AsyncClient(limits=_http_limits(OPENAI_MAX_CONCURRENCY),
+                                                        timeout=REQUEST_TIMEOUT))
+    _elevenlabs = httpx.AsyncClient(
+        base_url=ELEVENLABS_API_BASE,
+        headers={"xi-api-key": os.getenv("ELEVENLABS_API_KEY", ""), "accept": "application/json"},
+        limits=_http_limits(ELEVENLABS_MAX_CONCURRENCY),
+        timeout=REQUEST_TIMEOUT,
+    )
+
+
+def start():
+    """Start the event loop thread and its clients once per process; later calls are no-ops."""
+    global _loop
+    with _start_lock:
+        if _loop is not None:
+            return _loop
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="upstream-loop", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(_create_clients(), loop).result()
+        _loop = loop
+        return _loop
+
+
+def run(coroutine, timeout=None):
+    """Run a coroutine on the engine's loop from any thread and return its result."""
+    return asyncio.run_coroutine_threadsafe(coroutine, start()).result(timeout)
+
+
+def iterate(async_iterator):
+    """Consume an async iterator from a synchronous caller, one item per loop round trip."""
+    loop = start()
+    try:
+        while True:
+            try:
+                item = asyncio.run_coroutine_threadsafe(async_iterator.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        # Releases the concurrency slot when the caller stops early
+        asyncio.run_coroutine_threadsafe(async_iterator.aclose(), loop).result()
+
+
+def is_transient(error) -> bool:
+    import httpx
+    if isinstance(error, UpstreamError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError, TimeoutError))
+
+
+def run_with_retries(make_coroutine, description="request", attempts=None, base_delay=None):
+    """run(make_coroutine()) retried on transient failures with exponential backoff and jitter."""
+    attempts = attempts or RETRY_ATTEMPTS
+    base_delay = RETRY_BASE_SECONDS if base_delay is None else base_delay
+    for attempt in range(1, attempts + 1):
+        try:
+            return run(make_coroutine())
+        except Exception as e:
+            if attempt == attempts or not is_transient(e):
+                raise
+            delay = base_delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            print(f"{description} failed ({str(e)}); retry {attempt}/{attempts - 1} in {delay:.1f}s", file=sys.stderr)
+            time.sleep(delay)
+
+
+class _Slot:
+    """Holds the global and per-upstream semaphores for one call and keeps the counters."""
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+
+    async def __aenter__(self):
+        # Per-upstream first: a call queued behind its own upstream's limit must not
+        # hold a global slot that calls to the other upstream could be using
+        await _limits[self.upstream].acquire()
+        try:
+            await _limits["global"].acquire()
+        except BaseException:
+            _limits[self.upstream].release()
+            raise
+        with _stats_lock:
+            _stats[self.upstream]["in_flight"] += 1
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        with _stats_lock:
+            _stats[self.upstream]["in_flight"] -= 1
+            # A consumer that stops reading a stream early is not a failed call
+            failed = exc_type is not None and not issubclass(exc_type, GeneratorExit)
+            _stats[self.upstream]["failed" if failed else "completed"] += 1
+        _limits["global"].release()
+        _limits[self.upstream].release()
+
+
+def _check(response):
+    if response.status_code >= 400:
+        raise UpstreamError(ELEVENLABS, response.status_code, response.text)
+    return response
+
+
+# OpenAI
+
+def _record_usage(usage, reported):
+    if usage is not None and reported is not None:
+        usage["prompt_tokens"] = reported.prompt_tokens
+        usage["completion_tokens"] = reported.completion_tokens
+
+
+async def chat_completion(messages, model, usage=None):
+    """Return the reply text; token counts are stored in the usage dict when one is passed."""
+    async with _Slot(OPENAI):
+        response = await _openai.chat.completions.create(model=model, messages=messages)
+    _record_usage(usage, response.usage)
+    return response.choices[0].message.content
+
+
+async def chat_completion_stream(messages, model, usage=None):
+    """Yield reply text deltas as they arrive; token counts land in usage once the stream ends."""
+    options = {"stream_options": {"include_usage": True}} if usage is not None else {}
+    async with _Slot(OPENAI):
+        stream = await _openai.chat.completions.create(model=model, messages=messages, stream=True, **options)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if getattr(chunk, "usage", None) is not None:
+                _record_usage(usage, chunk.usage)
+
+
+# ElevenLabs
+
+async def text_to_speech(voice_id, text, model, output_format):
+    async with _Slot(ELEVENLABS):
+        response = await _elevenlabs.post(f"/text-to-speech/{voice_id}", params={"output_format": output_format},
+                                          json={"text": text, "model_id": model})
+        return _check(response).content
+
+
+async def text_to_speech_stream(voice_id, text, model, output_format):
+    """Yield audio chunks while ElevenLabs is still synthesizing."""
+    async with _Slot(ELEVENLABS):
+        params = {"optimize_streaming_latency": ELEVENLABS_STREAMING_LATENCY, "output_format": output_format}
+        async with _elevenlabs.stream("POST", f"/text-to-speech/{voice_id}/stream", params=params,
+                                      json={"text": text, "model_id": model}) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                _check(response)
+            async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                yield chunk
+
+
+async def add_voice(name, description, filename, audio_bytes, mime_type):
+    """Create an instant voice clone and return its voice_id."""
+    async with _Slot(ELEVENLABS):
+        response = await _elevenlabs.post(
+            "/voices/add",
+            data={"name": name, "description": description, "labels": "{}"},
+            files=[("files", (filename, audio_bytes, mime_type))],
+        )
+        return _check(response).json()["voice_id"]
+
+
+async def list_voices():
+    async with _Slot(ELEVENLABS):
+        response = await _elevenlabs.get("/voices")
+        return _check(response).json().get("voices", [])
+
+
+async def delete_voice(voice_id):
+    """True when the voice was deleted; failures are logged, not raised."""
+    async with _Slot(ELEVENLABS):
+        response = await _elevenlabs.delete(f"/voices/{voice_id}")
+    if response.status_code in (200, 204):
+        return True
+    print(f"Failed to delete voice ID: {voice_id}, Status: {response.status_code}, Message: {response.text}", file=sys.stderr)
+    return False
+
+
+async def delete_voices(voice_ids):
+    """Delete several voices concurrently; returns {voice_id: deleted}."""
+    results = await asyncio.gather(*(delete_voice(voice_id) for voice_id in voice_ids), return_exceptions=True)
+    deleted = {}
+    for voice_id, result in zip(voice_ids, results):
+        if isinstance(result, Exception):
+            print(f"Error deleting voice {voice_id}: {str(result)}", file=sys.stderr)
+        deleted[voice_id] = result is True
+    return deleted
+
+
+def stats() -> dict:
+    with _stats_lock:
+        snapshot = {upstream: dict(counters) for upstream, counters in _stats.items()}
+    snapshot["limits"] = {
+        "global": MAX_CONCURRENCY,
+        OPENAI: OPENAI_MAX_CONCURRENCY,
+        ELEVENLABS: ELEVENLABS_MAX_CONCURRENCY,
+    }
+    return snapshot
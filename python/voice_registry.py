@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
+import telemetry
+
+# Local registry of the cloned voices on the ElevenLabs account.
+#
+# Records name, voice_id, creation time, last time the voice was used by
+# /talk-to-ai and the hash of the audio it was cloned from. A voice reused for
+# another clone name (the same recording uploaded twice) lists every name that
+# refers to it, and is only deleted remotely once none is left. The existing-voice
+# check is answered from this file, which is reconciled with the remote voice list
+# at most every VOICE_REGISTRY_SYNC_TTL seconds. When the account is full only the
+# least recently used voices are deleted, so one new clone costs at most one
+# delete instead of wiping every user's voice.
+#
+# The JSON file is shared by every process in the container; all access goes
+# through an flock on a sidecar lock file and writes are atomic renames.
+# make_room counts, evicts and reserves a slot under one exclusive lock; the
+# reservation counts as a voice until register() (or release()) replaces it, so
+# concurrent clones cannot all see the same free slot while their uploads run.
+
+REGISTRY_PATH = os.getenv("VOICE_REGISTRY_PATH", "/app/uploads/voice_registry.json")
+SYNC_TTL_SECONDS = float(os.getenv("VOICE_REGISTRY_SYNC_TTL", "600"))
+VOICE_LIMIT = int(os.getenv("ELEVENLABS_VOICE_LIMIT", "30"))
+# Reservations of clones that never registered (crashed process) lapse after this
+RESERVATION_TTL_SECONDS = float(os.getenv("VOICE_REGISTRY_RESERVATION_TTL", "600"))
+
+# Only these categories count against the clone limit and may be evicted
+EVICTABLE_CATEGORIES = {"cloned", "generated"}
+
+log = telemetry.get_logger("voice_registry")
+
+
+_held = threading.local()
+
+
+def _empty():
+    return {"synced_at": 0, "voices": {}, "reservations": {}}
+
+
+def _load():
+    try:
+        with open(REGISTRY_PATH, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return _empty()
+
+
+def _save(registry):
+    directory = os.path.dirname(REGISTRY_PATH) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(registry, f)
+    os.replace(tmp_path, REGISTRY_PATH)
+
+
+@contextmanager
+def _locked(write=True):
+    held = getattr(_held, "registry", None)
+    if held is not None:
+        # This thread already holds the exclusive lock (make_room's delete callback);
+        # share its registry, which the outer section saves
+        yield held
+        return
+    os.makedirs(os.path.dirname(REGISTRY_PATH) or ".", exist_ok=True)
+    with open(REGISTRY_PATH + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+        registry = _load()
+        if write:
+            _held.registry = registry
+        try:
+            yield registry
+        finally:
+            _held.registry = None
+        if write:
+            _save(registry)
+
+
+def _reservations(registry, now):
+    """Live reservations of the registry; lapsed ones are dropped."""
+    reservations = registry.setdefault("reservations", {})
+    for token, reserved in list(reservations.items()):
+        if now - reserved["reserved_at"] > RESERVATION_TTL_SECONDS:
+            del reservations[token]
+    return reservations
+
+
+def sync(list_remote_voices, force=False):
+    """
+    Reconcile with the remote voice list when the last sync is older than the TTL.
+
+    list_remote_voices() must return dicts with voice_id, name and category.
+    Voices found remotely but unknown locally get last_used_at 0, so they are the
+    first eviction candidates; local entries missing remotely are dropped, unless
+    they were registered after the list was fetched (a clone finishing meanwhile).
+    """
+    with _locked(write=False) as registry:
+        if not force and time.time() - registry.get("synced_at", 0) < SYNC_TTL_SECONDS:
+            return False
+
+    fetched_at = time.time()
+    remote = [v for v in list_remote_voices() if v.get("category") in EVICTABLE_CATEGORIES or v.get("category") is None]
+    now = time.time()
+    with _locked() as registry:
+        local = registry["voices"]
+        remote_ids = set()
+        for voice in remote:
+            remote_ids.add(voice["voice_id"])
+            entry = local.setdefault(voice["voice_id"], {"names": [voice.get("name")], "created_at": now,
+                                                         "last_used_at": 0, "audio_hash": None})
+            entry["name"] = voice.get("name")
+        for voice_id, entry in list(local.items()):
+            if voice_id not in remote_ids and (entry.get("created_at") or 0) < fetched_at:
+                del local[voice_id]
+        registry["synced_at"] = now
+    log.debug(f"Voice registry synced: {len(remote_ids)} cloned voices")
+    return True
+
+
+def find_by_name(name):
+    with _locked(write=False) as registry:
+        for voice_id, entry in registry["voices"].items():
+            if name in entry.get("names", [entry.get("name")]):
+                return voice_id
+    return None
+
+
+def contains(voice_id):
+    if not voice_id:
+        return False
+    with _locked(write=False) as registry:
+        return voice_id in registry["voices"]
+
+
+def find_by_audio_hash(audio_hash):
+    if not audio_hash:
+        return None
+    with _locked(write=False) as registry:
+        for voice_id, entry in registry["voices"].items():
+            if entry.get("audio_hash") == audio_hash:
+                return voice_id
+    return None
+
+
+def register(voice_id, name, audio_hash=None, reservation=None):
+    """Record a new voice, taking over the slot make_room reserved for it."""
+    now = time.time()
+    with _locked() as registry:
+        registry["voices"][voice_id] = {"name": name, "names": [name], "created_at": now, "last_used_at": now,
+                                        "audio_hash": audio_hash}
+        if reservation:
+            _reservations(registry, now).pop(reservation, None)
+
+
+def release(reservation):
+    """Give back a slot reserved by make_room whose clone failed."""
+    if not reservation:
+        return
+    with _locked() as registry:
+        _reservations(registry, time.time()).pop(reservation, None)
+
+
+def add_name(voice_id, name):
+    """Record that clone name `name` now refers to an existing voice too. False if the voice is unknown."""
+    with _locked() as registry:
+        entry = registry["voices"].get(voice_id)
+        if entry is None:
+            return False
+        names = entry.setdefault("names", [entry.get("name")])
+        if name not in names:
+            names.append(name)
+        entry["last_used_at"] = time.time()
+        return True
+
+
+def remove_name(voice_id, name):
+    """Drop one clone name from a voice; returns the names still referring to it."""
+    with _locked() as registry:
+        entry = registry["voices"].get(voice_id)
+        if entry is None:
+            return []
+        names = [other for other in entry.get("names", [entry.get("name")]) if other != name]
+        entry["names"] = names
+        return names
+
+
+def touch(voice_id):
+    """Record that a voice was just used; called from the talk path. Unknown ids are ignored."""
+    with _locked() as registry:
+        entry = registry["voices"].get(voice_id)
+        if entry is not None:
+            entry["last_used_at"] = time.time()
+
+
+def remove(voice_id):
+    with _locked() as registry:
+        registry["voices"].pop(voice_id, None)
+
+
+def count():
+    with _locked(write=False) as registry:
+        return len(registry["voices"])
+
+
+def make_room(delete_voices, limit=VOICE_LIMIT, needed=1):
+    """
+    Delete least recently used voices until `needed` new voices fit under `limit`,
+    and reserve the freed slots.
+
+    delete_voices(voice_ids) performs the remote deletes (concurrently) and returns
+    the ids it managed to delete. Counting, deleting and reserving happen under one
+    exclusive lock. Returns the reservation to pass to register() once the voice
+    exists, or to release() when the clone fails.
+    """
+    now = time.time()
+    reservation = f"{os.getpid()}-{threading.get_ident()}-{now}"
+    with _locked() as registry:
+        reservations = _reservations(registry, now)
+        voices = sorted(registry["voices"].items(), key=lambda item: item[1].get("last_used_at") or 0)
+        reserved_slots = sum(reserved["slots"] for reserved in reservations.values())
+        overflow = len(voices) + reserved_slots + needed - limit
+        candidates = voices[:max(0, overflow)]
+        for voice_id, entry in candidates:
+            log.info(f"Voice limit reached. Evicting least recently used voice {voice_id} ({entry.get('name')})")
+        if candidates:
+            for voice_id in delete_voices([voice_id for voice_id, _ in candidates]):
+                registry["voices"].pop(voice_id, None)
+        reservations[reservation] = {"reserved_at": now, "slots": needed}
+    return reservation
@@ -0,0 +1,334 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import traceback
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Long-lived worker for the voice pipelines. It imports generate_ai_response and
+# audio_cloning once, keeps their API clients and HTTP connection pools warm,
+# and runs jobs sent either as JSON lines on stdin/stdout or over a Unix socket.
+#
+# Request:  {"id": "...", "op": "talk" | "clone" | "clone_submit" | "clone_status" | "health" | "metrics",
+#            "args": {...}}
+# Response: {"id": "...", "ok": true, "result": {...}} or {"id": "...", "ok": false, "error": "..."}
+#
+# Clones go through clone_queue, so duplicates share one run. "clone" waits for
+# the result; "clone_submit" returns the job state at once and runs the job in
+# the background, and "clone_status" ({"job_id", "wait"?}) reports on it. Jobs
+# interrupted by a crash or restart are resumed after warm-up.
+#
+# With --metrics-port the stage timings collected by telemetry are also served
+# over HTTP at /metrics in the Prometheus text format.
+
+DEFAULT_POOL_SIZE = int(os.getenv("VOICE_WORKER_POOL_SIZE", "4"))
+DEFAULT_JOB_TIMEOUT = float(os.getenv("VOICE_WORKER_JOB_TIMEOUT", "300"))
+DEFAULT_METRICS_PORT = int(os.getenv("VOICE_WORKER_METRICS_PORT", "0"))
+
+_started_at = time.monotonic()
+_stats_lock = threading.Lock()
+_stats = {"active_jobs": 0, "completed_jobs": 0, "failed_jobs": 0, "timed_out_jobs": 0}
+_pool = None
+_pool_size = DEFAULT_POOL_SIZE
+_job_timeout = DEFAULT_JOB_TIMEOUT
+
+
+def warm_up():
+    """Import both pipelines so their dependencies and API clients are ready before the first job."""
+    started = time.monotonic()
+    import generate_ai_response
+    import audio_cloning
+    import phrase_bank
+    phrase_bank.enable_in_process_builds()
+    generate_ai_response.warm_up()
+    audio_cloning.warm_up()
+    print(f"Worker warmed up in {time.monotonic() - started:.2f}s", file=sys.stderr)
+
+
+def resume_clone_jobs():
+    import audio_cloning
+    import clone_queue
+
+    def warm_bank(job):
+        if job.get("user_data") is not None:
+            audio_cloning.warm_phrase_bank(job["voice_id"], job["user_data"])
+
+    resumed = clone_queue.resume_pending(_pool, audio_cloning.remove_noise_and_clone_voice, on_success=warm_bank)
+    if resumed:
+        print(f"Resuming {resumed} interrupted clone job(s)", file=sys.stderr)
+
+
+def run_talk_job(args: dict) -> dict:
+    import generate_ai_response
+    output_info = {}
+    generated_audio_path = generate_ai_response.generate_ai_response_and_convert_to_audio(
+        args["user_input"],
+        args["cloned_voice_id"],
+        args["user_data"] if "user_data" in args else args["user_data_file"],
+        args["output_audio_path"],
+        stream=args.get("stream"),
+        conversation_id=args.get("conversation_id"),
+        output_format=args.get("output_format"),
+        output_info=output_info,
+    )
+    if not generated_audio_path:
+        raise RuntimeError("There was an error generating the audio.")
+    return {"generated_audio_path": generated_audio_path, **output_info}
+
+
+def _clone_user_data(args: dict):
+    import audio_cloning
+    if args.get("user_data") is not None:
+        return args["user_data"]
+    return audio_cloning.load_user_data(args["user_data_file"]) if args.get("user_data_file") else None
+
+
+def run_clone_job(args: dict) -> dict:
+    import audio_cloning
+    raw_user_data = _clone_user_data(args)
+    job = audio_cloning.clone_voice_job(args["input_audio_path"], args["clone_name"], raw_user_data)
+    if raw_user_data is not None:
+        audio_cloning.warm_phrase_bank(job["voice_id"], raw_user_data)
+    return {"voice_id": job["voice_id"], "job_id": job["job_id"]}
+
+
+def submit_clone_job(args: dict) -> dict:
+    """Queue a clone and return at once; the job runs in the background on the pool."""
+    import audio_cloning
+    import clone_queue
+    input_audio_path = audio_cloning.resolve_upload_path(args["input_audio_path"])
+    if not os.path.exists(input_audio_path):
+        raise FileNotFoundError(f"Input audio file not found: {input_audio_path}")
+    # Read the user data file now: it may be gone by the time the pool gets to the job
+    args = {**args, "user_data": _clone_user_data(args)}
+    job = clone_queue.submit(input_audio_path, args["clone_name"], args["user_data"])
+    if job["status"] == clone_queue.QUEUED:
+        _pool.submit(_run_tracked, run_clone_job, args)
+    return job
+
+
+def clone_job_status(args: dict) -> dict:
+    import clone_queue
+    if args.get("wait"):
+        return clone_queue.wait(args["job_id"], timeout=float(args.get("timeout") or _job_timeout))
+    job = clone_queue.status(args["job_id"])
+    if job is None:
+        raise clone_queue.CloneJobError(f"Unknown clone job: {args['job_id']}")
+    return job
+
+
+def health() -> dict:
+    import tts_cache
+    import reply_cache
+    import prompt_compiler
+    import upstream
+    with _stats_lock:
+        stats = dict(_stats)
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "uptime_seconds": round(time.monotonic() - _started_at, 3),
+        "pool_size": _pool_size,
+        "job_timeout_seconds": _job_timeout,
+        **stats,
+        "tts_cache": tts_cache.stats(),
+        "reply_cache": reply_cache.stats(),
+        "prompt_compiler": prompt_compiler.stats(),
+        "upstream": upstream.stats(),
+    }
+
+
+JOB_HANDLERS = {
+    "talk": run_talk_job,
+    "clone": run_clone_job,
+}
+
+
+def _run_tracked(handler, args):
+    with _stats_lock:
+        _stats["active_jobs"] += 1
+    try:
+        return handler(args)
+    finally:
+        with _stats_lock:
+            _stats["active_jobs"] -= 1
+
+
+def handle_request(request: dict) -> dict:
+    """Run one protocol request on the pool and build its response."""
+    request_id = request.get("id")
+    op = request.get("op")
+
+    if op == "health":
+        return {"id": request_id, "ok": True, "result": health()}
+    if op == "metrics":
+        import telemetry
+        return {"id": request_id, "ok": True, "result": {"prometheus": telemetry.prometheus_text()}}
+    if op in ("clone_submit", "clone_status"):
+        # Cheap bookkeeping; the clone itself runs on the pool
+        try:
+            result = submit_clone_job(request.get("args") or {}) if op == "clone_submit" \
+                else clone_job_status(request.get("args") or {})
+        except Exception as e:
+            return {"id": request_id, "ok": False, "error": str(e)}
+        return {"id": request_id, "ok": True, "result": result}
+
+    handler = JOB_HANDLERS.get(op)
+    if handler is None:
+        return {"id": request_id, "ok": False, "error": f"Unknown op: {op}"}
+
+    timeout = request.get("timeout") or _job_timeout
+    future = _pool.submit(_run_tracked, handler, request.get("args") or {})
+    try:
+        result = future.result(timeout=timeout)
+    except FutureTimeoutError:
+        # The job thread cannot be interrupted; it keeps its pool slot until it finishes.
+        with _stats_lock:
+            _stats["timed_out_jobs"] += 1
+        print(f"Job {request_id} ({op}) timed out after {timeout}s", file=sys.stderr)
+        return {"id": request_id, "ok": False, "error": f"Job timed out after {timeout}s"}
+    except Exception as e:
+        with _stats_lock:
+            _stats["failed_jobs"] += 1
+        print(f"Job {request_id} ({op}) failed: {str(e)}\n{traceback.format_exc()}", file=sys.stderr)
+        return {"id": request_id, "ok": False, "error": str(e)}
+
+    with _stats_lock:
+        _stats["completed_jobs"] += 1
+    return {"id": request_id, "ok": True, "result": result}
+
+
+def _parse_request(line: bytes):
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("request must be a JSON object")
+        return request, None
+    except ValueError as e:
+        return None, {"id": None, "ok": False, "error": f"Invalid request: {str(e)}"}
+
+
+def serve_stdio(protocol_out):
+    """JSON-lines protocol on stdin/stdout. Pipeline logging has already been moved to stderr."""
+    write_lock = threading.Lock()
+
+    def respond(response):
+        with write_lock:
+            protocol_out.write(json.dumps(response) + "\n")
+            protocol_out.flush()
+
+    def run(request):
+        respond(handle_request(request))
+
+    # Each request gets its own dispatcher thread so slow jobs do not block reading;
+    # the pool still bounds how many jobs run at once.
+    dispatchers = []
+    for line in sys.stdin.buffer:
+        if not line.strip():
+            continue
+        request, error = _parse_request(line)
+        if error:
+            respond(error)
+            continue
+        dispatcher = threading.Thread(target=run, args=(request,), daemon=True)
+        dispatcher.start()
+        dispatchers.append(dispatcher)
+        dispatchers = [d for d in dispatchers if d.is_alive()]
+
+    # stdin closed: answer everything already accepted before exiting.
+    for dispatcher in dispatchers:
+        dispatcher.join()
+
+
+class _JobRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            request, error = _parse_request(line)
+            response = error or handle_request(request)
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class _JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_socket(socket_path: str):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    with _JobServer(socket_path, _JobRequestHandler) as server:
+        os.chmod(socket_path, 0o660)
+        print(f"Worker listening on {socket_path} (pool_size={_pool_size}, job_timeout={_job_timeout}s)", file=sys.stderr)
+        try:
+            server.serve_forever()
+        finally:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        import telemetry
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = telemetry.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port: int):
+    """Serve /metrics on a background thread for Prometheus to scrape."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Worker serving metrics on :{port}/metrics", file=sys.stderr)
+    return server
+
+
+def main():
+    global _pool, _pool_size, _job_timeout
+
+    parser = argparse.ArgumentParser(description="Warm worker for the voice cloning and talk-to-ai pipelines")
+    parser.add_argument("--socket", default=os.getenv("VOICE_WORKER_SOCKET"),
+                        help="Unix socket path to serve on; JSON lines on stdin/stdout when omitted")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE, help="Maximum concurrent jobs")
+    parser.add_argument("--job-timeout", type=float, default=DEFAULT_JOB_TIMEOUT, help="Per-job timeout in seconds")
+    parser.add_argument("--metrics-port", type=int, default=DEFAULT_METRICS_PORT,
+                        help="Serve Prometheus metrics over HTTP on this port (0 disables)")
+    args = parser.parse_args()
+
+    _pool_size = max(1, args.pool_size)
+    _job_timeout = args.job_timeout
+    _pool = ThreadPoolExecutor(max_workers=_pool_size, thread_name_prefix="voice-job")
+
+    protocol_out = None
+    if not args.socket:
+        # Keep stdout for protocol responses only; the pipelines print progress freely.
+        protocol_out = sys.stdout
+        sys.stdout = sys.stderr
+
+    warm_up()
+    resume_clone_jobs()
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    if args.socket:
+        serve_socket(args.socket)
+    else:
+        serve_stdio(protocol_out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import json
+import socket
+import uuid
+
+# Path of the Unix socket served by worker.py. When unset (or when nothing is
+# listening) the CLI entry points run the pipeline in-process as before.
+WORKER_SOCKET_ENV = "VOICE_WORKER_SOCKET"
+
+
+class WorkerJobError(RuntimeError):
+    """Raised when the worker accepted a job but it failed or its answer was lost."""
+
+
+def get_worker_socket_path():
+    socket_path = os.getenv(WORKER_SOCKET_ENV)
+    if socket_path and os.path.exists(socket_path):
+        return socket_path
+    return None
+
+
+def request_worker_job(op: str, args: dict, timeout: float = None):
+    """
+    Send a single job to the warm worker and wait for its reply.
+
+    Returns the job result dict, or None when no worker is reachable so the
+    caller can fall back to running the pipeline in this process. Once the
+    request has been sent the job may already be running, so every later
+    failure raises WorkerJobError instead of falling back: running it again
+    here could double the TTS or clone work and race on the same output.
+    """
+    socket_path = get_worker_socket_path()
+    if not socket_path:
+        return None
+
+    request = {"id": uuid.uuid4().hex, "op": op, "args": args}
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path)
+        except OSError as e:
+            print(f"Worker at {socket_path} unavailable ({str(e)}), running in-process", file=sys.stderr)
+            return None
+        try:
+            with sock.makefile("rwb") as stream:
+                stream.write((json.dumps(request) + "\n").encode("utf-8"))
+                stream.flush()
+                line = stream.readline()
+        except OSError as e:
+            raise WorkerJobError(f"Lost the worker at {socket_path} while running the job: {str(e)}")
+
+    if not line:
+        raise WorkerJobError(f"Worker at {socket_path} closed the connection before answering")
+
+    response = json.loads(line)
+    if not response.get("ok"):
+        raise WorkerJobError(response.get("error") or "Worker job failed")
+    return response.get("result") or {}
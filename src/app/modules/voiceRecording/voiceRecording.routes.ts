@@ -2,8 +2,8 @@ import express, { Request, Response } from 'express';
 import { VoiceRecording } from './voiceRecording.model';
 import { authenticate } from '../auth/auth.middleware';
 import multer from 'multer';
-import { uploadImage, uploadAudio } from '../../utils/cloudinary';
-import { exec, execSync } from 'child_process';
+import { uploadImage, uploadAudio, uploadAudioBuffer } from '../../utils/cloudinary';
+import { exec, execSync, spawn } from 'child_process';
 import path from 'path';
 import fs from 'fs';
 import { promisify } from 'util';
@@ -184,6 +184,7 @@ router.post(
   upload,
   async (req: Request, res: Response): Promise<void> => {
     let files: { [fieldname: string]: Express.Multer.File[] } = {};
+    let personalizationPath = '';
     try {
       console.log('Step 1: Starting /add-voice route');
       const userId = req.user?.id;
@@ -256,8 +257,12 @@ router.post(
       const cloneName = `${title}-${userId}`.replace(/ /g, '_');
       console.log('Step 12: Preparing to call Python script:', { pythonScriptPath, tempAudioPath, cloneName });
 
+      // Personalization is passed along so the voice's stock phrases can be pre-synthesized
+      personalizationPath = `${tempAudioPath}.personalization.json`;
+      fs.writeFileSync(personalizationPath, JSON.stringify(parsedPersonalizationData));
+
       const pythonExec = getPythonExecutable();
-      const command = `${pythonExec} -u "${pythonScriptPath}" "${tempAudioPath}" "${cloneName}"`;
+      const command = `${pythonExec} -u "${pythonScriptPath}" "${tempAudioPath}" "${cloneName}" "${personalizationPath}"`;
       console.log('Step 12.5: Executing command:', command);
 
       let stdout, stderr;
@@ -291,6 +296,7 @@ router.post(
 
       console.log('Step 19: Cleaning up temp audio file:', tempAudioPath);
       fs.unlinkSync(tempAudioPath);
+      fs.unlinkSync(personalizationPath);
       if (files.image && files.image[0]?.path) {
         console.log('Step 20: Cleaning up temp image file:', files.image[0].path);
         fs.unlinkSync(files.image[0].path);
@@ -313,6 +319,9 @@ router.post(
       res.status(201).json({ success: true, voiceRecording });
     } catch (error: any) {
       console.error('Step 23: Error in /add-voice:', error.message);
+      if (personalizationPath && fs.existsSync(personalizationPath)) {
+        fs.unlinkSync(personalizationPath);
+      }
       if (files.audio && files.audio[0]?.path && fs.existsSync(files.audio[0].path)) {
         fs.unlinkSync(files.audio[0].path);
       }
@@ -412,13 +421,76 @@ router.put(
   }
 );
 
+// Run generate_ai_response.py in --stdin mode: the job goes in as JSON on stdin and the
+// reply comes back as framed audio on stdout (see python/job_io.py), so concurrent
+// requests share no files.
+interface TalkJob {
+  user_input: string;
+  cloned_voice_id: string;
+  user_data: any;
+  conversation_id?: string;
+  // One of python/audio_formats.py FORMATS; TALK_OUTPUT_FORMAT when omitted
+  output_format?: string;
+}
+
+interface TalkResult {
+  output_format: string;
+  extension: string;
+  mime_type: string;
+  bytes: number;
+  bytes_per_second: number | null;
+  // Streamed WAV only: base64 header with the real sizes for the first 44 bytes of audio
+  wav_header?: string;
+}
+
+function runTalkJob(pythonExec: string, pythonDir: string, job: TalkJob): Promise<{ audio: Buffer; result: TalkResult }> {
+  return new Promise((resolve, reject) => {
+    const child = spawn(pythonExec, ['-u', path.join(pythonDir, 'generate_ai_response.py'), '--stdin'], {
+      cwd: pythonDir,
+      env: { ...process.env, PYTHONPATH: pythonDir },
+    });
+    const stdoutChunks: Buffer[] = [];
+    const stderrChunks: Buffer[] = [];
+    child.stdout.on('data', (chunk: Buffer) => stdoutChunks.push(chunk));
+    child.stderr.on('data', (chunk: Buffer) => stderrChunks.push(chunk));
+    child.on('error', reject);
+    child.on('close', (code) => {
+      const stderr = Buffer.concat(stderrChunks).toString('utf-8');
+      console.log('Python talk job stderr:', stderr);
+      const stdout = Buffer.concat(stdoutChunks);
+      const audioFrames: Buffer[] = [];
+      let offset = 0;
+      while (offset + 5 <= stdout.length) {
+        const frameType = String.fromCharCode(stdout[offset]);
+        const length = stdout.readUInt32BE(offset + 1);
+        const payload = stdout.subarray(offset + 5, offset + 5 + length);
+        offset += 5 + length;
+        if (frameType === 'A') {
+          audioFrames.push(payload);
+        } else if (frameType === 'R') {
+          const audio = Buffer.concat(audioFrames);
+          const result: TalkResult = JSON.parse(payload.toString('utf-8'));
+          if (result.wav_header) {
+            Buffer.from(result.wav_header, 'base64').copy(audio, 0);
+          }
+          resolve({ audio, result });
+          return;
+        } else if (frameType === 'E') {
+          reject(new Error(JSON.parse(payload.toString('utf-8')).error));
+          return;
+        }
+      }
+      reject(new Error(`Talk job exited with code ${code} without a result: ${stderr.slice(-500)}`));
+    });
+    child.stdin.end(JSON.stringify(job));
+  });
+}
+
 // Task 3: Talk to AI with selected voice
 router.post(
   '/talk-to-ai',
   authenticate,
   async (req: Request, res: Response): Promise<void> => {
-    let tempFilePath: string = '';
-    let generatedAudioPath: string = '';
     try {
       const userId = req.user?.id;
       console.log('Step 1: Extracted userId:', userId);
@@ -427,7 +499,7 @@ router.post(
         return;
       }
 
-      const { recordingId, userInput } = req.body;
+      const { recordingId, userInput, outputFormat } = req.body;
       console.log('Step 2: Received recordingId and userInput:', { recordingId, userInput });
       if (!recordingId || !userInput) {
         res.status(400).json({ success: false, message: 'Recording ID and user input are required' });
@@ -441,59 +513,28 @@ router.post(
         return;
       }
 
-      // File paths resolved to: /app/uploads
-      tempFilePath = '/app/uploads/temp_user_data.json';
-      fs.writeFileSync(tempFilePath, JSON.stringify(voiceRecording.personalizationData));
-      console.log('Step 4: Wrote userData to temporary file:', tempFilePath);
-
       const aiPythonDir = resolvePythonDir('generate_ai_response.py');
       console.log('Step 5: AI Python directory resolved to:', aiPythonDir);
-      const pythonScriptPath = path.join(aiPythonDir, 'generate_ai_response.py');
-      console.log('Step 5.5: Python script path:', pythonScriptPath);
-      const outputAudioPath = '/app/uploads/generated_audio.wav';
-      console.log('Step 6: Output audio path:', outputAudioPath);
-      if (fs.existsSync(outputAudioPath)) {
-        fs.unlinkSync(outputAudioPath);
-        console.log('Step 7: Cleaned up existing output audio file:', outputAudioPath);
-      }
       const pythonExec = getPythonExecutable();
-      const command = `${pythonExec} -u "${pythonScriptPath}" "${userInput.replace(/"/g, '\\"')}" "${voiceRecording.clonedVoiceId}" "${tempFilePath}" "${outputAudioPath}"`;
-      console.log('Step 5: Executing command:', command);
 
-      const { stdout } = await execPromise(command, {
-        cwd: aiPythonDir,
-        env: { ...process.env, PYTHONPATH: aiPythonDir },
+      const { audio, result } = await runTalkJob(pythonExec, aiPythonDir, {
+        user_input: userInput,
+        cloned_voice_id: voiceRecording.clonedVoiceId,
+        user_data: voiceRecording.personalizationData || {},
+        // Earlier turns are remembered per user and recording
+        conversation_id: `${userId}:${recordingId}`,
+        output_format: outputFormat,
       });
+      console.log('Step 6: Talk job finished:', audio.length, 'bytes of', result.output_format,
+        `(${result.bytes_per_second} bytes/s of speech)`);
 
-      console.log('Step 6: Python script executed, stdout:', stdout);
-      const audioPathMatch = stdout.match(/Generated audio saved at: (.+)/);
-      const audioPath = audioPathMatch ? audioPathMatch[1].trim() : null;
-      console.log('Step 10: Extracted audioPath:', audioPath);
-      if (!audioPath) {
-        console.log('Step 11: No audioPath extracted, throwing error. Full stdout:', stdout);
-        throw new Error('Failed to extract generated audio path');
-      }
-
-      generatedAudioPath = audioPath;
-
-      fs.unlinkSync(tempFilePath);
-      console.log('Step 12: Cleaned up temporary userData file');
-
-      console.log('Step 13: Uploading generated audio to Cloudinary:', generatedAudioPath);
-      const audioResult = await uploadAudio(generatedAudioPath);
+      console.log('Step 13: Uploading generated audio to Cloudinary');
+      const audioResult = await uploadAudioBuffer(audio);
       console.log('Step 14: Audio uploaded, URL:', audioResult.secure_url);
-      fs.unlinkSync(generatedAudioPath);
-      console.log('Step 15: Cleaned up temporary audio file');
 
-      res.status(200).json({ success: true, audioUrl: audioResult.secure_url });
+      res.status(200).json({ success: true, audioUrl: audioResult.secure_url, mimeType: result.mime_type });
     } catch (error: any) {
       console.error('Step 16: Error in /talk-to-ai:', error.message);
-      if (fs.existsSync(tempFilePath)) {
-        fs.unlinkSync(tempFilePath);
-      }
-      if (generatedAudioPath && fs.existsSync(generatedAudioPath)) {
-        fs.unlinkSync(generatedAudioPath);
-      }
       res.status(500).json({ success: false, message: error.message });
     }
   }
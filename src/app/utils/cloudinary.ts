@@ -30,6 +30,21 @@ export const uploadAudio = async (filePath: string): Promise<{ secure_url: strin
   }
 };
 
+export const uploadAudioBuffer = async (audio: Buffer): Promise<{ secure_url: string }> => {
+  try {
+    const result = await new Promise<{ secure_url: string }>((resolve, reject) => {
+      const uploadStream = cloudinary.uploader.upload_stream(
+        { resource_type: 'video', folder: 'user_audio' },
+        (error, uploadResult) => (error || !uploadResult ? reject(error) : resolve(uploadResult))
+      );
+      uploadStream.end(audio);
+    });
+    return result;
+  } catch (error) {
+    throw new Error(`Audio upload failed: ${error instanceof Error ? error.message : JSON.stringify(error)}`);
+  }
+};
+
 export const uploadHeroImage = async (filePath: string): Promise<{ secure_url: string }> => {
   try {
     const result = await cloudinary.uploader.upload(filePath, { folder: 'hero_images' });
@@ -0,0 +1,23 @@
+#!/bin/bash
+# Container entry point: the warm Python voice worker runs next to the API.
+#
+# The worker listens on VOICE_WORKER_SOCKET and is restarted whenever it exits.
+# Node passes its environment to every Python job it spawns, so the entry points
+# find the socket and hand their jobs to the worker; while it is down (or with
+# VOICE_WORKER_ENABLED=0) they run the pipelines in-process as before.
+
+export VOICE_WORKER_SOCKET="${VOICE_WORKER_SOCKET:-/tmp/voice-worker.sock}"
+
+if [ "${VOICE_WORKER_ENABLED:-1}" = "1" ]; then
+  (
+    while true; do
+      python /app/python/worker.py --socket "$VOICE_WORKER_SOCKET"
+      echo "Voice worker exited with status $?, restarting in 5s" >&2
+      sleep 5
+    done
+  ) &
+else
+  unset VOICE_WORKER_SOCKET
+fi
+
+exec node -r dotenv/config dist/index.js